@@ -1,16 +1,17 @@
 import os
 import re
 import random
+import time
 from dotenv import load_dotenv
 load_dotenv()
 import streamlit as st
-from colearner import chatbot
-from colearner.utils import create_folder, save_file, get_file_hash, all_items_exist
-from colearner.pdf_loader import load_pdf 
-from colearner.rag import configure_retriever
-from colearner.chatbot import Context_with_History_Chatbot
-from colearner.unstructured_loader import load_unstructured_file   
-from colearner.notion_loader import NotionLoader
+from concurrent.futures import ThreadPoolExecutor
+# only light modules are imported before the page renders, langchain and chromadb are loaded where they are used
+from colearner.utils import get_file_hash
+from colearner.blob_store import BlobStore
+from colearner.chunk_diff import get_source_key
+from colearner.jobs import IngestionQueue, DONE, FAILED
+from colearner.metrics import start_metrics_server
 
 debug = True
 if debug:
@@ -32,21 +33,61 @@ with open("style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
     
     
+# ------------------------ metrics --------------------------
+
+if os.getenv("METRICS_PORT"):
+    start_metrics_server(int(os.getenv("METRICS_PORT")))        # once per process, Prometheus text on /metrics
+
+    
 # --------------------- session states -----------------------
 
-if "retriever" not in st.session_state:                                          
-    print("=======   ...Configuring retriever after app restart...   =======", '\n') 
-    st.session_state.retriever = configure_retriever(update=False)              
+@st.cache_resource
+def start_retriever_build():
+    """ Build the retriever (embedding model, chromaDB client) in a background thread once per server, so the page renders first. """
+    def build():
+        from colearner.rag import get_retriever
+        print("=======   ...Configuring retriever after app restart...   =======", '\n') 
+        return get_retriever()
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="retriever").submit(build)
+
+def get_retriever():
+    """ The retriever of this session, waiting for the background build if it is not done yet. """
+    if "retriever" not in st.session_state:
+        try:
+            st.session_state.retriever = start_retriever_build().result()
+        except Exception:
+            start_retriever_build.clear()                       # build again on the next run instead of caching the failure
+            raise
+    return st.session_state.retriever
 
-# raw doc ids from the vectorstore, e.g., 'hash-0', 'hash-1', 'hash-2'                                                      #TODO: is session state the best way to store these values?
-st.session_state.doc_ids = list(set([id.split('-')[0] for id in st.session_state.retriever.vectorstore.get()['ids']]))
+if "retriever" not in st.session_state and start_retriever_build().done():
+    try:
+        get_retriever()
+    except Exception as e:
+        st.error(f"Could not load the knowledge base, retrying on the next run: {e}")
 
-# doc names from the vectorstore, duplication due to multiple docs of the same document                             
-st.session_state.doc_names = [st.session_state.retriever.vectorstore.get(id+'-0')['metadatas'][0]['source'].split('/')[-1] 
-                                for id in st.session_state.doc_ids]
+if "retriever" in st.session_state:
+    # raw doc ids from the vectorstore, e.g., 'hash-0', 'hash-1', 'hash-2'                                                  #TODO: is session state the best way to store these values?
+    st.session_state.doc_ids = list(set([id.split('-')[0] for id in st.session_state.retriever.vectorstore.get()['ids']]))
+
+    # doc names from the vectorstore, taken from the first stored split of each document (split 0 may be dropped as a duplicate)
+    stored_docs = st.session_state.retriever.vectorstore.get(include=['metadatas'])
+    first_metadatas = {}
+    for id, metadata in zip(stored_docs['ids'], stored_docs['metadatas']):
+        first_metadatas.setdefault(id.split('-')[0], metadata)
+    st.session_state.doc_names = [(first_metadatas[id] or {}).get('source', id).split('/')[-1] for id in st.session_state.doc_ids]
+else:
+    st.session_state.doc_ids, st.session_state.doc_names = [], []              # listed once the retriever is built
 
 if 'checkboxes' not in st.session_state:
-    st.session_state.checkboxes = [True] * len(st.session_state.doc_ids)
+    st.session_state.checkboxes = []
+
+# documents ingested in the background since the last run are selected by default
+if len(st.session_state.checkboxes) < len(st.session_state.doc_ids):
+    st.session_state.checkboxes += [True] * (len(st.session_state.doc_ids) - len(st.session_state.checkboxes))
+
+if 'notion_submitted' not in st.session_state:
+    st.session_state.notion_submitted = set()
 
 if 'file_uploader_key' not in st.session_state:
     st.session_state.file_uploader_key = 'default'
@@ -54,6 +95,13 @@ if 'file_uploader_key' not in st.session_state:
 if 'notion_data_uploaded' not in st.session_state:
     st.session_state.notion_data_uploaded = False
 
+# ------------------ background ingestion --------------------
+
+@st.cache_resource
+def get_ingestion_queue():
+    """ One ingestion queue and its worker threads for the whole server, shared by all sessions. """
+    return IngestionQueue().start()
+
 # -------------- functions to manage session states -------------
 
 def reset_file_uploader():
@@ -72,7 +120,15 @@ def delete_document(delete_index):
     ids_to_delete = [id for id in all_ids if re.match(pattern, id)]
     
     if ids_to_delete:
+        from colearner.dedup import get_dedup_index
+        from colearner.embeddings import get_collection_name
         st.session_state.retriever.vectorstore.delete(ids=ids_to_delete)
+        dedup_index = get_dedup_index(get_collection_name())
+        orphans = dedup_index.remove(ids_to_delete)
+        dedup_index.save()
+        if orphans:
+            print(f"{len(orphans)} dropped duplicate splits of other documents lost their stored copy, syncing them again.")
+            get_ingestion_queue().resync_orphans(orphans)
         print(f"Deleted {len(ids_to_delete)} documents matching the pattern: {pattern}")
     else:
         print(f"No documents found matching the pattern: {pattern}")
@@ -119,8 +175,12 @@ expand = st.sidebar.expander("📖 Notion",
                                 expanded=False) 
 expand.write("Share link of the Notion document. Instructions: link to the instruction page.")
 if notion_id := expand.text_input(label = "Notion share link url", label_visibility='collapsed', key='notion_id'):
-    loader = NotionLoader(page_url=notion_id)
+    if st.session_state.get('notion_loader') is None or st.session_state.notion_loader.page_url != notion_id:
+        from colearner.notion_loader import NotionLoader
+        st.session_state.notion_loader = NotionLoader(page_url=notion_id)            # one loader per link, reruns reuse it
+    loader = st.session_state.notion_loader
     st.session_state.notion_data_uploaded = True
+    notion_resync = expand.button("🔄 Sync changes")                                  # re-ingest only the chunks changed in Notion
     
       
 # ------------------------------------------------------------
@@ -176,106 +236,100 @@ if button_col3.button('Remove'):
 # ------------------------------------------------------------       
          
 # ---------------------- Uploaded files -----------------------
+
+if (uploaded_files or st.session_state.notion_data_uploaded) and "retriever" not in st.session_state:
+    get_retriever()                                                                    # new documents are compared with the stored ones,
+    st.rerun()                                                                         # so wait for the vectorDB and list them first
    
 if uploaded_files:                                                                                             
-    # based on the file type, save the file and update the retriever
-    save_file_dir = os.getenv('DATA_DIR') + "uploaded_files/"
-    create_folder(save_file_dir)  
-    
-    new_file_hashes = [get_file_hash(file) for file in uploaded_files]     
-    new_file_names = [file.name for file in uploaded_files]      
+    # save the files and queue them for parsing, embedding and storing in the background
+    blob_store = BlobStore()                                                           # files are stored by content hash
+    ingestion_queue = get_ingestion_queue()
     reset_file_uploader()                                                              # Reset the file uploader to avoid reprocessing 
     
-    if all_items_exist(new_file_hashes, st.session_state.doc_ids):                     # If none of the uploaded files are new, skip all processing         
-        print("Duplicated upload detected. Skipping the processing.",'\n')           
-
-    else:                                                                              # For non-duplicated new file, process it as follows: 
-        print("Some of the uploaded files are not in VectorDB. Processing...",'\n')        
-                                                                                                                                      
-        for file, new_file_hash, new_file_name in zip(uploaded_files, new_file_hashes, new_file_names):    
-            if new_file_hash not in st.session_state.doc_ids:                          # If the new file is already in the vectorDB, skip it               
-                file_path = save_file_dir + new_file_name                               
-                save_file(file, file_path)                                                         # 1. save the file locally
-
-                if file_path.endswith('.pdf'):                                                     # 2. load the new PDF as langchain document 
-                    new_pdf_doc = load_pdf(file_path)     
-                else:                                            
-                    new_pdf_doc = load_unstructured_file(file_path)                                #TODO: slow for loading single file, change logic to multi-file
-                                          
-                try:
-                    st.session_state.retriever = configure_retriever(                              # 3. update the ChromaDB and retriever 
-                                                        doc_hash = new_file_hash,                 
-                                                        docs = new_pdf_doc, 
-                                                        update=True)
-                except Exception as e:
-                    print("Error occurred when updating the retriever with the new PDF.")
-                    print(e)                                                                       
-                    
-                st.session_state.doc_ids.append(new_file_hash)                                     # 4. update the session states                    
-                st.session_state.checkboxes.append(True)
-                st.session_state.doc_names.append(new_file_name)
-                
-                print("=======    Updating checkbox UI   =======")
-                print(f"There are {len(st.session_state.checkboxes)} checkboxes.")    
-                print("Their ids are: ", st.session_state.doc_ids)        
-                print("Their names are: ", st.session_state.doc_names)       
-                
-                k = len(st.session_state.checkboxes)                        
-                print(f"Created the new {k}th checkbox.")
-                checkbox_col1.checkbox(key=new_file_hash,                                          # 5. update the checkbox UI                
-                                    label=new_file_name, 
-                                    value=True)          
-                if checkbox_col2.button("✖", key=f"delete_{k}", type='primary'):                                                                          
-                    delete_document(k)
-                    st.rerun()                                         
+    def is_unchanged(doc_id, file_hash):
+        """ True if the same version of the file is already in the vectorDB. """
+        if file_hash in st.session_state.doc_ids:                                      # documents ingested with positional ids
+            return True
+        stored = st.session_state.retriever.vectorstore.get(where={"doc_id": doc_id}, limit=1, include=['metadatas'])
+        return bool(stored['ids']) and stored['metadatas'][0].get('doc_hash') == file_hash
+    
+    for file in uploaded_files:
+        new_file_hash = get_file_hash(file)
+        new_doc_id = get_source_key(file.name)                                         # documents are identified by their file name
+        
+        if is_unchanged(new_doc_id, new_file_hash):                                    # If the same file version is already in the vectorDB, skip it
+            print(f"Duplicated upload detected: {file.name}. Skipping the processing.",'\n')
+            continue
+        
+        _, file_path = blob_store.put(file, file.name, file_hash=new_file_hash)       # 1. save the file locally
+        ingestion_queue.submit(kind='file', source_id=file.name, name=file.name,       # 2. parse, embed and store it in the background, 
+                               payload={'file_path': file_path, 'file_hash': new_file_hash})  # diffing it against the stored version
+        print(f"Queued {file.name} for ingestion.",'\n')
                     
                     
 # ----------------------- Notion API ------------------------
                     
 if st.session_state.notion_data_uploaded:
-    new_file_hash = loader.page_id
-    new_file_name = loader.page_name+'.txt'
+    new_doc_id = get_source_key(loader.page_id)                                       # documents are identified by their page id
     
-    if new_file_hash in st.session_state.doc_ids:                                # If the new file is already in the vectorDB, skip it
+    if (new_doc_id in st.session_state.doc_ids or loader.page_id in st.session_state.notion_submitted) and not notion_resync:
         print("Duplicated notion document detected. Skipping the processing.",'\n')
     else:                         
-        new_pdf_doc = loader.load()                                                        # 2. load the new PDF as langchain document 
-        print(new_pdf_doc)
-        try:
-            st.session_state.retriever = configure_retriever(                              # 3. update the ChromaDB and retriever 
-                                                doc_hash = new_file_hash,                 
-                                                docs = new_pdf_doc, 
-                                                update=True)
-        except Exception as e:
-            print("Error occurred when updating the retriever with the new PDF.")
-            print(e)                                                                       
-            
-        st.session_state.doc_ids.append(new_file_hash)                                     # 4. update the session states                    
-        st.session_state.checkboxes.append(True)
-        st.session_state.doc_names.append(new_file_name)
-        
-        print("=======    Updating checkbox UI   =======")
-        print(f"There are {len(st.session_state.checkboxes)} checkboxes.")    
-        print("Their ids are: ", st.session_state.doc_ids)        
-        print("Their names are: ", st.session_state.doc_names)       
-        
-        k = len(st.session_state.checkboxes)                        
-        print(f"Created the new {k}th checkbox.")
-        checkbox_col1.checkbox(key=new_file_hash,                                          # 5. update the checkbox UI                
-                            label=new_file_name, 
-                            value=True)          
-        if checkbox_col2.button("✖", key=f"delete_{k}", type='primary'):                                                                          
-            delete_document(k)
-            st.rerun()    
+        get_ingestion_queue().submit(kind='notion', source_id=loader.page_id, name=loader.page_name+'.txt', 
+                                     payload={'page_url': loader.page_url})
+        st.session_state.notion_submitted.add(loader.page_id)
                                               
 
+# ------------------------ ingestion jobs UI ------------------------
+
+@st.experimental_fragment(run_every=2)
+def show_ingestion_jobs():
+    """ Progress of background ingestion jobs, refreshed without rerunning the app or interrupting the chat. """
+    jobs = get_ingestion_queue().list_jobs(limit=10)
+    active_jobs = [job for job in jobs if job.is_active]
+    failed_jobs = [job for job in jobs if job.state == FAILED and job.updated_at > st.session_state.get('app_started', 0)]
+    
+    if active_jobs or failed_jobs:
+        st.write("⏳ Ingestion jobs")
+    for job in active_jobs:
+        progress_col, cancel_col = st.columns([0.8, 0.2], vertical_alignment='center')
+        progress_col.progress(job.progress, text=f"{job.name}: {job.message or job.state}")
+        if cancel_col.button("✖", key=f"cancel_{job.id}", help="Cancel ingestion"):
+            get_ingestion_queue().cancel(job.id)
+    for job in failed_jobs:
+        st.error(f"{job.name}: {job.error}")
+    
+    # rerun the whole app when a job finished, to list the new document
+    finished = {job.id for job in jobs if job.state == DONE}
+    if finished - st.session_state.finished_jobs:
+        st.session_state.finished_jobs |= finished
+        st.rerun()
+
+if 'app_started' not in st.session_state:
+    st.session_state.app_started = time.time()
+    st.session_state.finished_jobs = {job.id for job in get_ingestion_queue().list_jobs(states=[DONE])}
+
+with st.sidebar:
+    show_ingestion_jobs()
+
+
 # ------------------------------------------------------------
 #
 #               Create Chatbot and RAG chain
 #
 # ------------------------------------------------------------     
  
+from colearner.chatbot import Context_with_History_Chatbot
+
 chatbot = Context_with_History_Chatbot(model = "gpt-3.5-turbo")
+
+if "retriever" not in st.session_state:
+    # the page is rendered: wait for the background build, then rerun to list the documents and enable the chat
+    st.chat_input(placeholder="Loading your documents...", disabled=True)
+    get_retriever()
+    st.rerun()
+
 final_chain = chatbot.get_qa_chain(st.session_state.retriever)
 
 
@@ -0,0 +1,170 @@
+"""
+Concurrent chat load test of the QA chain (rephrase, retrieve, generate) against the local OpenAI stub.
+
+    python -m benchmarks.chat_load --concurrency 1 4 16 --turns 3
+    python -m benchmarks.chat_load --base-url http://127.0.0.1:8001/v1     # a stub (or API) started separately
+
+Each simulated user is a thread with its own chat history that sends `turns` questions in a row, so every turn after
+the first makes two LLM calls. The chat model and the embeddings are built as in the app (rate_limited_chat_openai
+and the "openai" embedding provider), so requests go through the shared rate limiter and its retries to the stub.
+For every concurrency level the report has p50/p95/p99 time to first answer token and full answer latency,
+and throughput in turns and answer tokens per second.
+"""
+
+import os
+import json
+import time
+import tempfile
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fakes import make_pdf_pages
+from benchmarks.openai_stub import StubConfig, start_openai_stub
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(samples)), "max": float(max(samples))}
+
+
+@contextmanager
+def _openai_environment(base_url: str):
+    """ Point the OpenAI clients built inside the block at base_url, as OPENAI_BASE_URL does in the app. """
+    saved = {name: os.environ.get(name) for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def build_retriever(base_url: str, data_dir: str, num_pages: int = 200):
+    """ Chroma retriever over a synthetic corpus, embedded by the app's OpenAI embeddings through the stub. """
+    import chromadb
+    from langchain_chroma import Chroma
+    from colearner.embeddings import EMBEDDING_PROVIDERS
+    from colearner.rag import split_documents, get_retriever
+
+    with _openai_environment(base_url):
+        embeddings = EMBEDDING_PROVIDERS["openai"]()         # not the cached instance, which may point at another API
+    embeddings.embeddings.check_embedding_ctx_length = False  # the stub needs no token ids, and no tiktoken download
+    vectordb = Chroma(client=chromadb.PersistentClient(path=os.path.join(data_dir, "chromadb")),
+                      collection_name="chat_load", embedding_function=embeddings)
+    pages, queries = make_pdf_pages(num_pages)
+    vectordb.add_documents(split_documents(pages))
+    return get_retriever(vectordb), [query for query, _ in queries]
+
+
+def _run_session(chain, questions: List[str], session_id: str, results: List[Dict[str, Any]], lock: threading.Lock) -> None:
+    for question in questions:
+        start = time.perf_counter()
+        first_token, tokens, error = None, 0, None
+        try:
+            for chunk in chain.stream({"input": question}, config={"configurable": {"session_id": session_id}}):
+                if chunk.get("answer"):
+                    tokens += 1
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        with lock:
+            results.append({"ttft": first_token, "latency": time.perf_counter() - start, "tokens": tokens, "error": error})
+
+
+def run_level(retriever, questions: List[str], base_url: str, concurrency: int, turns: int) -> Dict[str, Any]:
+    """ Run `concurrency` simultaneous sessions of `turns` questions each and summarize the turns. """
+    from langchain_community.chat_message_histories import ChatMessageHistory
+    from colearner.chatbot import Context_with_History_Chatbot
+    from colearner.metrics import registry
+    from colearner.rate_limit import get_rate_limiter, rate_limited_chat_openai
+
+    registry.reset()
+    llm = rate_limited_chat_openai(model="gpt-3.5-turbo", temperature=0, base_url=base_url,
+                                   api_key=os.getenv("OPENAI_API_KEY", "stub"))
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    threads = []
+    for user in range(concurrency):
+        chain = Context_with_History_Chatbot(llm=llm, msgs=ChatMessageHistory()).get_qa_chain(retriever)
+        user_questions = [questions[(user * turns + turn) % len(questions)] for turn in range(turns)]
+        threads.append(threading.Thread(target=_run_session, args=(chain, user_questions, f"user-{user}", results, lock)))
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    ok = [r for r in results if r["error"] is None]
+    return {"concurrency": concurrency, "turns": len(results), "errors": len(results) - len(ok),
+            "error_examples": sorted({r["error"] for r in results if r["error"]})[:3],
+            "wall_time": wall_time,
+            "ttft": _percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+            "latency": _percentiles([r["latency"] for r in ok]),
+            "turns_per_second": len(ok) / wall_time,
+            "tokens_per_second": sum(r["tokens"] for r in ok) / wall_time,
+            "stages": registry.summary(),
+            "rate_limit": get_rate_limiter().report()}
+
+
+def run(concurrency_levels: List[int], turns: int = 3, base_url: Optional[str] = None,
+        stub_config: Optional[StubConfig] = None, num_pages: int = 200) -> Dict[str, Any]:
+    """ Load test at growing concurrency, with a stub started here unless base_url is given. """
+    server = None if base_url else start_openai_stub(stub_config or StubConfig())
+    base_url = base_url or server.base_url
+    try:
+        with tempfile.TemporaryDirectory(prefix="colearner-chat-load-") as data_dir:
+            retriever, questions = build_retriever(base_url, data_dir, num_pages)
+            levels = []
+            for concurrency in concurrency_levels:
+                level = run_level(retriever, questions, base_url, concurrency, turns)
+                levels.append(level)
+                print(f"concurrency={concurrency:<4} turns={level['turns']:<5} errors={level['errors']:<3} "
+                      f"ttft p50={level['ttft'].get('p50', 0):.3f}s p95={level['ttft'].get('p95', 0):.3f}s "
+                      f"p99={level['ttft'].get('p99', 0):.3f}s  latency p50={level['latency'].get('p50', 0):.3f}s "
+                      f"p95={level['latency'].get('p95', 0):.3f}s  {level['turns_per_second']:.2f} turns/s "
+                      f"{level['tokens_per_second']:.1f} tokens/s")
+    finally:
+        if server is not None:
+            server.shutdown()
+    config = stub_config or StubConfig()
+    return {"meta": {"base_url": base_url, "turns_per_user": turns, "pages": num_pages, "timestamp": time.time(),
+                     "stub": None if server is None else vars(config)},
+            "levels": levels}
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Concurrent chat load test of the QA chain.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="simultaneous users per level")
+    parser.add_argument("--turns", type=int, default=3, help="questions per user")
+    parser.add_argument("--pages", type=int, default=200, help="pages of the synthetic corpus")
+    parser.add_argument("--base-url", help="OpenAI-compatible API to test instead of a local stub")
+    parser.add_argument("--first-token-latency", type=float, default=StubConfig.first_token_latency)
+    parser.add_argument("--tokens-per-second", type=float, default=StubConfig.tokens_per_second)
+    parser.add_argument("--answer-tokens", type=int, default=StubConfig.answer_tokens)
+    parser.add_argument("--embedding-latency", type=float, default=StubConfig.embedding_latency)
+    parser.add_argument("--output", default="chat_load_output.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    stub_config = StubConfig(args.first_token_latency, args.tokens_per_second, args.answer_tokens, args.embedding_latency)
+    report = run(args.concurrency, args.turns, args.base_url, stub_config, args.pages)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Offline stand-ins for the models and APIs used by the pipeline: a bag-of-words embedding model that makes
+retrieval recall meaningful without a network, a fake chat model, synthetic corpora and a Notion API stub.
+"""
+
+import re
+import json
+import zlib
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from colearner.embeddings import register_provider
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: words are hashed into `size` dimensions with a random sign, and the
+    vector is l2-normalized. Texts sharing rare words end up close, so retrieval recall can be measured offline.
+    """
+
+    def __init__(self, size: int = 2048) -> None:
+        self.size = size
+        self.calls = 0                                           # number of embedded texts
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.size] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+@register_provider("hashing")
+def _hashing_embeddings() -> Embeddings:
+    return HashingEmbeddings()
+
+
+def fake_chat_model(answer: str = "The answer is in your notes.", rephrased: str = "standalone question"):
+    """ Chat model that alternates between a rephrased question and an answer, streamed character by character. """
+    from langchain_core.language_models import FakeListChatModel
+    return FakeListChatModel(responses=[rephrased, answer])
+
+
+# ------------------------------------------------------------
+#                      Synthetic corpora
+# ------------------------------------------------------------
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def make_pdf_pages(num_pages: int, words_per_page: int = 250, seed: int = 0) -> Tuple[List[Document], List[Tuple[str, str]]]:
+    """
+    PDF-like pages of filler text from a shared vocabulary. Every page states one fact made of rare words,
+    so a query for the fact has exactly one relevant chunk.
+
+    Returns:
+        (pages, queries) where queries are (query, fact sentence) pairs, one per page.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(2000, seed)
+    pages, queries = [], []
+    for page in range(num_pages):
+        words = [rng.choice(vocabulary) for _ in range(words_per_page)]
+        key_words = [f"k{page}x{i}{rng.randint(0, 10 ** 6)}" for i in range(5)]
+        fact = f"The key words of page {page} are {' '.join(key_words)}."
+        position = rng.randint(0, len(words))
+        text = " ".join(words[:position]) + " " + fact + " " + " ".join(words[position:])
+        pages.append(Document(page_content=text, metadata={"source": "synthetic.pdf", "page": page}))
+        queries.append((f"What about {' '.join(key_words)}?", fact))
+    return pages, queries
+
+
+def _block_id(path: str) -> str:
+    return hashlib.md5(path.encode("utf-8")).hexdigest()
+
+
+class NotionTree:
+    """
+    Synthetic Notion page tree: every page has `paragraphs` paragraph blocks and `fanout` child pages,
+    down to `depth` levels. Block ids are hex strings like real Notion ids.
+    """
+
+    def __init__(self, depth: int = 3, fanout: int = 3, paragraphs: int = 10, seed: int = 0) -> None:
+        self.root_id = _block_id("root")
+        self.children: Dict[str, List[Dict]] = {}
+        rng = random.Random(seed)
+        vocabulary = make_vocabulary(500, seed)
+        self._build(self.root_id, "root", depth, fanout, paragraphs, rng, vocabulary)
+
+    def _build(self, page_id, path, depth, fanout, paragraphs, rng, vocabulary) -> None:
+        blocks = []
+        for i in range(paragraphs):
+            text = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(10, 60)))
+            blocks.append({"id": _block_id(f"{path}/p{i}"), "type": "paragraph", "has_children": False,
+                           "paragraph": {"rich_text": [{"plain_text": text}]}})
+        if depth > 0:
+            for i in range(fanout):
+                child_path = f"{path}/c{i}"
+                child_id = _block_id(child_path)
+                blocks.append({"id": child_id, "type": "child_page", "has_children": True,
+                               "child_page": {"title": f"Page {child_path}"}})
+                self._build(child_id, child_path, depth - 1, fanout, paragraphs, rng, vocabulary)
+        self.children[page_id] = blocks
+
+    @property
+    def num_blocks(self) -> int:
+        return sum(len(blocks) for blocks in self.children.values())
+
+    @property
+    def page_url(self) -> str:
+        return f"https://www.notion.so/Synthetic-notes-{self.root_id}?pvs=4"
+
+
+def start_notion_stub(tree: NotionTree, latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Serve a NotionTree on a local port with the endpoints NotionLoader uses (GET /pages/<id> and
+    GET /blocks/<id>/children). Point NOTION_API_BASE_URL at http://127.0.0.1:<port>.
+    """
+    import time
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            parts = self.path.strip("/").split("/")
+            if parts[0] == "pages" and len(parts) == 2:
+                body = {"id": parts[1], "last_edited_time": "2024-01-01T00:00:00.000Z",
+                        "properties": {"title": {"type": "title", "title": [{"plain_text": "Synthetic notes"}]}}}
+            elif parts[0] == "blocks" and len(parts) == 3 and parts[1] in tree.children:
+                body = {"object": "list", "results": tree.children[parts[1]], "has_more": False}
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="notion-stub", daemon=True).start()
+    return server
@@ -0,0 +1,164 @@
+"""
+Local OpenAI-compatible API stub for load tests: chat completions (plain and streamed as server-sent events)
+and embeddings, with configurable latency and token rate. No API key or network needed.
+
+    python -m benchmarks.openai_stub --port 8001 --first-token-latency 0.3 --tokens-per-second 40
+
+Point the clients at it with base_url="http://127.0.0.1:8001/v1" (or OPENAI_BASE_URL) and any api key.
+"""
+
+import json
+import time
+import uuid
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from benchmarks.fakes import HashingEmbeddings
+
+
+@dataclass
+class StubConfig:
+    first_token_latency: float = 0.2              # seconds before the first token of a chat completion
+    tokens_per_second: float = 50.0               # streaming rate of the following tokens, 0 for no delay
+    answer_tokens: int = 40                       # tokens of an answer
+    embedding_latency: float = 0.05               # seconds per embeddings request
+    embedding_size: int = 256
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig) -> None:
+        super().__init__(address, _Handler)
+        self.config = config
+        self.embeddings = HashingEmbeddings(size=config.embedding_size)
+        self.lock = threading.Lock()
+        self.requests = {"chat": 0, "embeddings": 0}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+
+def _completion_tokens(messages: List[Dict[str, Any]], config: StubConfig) -> List[str]:
+    """ Rephrasing requests echo the last user message, other requests get an answer of answer_tokens tokens. """
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "standalone question" in system:
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        return [word + " " for word in question.split()] or ["?"]
+    return [f"token{i} " for i in range(config.answer_tokens)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: _StubServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body: Dict[str, Any], status: int = 200) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/v1/chat/completions":
+            self._chat(request)
+        elif self.path == "/v1/embeddings":
+            self._embeddings(request)
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def _embeddings(self, request: Dict[str, Any]) -> None:
+        config = self.server.config
+        with self.server.lock:
+            self.server.requests["embeddings"] += 1
+        texts = request.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        if texts and not isinstance(texts[0], str):                        # token ids
+            texts = [" ".join(map(str, tokens)) for tokens in texts]
+        time.sleep(config.embedding_latency)
+        data = [{"object": "embedding", "index": i, "embedding": embedding}
+                for i, embedding in enumerate(self.server.embeddings.embed_documents(texts))]
+        tokens = sum(len(text.split()) for text in texts)
+        self._send_json({"object": "list", "data": data, "model": request.get("model", "stub"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _chat(self, request: Dict[str, Any]) -> None:
+        config = self.server.config
+        with self.server.lock:
+            self.server.requests["chat"] += 1
+        tokens = _completion_tokens(request.get("messages", []), config)
+        completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), request.get("model", "stub")
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second else 0.0
+        time.sleep(config.first_token_latency)
+
+        if not request.get("stream"):
+            time.sleep(interval * (len(tokens) - 1))
+            self._send_json({"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": "".join(tokens).strip()}}],
+                             "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(delta: Dict[str, Any], finish_reason=None) -> None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(interval)
+            send({"role": "assistant", "content": token} if i == 0 else {"content": token})
+        send({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_openai_stub(config: StubConfig = None, host: str = "127.0.0.1", port: int = 0) -> _StubServer:
+    """ Start the stub in a daemon thread. Its base_url attribute is the API base for the OpenAI clients. """
+    server = _StubServer((host, port), config or StubConfig())
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible API stub with configurable latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-latency", type=float, default=StubConfig.first_token_latency)
+    parser.add_argument("--tokens-per-second", type=float, default=StubConfig.tokens_per_second)
+    parser.add_argument("--answer-tokens", type=int, default=StubConfig.answer_tokens)
+    parser.add_argument("--embedding-latency", type=float, default=StubConfig.embedding_latency)
+    parser.add_argument("--embedding-size", type=int, default=StubConfig.embedding_size)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.first_token_latency, args.tokens_per_second, args.answer_tokens,
+                        args.embedding_latency, args.embedding_size)
+    server = _StubServer((args.host, args.port), config)
+    print(f"OpenAI stub serving on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Offline benchmarks of the ingestion and retrieval hot paths. No network is used: embeddings come from a
+bag-of-words hashing model, the LLM is a fake chat model and Notion pages are served by a local stub.
+
+    python -m benchmarks.run                                   # default sizes
+    python -m benchmarks.run --sizes 100 1000 --output bench.json
+    python -m benchmarks.run --only retrieval ingest
+
+Every benchmark runs in a fresh temporary DATA_DIR. Token counts use one tokenizer for the whole run, the
+characters/4 estimate by default, so chunk counts and timings compare across hosts. Results, with the per-stage
+timings of the metrics registry and the tokenizer, are written as JSON to compare commits.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.fakes import NotionTree, fake_chat_model, make_pdf_pages, start_notion_stub
+
+
+def _timings(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {"min": samples[0], "median": statistics.median(samples), "mean": statistics.fmean(samples),
+            "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))], "runs": len(samples)}
+
+
+def _repeat(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return _timings(samples)
+
+
+@contextmanager
+def offline_environment(**env):
+    """ Fresh DATA_DIR and offline providers for one benchmark, restoring the environment afterwards. """
+    from colearner.metrics import registry
+
+    old = {key: os.environ.get(key) for key in ["DATA_DIR", "EMBEDDING_MODEL", *env]}
+    with tempfile.TemporaryDirectory(prefix="colearner-bench-") as data_dir:
+        os.environ.update({"DATA_DIR": data_dir, "EMBEDDING_MODEL": "hashing", **env})
+        registry.reset()
+        try:
+            yield data_dir
+        finally:
+            for key, value in old.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+
+@contextmanager
+def pinned_tokenizer(encoding: str = "estimate"):
+    """
+    Count tokens with `encoding` in every benchmark: the characters/4 estimate (no network), or a tiktoken encoding,
+    to cache beforehand with `python -m colearner.tokenizer download`. The encoding is loaded once, from the host's
+    TIKTOKEN_CACHE_DIR rather than a temporary DATA_DIR, and a run fails instead of falling back to the estimate.
+    """
+    from colearner import tokenizer
+
+    keys = ["TOKENIZER_ENCODING", "TOKENIZER_STRICT", "TIKTOKEN_CACHE_DIR"]
+    old = {key: os.environ.get(key) for key in keys}
+    os.environ.update({"TOKENIZER_ENCODING": encoding, "TOKENIZER_STRICT": "true",
+                       "TIKTOKEN_CACHE_DIR": tokenizer.get_tiktoken_cache_dir()})   # not under the temporary DATA_DIRs
+    tokenizer.reset_encoding()
+    try:
+        tokenizer.get_encoding()
+        yield encoding
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        tokenizer.reset_encoding()
+
+
+def _stages() -> Dict[str, Dict[str, float]]:
+    from colearner.metrics import registry
+    return registry.summary()
+
+
+# ------------------------------------------------------------
+#                         Benchmarks
+# ------------------------------------------------------------
+
+def bench_notion_load(depth: int, fanout: int = 3, paragraphs: int = 10, repeat: int = 3) -> Dict[str, Any]:
+    """ NotionLoader.load of a synthetic page tree served by the local stub. """
+    from colearner.notion_loader import NotionLoader
+
+    tree = NotionTree(depth=depth, fanout=fanout, paragraphs=paragraphs)
+    server = start_notion_stub(tree)
+    try:
+        with offline_environment(NOTION_API_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}", NOTION_API_KEY="stub"):
+            docs = []
+            timings = _repeat(lambda: docs.append(NotionLoader(page_url=tree.page_url).load()), repeat)
+            return {"benchmark": "notion_load", "size": tree.num_blocks, "pages": len(tree.children),
+                    "documents": len(docs[-1]), "seconds": timings, "stages": _stages()}
+    finally:
+        server.shutdown()
+
+
+def bench_split(num_pages: int, repeat: int = 3) -> Dict[str, Any]:
+    """ rag.split_documents of PDF-like pages. """
+    from colearner.rag import split_documents
+    from colearner.splitter import chunk_size_stats
+
+    pages, _ = make_pdf_pages(num_pages)
+    chunks = []
+    with offline_environment():
+        timings = _repeat(lambda: chunks.append(split_documents(pages)), repeat)
+    characters = sum(len(page.page_content) for page in pages)
+    return {"benchmark": "split", "size": num_pages, "chunks": len(chunks[-1]), "seconds": timings,
+            "chars_per_second": characters / timings["median"], "chunk_tokens": chunk_size_stats(chunks[-1])}
+
+
+def bench_ingest_and_retrieve(num_pages: int, num_queries: int = 50) -> List[Dict[str, Any]]:
+    """
+    configure_retriever ingestion of PDF-like pages (first ingestion, then an unchanged re-ingestion that
+    should embed nothing), followed by retrieval latency and recall of one fact per page.
+    """
+    from colearner.rag import configure_retriever
+    from colearner.embeddings import get_embedding_function
+
+    pages, queries = make_pdf_pages(num_pages)
+    with offline_environment():
+        embeddings = get_embedding_function()
+        calls_before = embeddings.calls
+
+        start = time.perf_counter()
+        retriever = configure_retriever(docs=pages, update=True, source_id="synthetic.pdf")
+        first = time.perf_counter() - start
+        embedded = embeddings.calls - calls_before
+
+        start = time.perf_counter()
+        configure_retriever(docs=pages, update=True, source_id="synthetic.pdf")
+        again = time.perf_counter() - start
+        chunks = retriever.vectorstore._collection.count()
+        ingest = {"benchmark": "ingest", "size": num_pages, "chunks": chunks, "embedded_chunks": embedded,
+                  "reembedded_chunks": embeddings.calls - calls_before - embedded,
+                  "seconds": {"first": first, "unchanged": again}, "chunks_per_second": chunks / first,
+                  "stages": _stages()}
+
+        step = max(1, len(queries) // num_queries)
+        samples, hits = [], 0
+        for query, fact in queries[::step][:num_queries]:
+            start = time.perf_counter()
+            docs = retriever.invoke(query)
+            samples.append(time.perf_counter() - start)
+            hits += any(fact in doc.page_content for doc in docs)
+        retrieval = {"benchmark": "retrieval", "size": num_pages, "chunks": chunks, "k": retriever.search_kwargs["k"],
+                     "queries": len(samples), "recall": hits / len(samples), "seconds": _timings(samples)}
+
+        qa = bench_qa_chain(retriever, num_turns=min(num_queries, 20))
+        qa["size"] = num_pages
+    return [ingest, retrieval, qa]
+
+
+def bench_qa_chain(retriever, num_turns: int = 20) -> Dict[str, Any]:
+    """ Multi-turn QA chain with the fake chat model: chain overhead of rephrase, retrieve and generate. """
+    from langchain_community.chat_message_histories import ChatMessageHistory
+    from colearner.chatbot import Context_with_History_Chatbot
+    from colearner.metrics import registry
+
+    registry.reset()
+    chatbot = Context_with_History_Chatbot(llm=fake_chat_model(), msgs=ChatMessageHistory())
+    chain = chatbot.get_qa_chain(retriever)
+    samples = []
+    for turn in range(num_turns):
+        start = time.perf_counter()
+        for _ in chain.stream({"input": f"question {turn}"}, config={"configurable": {"session_id": "bench"}}):
+            pass
+        samples.append(time.perf_counter() - start)
+    return {"benchmark": "qa_chain", "turns": num_turns, "seconds": _timings(samples), "stages": _stages()}
+
+
+# ------------------------------------------------------------
+#                            Runner
+# ------------------------------------------------------------
+
+BENCHMARKS = ["notion_load", "split", "ingest", "retrieval", "qa_chain"]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: List[int], notion_depths: List[int], only: Optional[List[str]] = None, repeat: int = 3,
+        num_queries: int = 50, tokenizer: str = "estimate") -> Dict[str, Any]:
+    only = set(only or BENCHMARKS)
+    results = []
+    with pinned_tokenizer(tokenizer):
+        for depth in notion_depths if "notion_load" in only else []:
+            results.append(bench_notion_load(depth, repeat=repeat))
+        for size in sizes:
+            if "split" in only:
+                results.append(bench_split(size, repeat=repeat))
+            if only & {"ingest", "retrieval", "qa_chain"}:
+                results += [r for r in bench_ingest_and_retrieve(size, num_queries) if r["benchmark"] in only]
+    for result in results:
+        print(f"{result['benchmark']:>12} size={result.get('size', '-'):<6} "
+              f"{json.dumps({k: v for k, v in result.items() if k not in ('benchmark', 'size', 'stages')}, default=str)}")
+    return {"meta": {"commit": _git_commit(), "timestamp": time.time(), "python": sys.version.split()[0],
+                     "platform": platform.platform(), "cpus": os.cpu_count(), "sizes": sizes,
+                     "notion_depths": notion_depths, "repeat": repeat, "tokenizer": tokenizer},
+            "results": results}
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of ingestion and retrieval.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="corpus sizes in pages")
+    parser.add_argument("--notion-depths", type=int, nargs="+", default=[2, 3], help="depths of the Notion page trees")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the repeated benchmarks")
+    parser.add_argument("--queries", type=int, default=50, help="retrieval queries per corpus size")
+    parser.add_argument("--tokenizer", default="estimate",
+                        help="token counts: 'estimate' (characters/4) or a cached tiktoken encoding, e.g. cl100k_base")
+    parser.add_argument("--output", default="bench_output.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.notion_depths, args.only, args.repeat, args.queries, args.tokenizer)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
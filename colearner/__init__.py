@@ -0,0 +1,21 @@
+"""
+CoLearner package. Submodules are imported on first attribute access (`colearner.rag`), so importing
+the package stays cheap and langchain, chromadb and the loaders are only loaded when they are used.
+"""
+
+import importlib
+
+_SUBMODULES = {
+    "blob_store", "chatbot", "chunk_diff", "compression", "dedup", "embeddings", "git_loader", "jobs", "metrics", "notion_loader",
+    "parse_worker", "pdf_loader", "rag", "rate_limit", "snapshot", "splitter", "startup", "tokenizer", "unstructured_loader", "unstructured_loader_docker", "utils", "website_loader",
+}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
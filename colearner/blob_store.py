@@ -0,0 +1,114 @@
+""" Content-addressed store of uploaded files under DATA_DIR, with a name -> hash index. """
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
+
+
+CHUNK_SIZE = 1 << 20
+
+
+def hash_stream(file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    MD5 of a file object without reading it into memory at once. In-memory files (BytesIO, Streamlit
+    UploadedFile) are hashed through a memoryview of their buffer, other files in chunks.
+    The file position is reset to the beginning.
+    """
+    hasher = hashlib.md5()
+    if hasattr(file, "getbuffer"):
+        with file.getbuffer() as view:
+            for start in range(0, len(view), chunk_size):
+                hasher.update(view[start:start + chunk_size])          # slicing a memoryview does not copy
+    else:
+        file.seek(0)
+        while chunk := file.read(chunk_size):
+            hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def atomic_write(file_path: str, file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+    """ Write a file object to file_path through a temporary file, so readers never see a partial file. """
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if hasattr(file, "getbuffer"):
+                with file.getbuffer() as view:
+                    f.write(view)
+            else:
+                file.seek(0)
+                while chunk := file.read(chunk_size):
+                    f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        file.seek(0)
+
+
+class BlobStore:
+    """
+    Uploaded files stored once per content under `root/blobs/<md5><extension>`, with an index from the
+    upload name to the hash in `root/index.json`. Uploading the same file under two names stores it once,
+    and two different files with the same name no longer overwrite each other: the name points to the latest.
+    """
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        self.root = root or os.path.join(os.getenv("DATA_DIR", "data"), "uploaded_files")
+        self.index_path = os.path.join(self.root, "index.json")
+        self._lock = threading.Lock()
+
+    def blob_path(self, file_hash: str, name: str = "") -> str:
+        """ Path of the blob; the extension of the name is kept so loaders can detect the file type. """
+        return os.path.join(self.root, "blobs", file_hash + os.path.splitext(name)[1].lower())
+
+    def read_index(self) -> Dict[str, str]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict[str, str]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def put(self, file: BinaryIO, name: str, file_hash: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Store an uploaded file, unless a blob with the same content exists, and point its name to it.
+
+        Args:
+            file: binary file object, e.g. Streamlit UploadedFile
+            name: upload file name
+            file_hash: md5 of the content, if it is already known
+        Returns:
+            (file hash, blob path)
+        """
+        file_hash = file_hash or hash_stream(file)
+        path = self.blob_path(file_hash, name)
+        if not os.path.exists(path):
+            atomic_write(path, file)
+
+        with self._lock:
+            index = self.read_index()
+            if index.get(name) != file_hash:
+                index[name] = file_hash
+                self._write_index(index)
+        return file_hash, path
+
+    def get_path(self, name: str) -> Optional[str]:
+        """ Blob path of the latest file uploaded with the given name, or None. """
+        file_hash = self.read_index().get(name)
+        return self.blob_path(file_hash, name) if file_hash else None
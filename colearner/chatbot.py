@@ -1,22 +1,101 @@
+import os
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory 
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.callbacks import BaseCallbackHandler
+from colearner.metrics import record, registry
+import time
+
+
+class StageTimingHandler(BaseCallbackHandler):
+    """
+    Langchain callback handler recording the stages of the QA chain as metrics spans:
+    'rephrase' (LLM call of the history aware retriever), 'retrieve' and 'generate' (LLM call answering
+    the question, until the last streamed token). Time to the first answer token is recorded as 'first_token'.
+    """
+
+    STAGE_OF_CHAIN = {"chat_retriever_chain": "rephrase", "retrieve_documents": "rephrase", "stuff_documents_chain": "generate"}
+
+    def __init__(self) -> None:
+        self.parents = {}                 # run id -> (run name, parent run id)
+        self.starts = {}                  # run id -> (stage, perf_counter start)
+        self.streaming = set()            # generate runs that already produced their first token
+
+    def _stage(self, parent_run_id):
+        while parent_run_id is not None:
+            name, parent_run_id = self.parents.get(parent_run_id, (None, None))
+            if name in self.STAGE_OF_CHAIN:
+                return self.STAGE_OF_CHAIN[name]
+        return "llm"
+
+    def _end(self, run_id, error=None):
+        self.streaming.discard(run_id)
+        if run_id in self.starts:
+            stage, start = self.starts.pop(run_id)
+            record(stage, time.perf_counter() - start, path=("chat", stage), error=error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self.parents[run_id] = (kwargs.get("name"), parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self.parents.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.parents.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self.starts[run_id] = (self._stage(parent_run_id), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self.starts[run_id] = (self._stage(parent_run_id), time.perf_counter())
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        stage, start = self.starts.get(run_id, (None, None))
+        if stage == "generate" and run_id not in self.streaming:
+            self.streaming.add(run_id)
+            registry.observe("first_token", time.perf_counter() - start)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self.starts.pop(parent_run_id, None)          # a wrapping retriever (compression) only times the vector search
+        self.starts[run_id] = ("retrieve", time.perf_counter())
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, type(error).__name__)
 
 
 class Context_with_History_Chatbot:
     """ Streamlit Chatbot with context and history-awareness """
 
-    def __init__(self, model = "gpt-3.5-turbo" ):
-        self.llm = ChatOpenAI(model=model, temperature=0) 
+    def __init__(self, model = "gpt-3.5-turbo", llm = None, msgs = None, base_url = None, context_token_budget = None):
+        """
+        llm and msgs default to a rate limited ChatOpenAI and the Streamlit chat history shown in the app. Pass another chat model
+        and a message history (e.g. ChatMessageHistory) to run the chain outside of Streamlit, in scripts and benchmarks.
+        base_url points the default ChatOpenAI at another OpenAI-compatible API, e.g. a local stub for load tests.
+        context_token_budget (default CONTEXT_TOKEN_BUDGET) compresses the retrieved context to this many tokens, 0 to disable.
+        """
+        if llm is None:
+            from colearner.rate_limit import rate_limited_chat_openai
+            llm = rate_limited_chat_openai(model=model, temperature=0, base_url=base_url)      # chat has priority over embedding
+        self.llm = llm
+        if context_token_budget is None:
+            context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 0))
+        self.context_token_budget = context_token_budget
         self.relevant_context = None 
-        # streamlit chat message history
-        self.msgs = StreamlitChatMessageHistory("chat_history")    
         self.avatars = {"human":"🤯", "ai":"🤖"}
-        self.display_Streamlit_chat_history()
+        if msgs is None:
+            from langchain_community.chat_message_histories import StreamlitChatMessageHistory 
+            # streamlit chat message history
+            self.msgs = StreamlitChatMessageHistory("chat_history")    
+            self.display_Streamlit_chat_history()
+        else:
+            self.msgs = msgs
 
     def display_Streamlit_chat_history(self):
         if len(self.msgs.messages) == 0:
@@ -27,6 +106,10 @@ class Context_with_History_Chatbot:
        
     def get_qa_chain(self, retriever):
         """ Get the question answering chain with chat history and context docs """
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+        from langchain_core.runnables.history import RunnableWithMessageHistory
 
         history_aware_retriever_system_prompt = """Given a chat history and the latest user question \
         which might reference context in the chat history, formulate a standalone question \
@@ -40,6 +123,10 @@ class Context_with_History_Chatbot:
                 ("human", "{input}"),
             ]
         )
+        if self.context_token_budget:
+            from colearner.compression import compress_retriever
+            retriever = compress_retriever(retriever, self.context_token_budget)          # keep relevant sentences only
+
         history_aware_retriever = create_history_aware_retriever(self.llm, 
                                                                  retriever, 
                                                                  contextualize_q_prompt)
@@ -68,7 +155,7 @@ class Context_with_History_Chatbot:
             input_messages_key="input",
             history_messages_key="chat_history",
             output_messages_key="answer",
-        )
+        ).with_config(callbacks=[StageTimingHandler()])              # time rephrase, retrieve and generate
         return final_chain
     
     def streaming_output(self, response):
@@ -0,0 +1,202 @@
+""" Chunk-level diffing of re-ingested documents, so only changed chunks are embedded again. """
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from colearner.metrics import span
+
+if TYPE_CHECKING:                                                 # keep get_source_key cheap to import
+    from langchain_core.documents import Document
+    from colearner.dedup import DedupReport
+
+
+@dataclass
+class ChunkDiff:
+    """ Chunk ids of a new document version compared to the stored version. """
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    orphans: List[str] = field(default_factory=list)          # dropped duplicates of other documents whose kept copy was removed
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.unchanged)} unchanged chunks"
+
+
+def get_source_key(source_id: str) -> str:
+    """ Stable document id from the source identity (file path/name or Notion page id). """
+    return hashlib.md5(source_id.encode("utf-8")).hexdigest()
+
+
+def get_chunk_id(source_key: str, chunk: "Document") -> str:
+    """ Chunk id made of the document id and the hash of the chunk content, independent of its position. """
+    return source_key + "-" + hashlib.md5(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+def get_chunk_ids(source_key: str, chunks: List["Document"]) -> Tuple[List[str], List["Document"]]:
+    """
+    Return content-hash ids for the chunks. Chunks with identical content within a document
+    share an id, so only the first one is kept.
+    """
+    ids, unique_chunks, seen = [], [], set()
+    for chunk in chunks:
+        chunk_id = get_chunk_id(source_key, chunk)
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            ids.append(chunk_id)
+            unique_chunks.append(chunk)
+    return ids, unique_chunks
+
+
+def diff_chunks(stored_ids: List[str], new_ids: List[str]) -> ChunkDiff:
+    """ Compare stored and new chunk ids, keeping the order of new_ids for added and unchanged chunks. """
+    stored = set(stored_ids)
+    new = set(new_ids)
+    return ChunkDiff(added=[i for i in new_ids if i not in stored],
+                     removed=[i for i in stored_ids if i not in new],
+                     unchanged=[i for i in new_ids if i in stored])
+
+
+@dataclass
+class SyncPlan:
+    """ Changes needed to bring the stored chunks of a document up to date, computed before anything is written. """
+    source_id: str
+    diff: ChunkDiff
+    added_ids: List[str] = field(default_factory=list)            # chunks to embed and store, after deduplication
+    added_chunks: List["Document"] = field(default_factory=list)
+    removed_ids: List[str] = field(default_factory=list)          # stored chunks to delete
+    moved: Dict[str, Dict] = field(default_factory=dict)          # unchanged chunk id -> new metadata
+    dedup_report: Optional["DedupReport"] = None
+
+
+def plan_document_sync(vectordb, source_id: str, chunks: List["Document"], dedup_index=None,
+                       extra_metadata: Optional[Dict] = None) -> SyncPlan:
+    """
+    Diff a new version of a document against its chunks in the vectorDB, without writing to the vectorDB.
+
+    Args:
+        vectordb: langchain Chroma vectorstore
+        source_id: identity of the document source, e.g. the file name or Notion page id
+        chunks: split documents of the new version
+        dedup_index: optional NearDuplicateIndex, added chunks are filtered with it. Kept chunks are added to
+                     the index right away, so call discard_document_sync if the plan is not applied.
+        extra_metadata: metadata added to every chunk, e.g. the file hash of the version
+    """
+    source_key = get_source_key(source_id)
+    ids, chunks = get_chunk_ids(source_key, chunks)
+    for chunk in chunks:
+        chunk.metadata = {**chunk.metadata, **(extra_metadata or {}), "doc_id": source_key, "source_id": source_id}
+
+    stored = vectordb.get(where={"doc_id": source_key}, include=["metadatas"])
+    stored_metadatas = dict(zip(stored["ids"], stored["metadatas"]))
+    chunks_by_id = dict(zip(ids, chunks))
+
+    if dedup_index is None:
+        diff = diff_chunks(stored["ids"], ids)
+        plan = SyncPlan(source_id, diff, added_ids=diff.added, added_chunks=[chunks_by_id[i] for i in diff.added])
+    else:
+        with span("dedup", chunks=len(ids)), dedup_index.lock:
+            # chunks dropped as duplicates are not stored, but they are still part of the last version
+            linked_ids = [i for i in dedup_index.links if i.startswith(source_key + "-")]
+            diff = diff_chunks(stored["ids"] + linked_ids, ids)
+            added_ids, added_chunks, report = dedup_index.filter_documents(
+                diff.added, [chunks_by_id[i] for i in diff.added], exclude=diff.removed)
+        plan = SyncPlan(source_id, diff, added_ids=added_ids, added_chunks=added_chunks, dedup_report=report)
+
+    plan.removed_ids = [i for i in diff.removed if i in stored_metadatas]
+    plan.moved = {i: chunks_by_id[i].metadata for i in diff.unchanged
+                  if i in stored_metadatas and stored_metadatas[i] != chunks_by_id[i].metadata}
+    return plan
+
+
+def apply_document_sync(vectordb, plan: SyncPlan, embeddings: Optional[List[List[float]]] = None,
+                        dedup_index=None, batch_size: int = 1000) -> List[str]:
+    """
+    Write a SyncPlan to the vectorDB. The added chunks are embedded first (unless their embeddings are given),
+    so nothing is written if embedding fails. Writes are upserts by content id, so applying the same plan
+    again after an interruption is safe.
+
+    Returns:
+        ids of chunks of other documents that were dropped as duplicates of a removed chunk, see
+        NearDuplicateIndex.remove. Their documents need to be synced again (IngestionQueue.resync_orphans).
+    """
+    if embeddings is None and plan.added_chunks:
+        with span("embed", chunks=len(plan.added_chunks)):
+            embeddings = vectordb.embeddings.embed_documents([chunk.page_content for chunk in plan.added_chunks])
+
+    with span("insert", added=len(plan.added_ids), removed=len(plan.removed_ids), moved=len(plan.moved)):
+        for start in range(0, len(plan.added_ids), batch_size):
+            end = start + batch_size
+            vectordb._collection.upsert(ids=plan.added_ids[start:end],
+                                        embeddings=embeddings[start:end],
+                                        documents=[chunk.page_content for chunk in plan.added_chunks[start:end]],
+                                        metadatas=[chunk.metadata for chunk in plan.added_chunks[start:end]])
+
+        if plan.removed_ids:
+            vectordb.delete(ids=plan.removed_ids)
+        if plan.moved:
+            vectordb._collection.update(ids=list(plan.moved), metadatas=list(plan.moved.values()))
+
+    orphans = []
+    if dedup_index is not None:
+        with dedup_index.lock:
+            orphans = dedup_index.remove(plan.diff.removed)
+            dedup_index.save()
+    return orphans
+
+
+def discard_document_sync(plan: SyncPlan, dedup_index=None) -> List[str]:
+    """
+    Undo the changes plan_document_sync made to the dedup index, for a plan that will not be applied.
+    Returns the orphaned duplicates of other documents, e.g. chunks of a concurrent job that were dropped
+    as duplicates of this plan's added chunks, see apply_document_sync.
+    """
+    if dedup_index is not None and plan.dedup_report is not None:
+        with dedup_index.lock:
+            return dedup_index.remove(plan.added_ids + list(plan.dedup_report.duplicates))
+    return []
+
+
+def sync_document_chunks(vectordb, source_id: str, chunks: List["Document"], dedup_index=None,
+                         extra_metadata: Optional[Dict] = None) -> ChunkDiff:
+    """
+    Bring the chunks of one document in the vectorDB up to date with a new version of the document.
+
+    Only added chunks are embedded, removed chunks are deleted and unchanged chunks are left in place,
+    apart from a metadata update when e.g. their page number moved.
+
+    Args: see plan_document_sync.
+    Returns:
+        ChunkDiff of the stored and new chunk ids, with the orphaned duplicates of other documents, which the
+        caller syncs again (IngestionQueue.resync_orphans).
+    """
+    plan = plan_document_sync(vectordb, source_id, chunks, dedup_index, extra_metadata)
+    if plan.dedup_report is not None:
+        print(plan.dedup_report)
+    try:
+        orphans = apply_document_sync(vectordb, plan, dedup_index=dedup_index)
+    except Exception:
+        discard_document_sync(plan, dedup_index)                  # the added chunks were not stored
+        raise
+
+    plan.diff.orphans = orphans
+    print(f"Synced {source_id}: {plan.diff}")
+    return plan.diff
+
+
+def remove_document_chunks(vectordb, source_id: str, dedup_index=None) -> ChunkDiff:
+    """
+    Delete all stored chunks of a document, e.g. a file removed from a git repository. Returns a ChunkDiff
+    of the deleted ids and of the orphaned duplicates of other documents, as sync_document_chunks.
+    """
+    source_key = get_source_key(source_id)
+    ids = vectordb.get(where={"doc_id": source_key}, include=[])["ids"]
+    with span("insert", removed=len(ids)):
+        if ids:
+            vectordb.delete(ids=ids)
+    orphans = []
+    if dedup_index is not None:
+        with dedup_index.lock:
+            orphans = dedup_index.remove(ids + [i for i in dedup_index.links if i.startswith(source_key + "-")])
+            dedup_index.save()
+    return ChunkDiff(removed=ids, orphans=orphans)
@@ -0,0 +1,151 @@
+"""
+Context compression between retrieval and generation: the sentences of the retrieved chunks are scored against
+the question with the embedding model of the vectorDB, and only the most relevant ones that fit a token budget
+are passed to the answer prompt, in their original order and without duplicates.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.embeddings import Embeddings
+
+from colearner.metrics import registry, span
+from colearner.rate_limit import EMBEDDING_QUERY, RateLimitedEmbeddings
+from colearner.tokenizer import count_tokens
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """ Sentences and lines of a text, without empty ones. """
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence and sentence.strip()]
+
+
+def _normalize(sentence: str) -> str:
+    return " ".join(sentence.lower().split())
+
+
+_caches: Dict[int, Tuple[Embeddings, OrderedDict, threading.Lock]] = {}
+_caches_lock = threading.Lock()
+
+
+def _sentence_cache(embeddings: Embeddings) -> Tuple[OrderedDict, threading.Lock]:
+    """
+    Sentence embeddings of an embedding model, kept for the whole process: the app builds a new compressor
+    on every Streamlit rerun, so a cache per compressor would never be hit.
+    """
+    with _caches_lock:
+        if id(embeddings) not in _caches:
+            _caches[id(embeddings)] = (embeddings, OrderedDict(), threading.Lock())    # holds the model, so its id is not reused
+        _, cache, lock = _caches[id(embeddings)]
+    return cache, lock
+
+
+class EmbeddingContextCompressor(BaseDocumentCompressor):
+    """
+    Keep the sentences of the retrieved documents most similar to the query, up to token_budget tokens in total.
+
+    Documents that already fit the budget are returned as they are, without embedding anything. Otherwise kept
+    sentences stay in their document and in their original order, gaps are marked with '...', repeated sentences
+    are kept once and documents without a kept sentence are dropped. Sentence embeddings are cached per embedding
+    model, across compressors, since the same chunks are retrieved again and again in a conversation.
+    """
+
+    embeddings: Embeddings
+    token_budget: int = 800
+    min_similarity: float = 0.0                     # sentences less similar to the query are never kept
+    cache_size: int = 10000                         # sentence embeddings kept in memory (least recently used are dropped)
+    priority: int = EMBEDDING_QUERY                 # rate limiter priority: a chat turn waits, so ahead of ingestion
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _embed_sentences(self, sentences: List[str]) -> np.ndarray:
+        cache, lock = _sentence_cache(self.embeddings)
+        with lock:
+            missing = list(dict.fromkeys(s for s in sentences if s not in cache))
+        vectors = []
+        if missing and isinstance(self.embeddings, RateLimitedEmbeddings):
+            vectors = self.embeddings.embed_documents(missing, priority=self.priority)
+        elif missing:
+            vectors = self.embeddings.embed_documents(missing)
+        with lock:
+            for sentence, vector in zip(missing, vectors):
+                cache[sentence] = np.asarray(vector, dtype=np.float32)
+            result = []
+            for sentence in sentences:
+                cache.move_to_end(sentence)
+                result.append(cache[sentence])
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return np.vstack(result)
+
+    def select(self, documents: Sequence[Document], query: str) -> Tuple[List[Tuple[int, int, str]], set]:
+        """ Unique sentences (document index, position, text) of the documents and the positions kept for the query. """
+        sentences, seen = [], set()
+        for doc_index, doc in enumerate(documents):
+            for position, sentence in enumerate(split_sentences(doc.page_content)):
+                key = _normalize(sentence)
+                if key not in seen:
+                    seen.add(key)
+                    sentences.append((doc_index, position, sentence))
+        if not sentences:
+            return sentences, set()
+
+        vectors = self._embed_sentences([sentence for _, _, sentence in sentences])
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+
+        kept, used = set(), 0
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] < self.min_similarity:
+                break
+            tokens = count_tokens(sentences[i][2])
+            if used + tokens <= self.token_budget:                      # smaller sentences may still fit
+                kept.add((sentences[i][0], sentences[i][1]))
+                used += tokens
+        return sentences, kept
+
+    def compress_documents(self, documents: Sequence[Document], query: str,
+                           callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        tokens_in = sum(count_tokens(doc.page_content) for doc in documents)
+        with span("compress", documents=len(documents), tokens_in=tokens_in) as attributes:
+            if tokens_in <= self.token_budget:
+                compressed = list(documents)
+            else:
+                sentences, kept = self.select(documents, query)
+                compressed = []
+                for doc_index, doc in enumerate(documents):
+                    parts, previous = [], None
+                    for index, position, sentence in sentences:
+                        if index == doc_index and (index, position) in kept:
+                            if previous is not None and position != previous + 1:
+                                parts.append("...")
+                            parts.append(sentence)
+                            previous = position
+                    if parts:
+                        compressed.append(Document(page_content=" ".join(parts), metadata=dict(doc.metadata)))
+
+            tokens_out = sum(count_tokens(doc.page_content) for doc in compressed)
+            attributes.update(tokens_out=tokens_out, tokens_saved=tokens_in - tokens_out)
+        registry.increment("context_tokens_in", tokens_in)
+        registry.increment("context_tokens_saved", tokens_in - tokens_out)
+        print(f"Context compressed from {tokens_in} to {tokens_out} tokens ({tokens_in - tokens_out} saved).")
+        return compressed
+
+
+def compress_retriever(retriever, token_budget: int, embeddings: Optional[Embeddings] = None):
+    """ Wrap a vectorstore retriever so the documents it returns are compressed to token_budget tokens. """
+    from langchain.retrievers import ContextualCompressionRetriever
+
+    embeddings = embeddings or retriever.vectorstore.embeddings
+    compressor = EmbeddingContextCompressor(embeddings=embeddings, token_budget=token_budget)
+    return ContextualCompressionRetriever(base_compressor=compressor, base_retriever=retriever)
@@ -0,0 +1,251 @@
+""" Near-duplicate detection of text chunks with MinHash signatures and LSH buckets, run before embedding. """
+
+import os
+import re
+import json
+import zlib
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+_MERSENNE_PRIME = np.uint64(4294967311)      # smallest prime above 2**32, keeps a*x+b inside uint64
+_MAX_HASH = np.uint64(2**32 - 1)
+
+
+@dataclass
+class DedupReport:
+    """ Summary of one deduplication pass. """
+    total_chunks: int = 0
+    duplicate_chunks: int = 0
+    chars_saved: int = 0
+    duplicates: Dict[str, str] = field(default_factory=dict)      # duplicate chunk id -> kept chunk id
+
+    @property
+    def embedding_calls_saved(self) -> int:
+        """ Every dropped chunk is one text less sent to the embedding model. """
+        return self.duplicate_chunks
+
+    def storage_saved(self, embedding_size: int = 0) -> int:
+        """ Estimated bytes not written to the vectorDB: chunk text plus a float32 vector per dropped chunk. """
+        return self.chars_saved + self.duplicate_chunks * embedding_size * 4
+
+    def __str__(self) -> str:
+        return (f"Dropped {self.duplicate_chunks}/{self.total_chunks} near-duplicate chunks, "
+                f"saved {self.embedding_calls_saved} embeddings and {self.chars_saved} characters of text.")
+
+
+class NearDuplicateIndex:
+    """
+    Index of MinHash signatures of all chunks stored in the vectorDB.
+
+    Chunks are normalized (lowercase, collapsed whitespace) and shingled into character n-grams. Signatures
+    are split into `bands` LSH bands so that only chunks sharing a band are compared, and a candidate is a
+    near-duplicate when the estimated Jaccard similarity of the shingles is at least `threshold`.
+    The index is saved as json at `path` and updated incrementally with add() and remove().
+    """
+
+    def __init__(self,
+        path: Optional[str] = None,
+        num_perm: int = 64,
+        bands: int = 8,
+        threshold: float = 0.8,
+        shingle_size: int = 5,
+        seed: int = 1
+    ) -> None:
+
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 2**32 - 1, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 2**32 - 1, size=num_perm, dtype=np.uint64)
+
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.links: Dict[str, str] = {}                                # dropped duplicate id -> kept chunk id
+        self._buckets: List[Dict[bytes, set]] = [{} for _ in range(bands)]
+        self.lock = threading.RLock()                                  # held by callers sharing the index between threads
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    # -------------------- signatures --------------------
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """ Stable 32-bit hashes of the character shingles of the normalized text. """
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        k = self.shingle_size
+        if len(text) <= k:
+            grams = {text}
+        else:
+            grams = {text[i:i + k] for i in range(len(text) - k + 1)}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        """ MinHash signature of the text, one minimum per permutation. """
+        shingles = self._shingles(text)
+        hashes = (np.outer(shingles, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return hashes.min(axis=0)
+
+    def similarity(self, sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        """ Estimated Jaccard similarity of two signatures. """
+        return float(np.mean(sig_a == sig_b))
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    # -------------------- queries and updates --------------------
+
+    def find_duplicate(self, text: str = "", signature: Optional[np.ndarray] = None,
+                       exclude: Iterable[str] = ()) -> Optional[str]:
+        """ Return the id of the most similar indexed chunk above the threshold, ignoring excluded ids, or None. """
+        if signature is None:
+            signature = self.signature(text)
+
+        candidates = set()
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            candidates |= band.get(key, set())
+        candidates -= set(exclude)
+
+        best_id, best_score = None, self.threshold
+        for candidate in candidates:
+            score = self.similarity(signature, self.signatures[candidate])
+            if score >= best_score:
+                best_id, best_score = candidate, score
+        return best_id
+
+    def add(self, chunk_id: str, text: str = "", signature: Optional[np.ndarray] = None) -> None:
+        """ Add a chunk to the index. """
+        if signature is None:
+            signature = self.signature(text)
+        if chunk_id in self.signatures:
+            self.remove([chunk_id])
+
+        self.signatures[chunk_id] = signature
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(key, set()).add(chunk_id)
+
+    def remove(self, chunk_ids: Iterable[str]) -> List[str]:
+        """
+        Remove chunks from the index, e.g. after they are deleted from the vectorDB.
+
+        Returns:
+            ids of previously dropped duplicates whose kept chunk was removed. They are no longer
+            represented in the vectorDB and should be ingested again if their document is still used.
+        """
+        chunk_ids = set(chunk_ids)
+        for chunk_id in chunk_ids:
+            signature = self.signatures.pop(chunk_id, None)
+            self.links.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for band, key in zip(self._buckets, self._band_keys(signature)):
+                members = band.get(key)
+                if members is not None:
+                    members.discard(chunk_id)
+                    if not members:
+                        del band[key]
+
+        orphans = [dup for dup, kept in self.links.items() if kept in chunk_ids]
+        for dup in orphans:
+            del self.links[dup]
+        return orphans
+
+    def filter_documents(self, ids: List[str], docs: List[Document],
+                         exclude: Iterable[str] = ()) -> Tuple[List[str], List[Document], DedupReport]:
+        """
+        Drop chunks that are near-duplicates of indexed chunks or of earlier chunks in the same batch,
+        and add the kept chunks to the index. Each dropped chunk is linked to the chunk it duplicates
+        in self.links, so that it can be traced and restored if that chunk is deleted later.
+
+        Args:
+            ids: chunk ids, aligned with docs
+            docs: chunk documents
+            exclude: indexed chunk ids that are about to be deleted, and do not count as originals
+        Returns:
+            kept ids, kept docs and a DedupReport.
+        """
+        report = DedupReport(total_chunks=len(docs))
+        kept_ids, kept_docs = [], []
+
+        exclude = set(exclude)
+        for chunk_id, doc in zip(ids, docs):
+            signature = self.signature(doc.page_content)
+            duplicate_of = self.find_duplicate(signature=signature, exclude=exclude)
+
+            if duplicate_of is not None and duplicate_of != chunk_id:
+                report.duplicate_chunks += 1
+                report.chars_saved += len(doc.page_content)
+                report.duplicates[chunk_id] = duplicate_of
+                self.links[chunk_id] = duplicate_of
+                continue
+
+            self.add(chunk_id, signature=signature)
+            kept_ids.append(chunk_id)
+            kept_docs.append(doc)
+
+        return kept_ids, kept_docs, report
+
+    # -------------------- persistence --------------------
+
+    def save(self, path: Optional[str] = None) -> None:
+        """ Write the index to a json file, replacing the old file atomically. """
+        path = path or self.path
+        if not path:
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "shingle_size": self.shingle_size,
+            "signatures": {chunk_id: sig.tolist() for chunk_id, sig in self.signatures.items()},
+            "links": self.links,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None) -> None:
+        """ Load the index from a json file written by save(). """
+        path = path or self.path
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if (data["num_perm"], data["bands"], data["shingle_size"]) != (self.num_perm, self.bands, self.shingle_size):
+            print(f"Dedup index at {path} was built with different parameters, starting a new index.")
+            return
+
+        for chunk_id, sig in data["signatures"].items():
+            self.add(chunk_id, signature=np.array(sig, dtype=np.uint64))
+        self.links = data.get("links", {})
+
+
+_indexes: Dict[str, NearDuplicateIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(collection_name: str) -> NearDuplicateIndex:
+    """
+    Near-duplicate index of a vectorDB collection, loaded from DATA_DIR/dedup on first use and then shared
+    in the process, so concurrent ingestion jobs update the same index.
+    """
+    path = os.path.join(os.getenv("DATA_DIR", "data"), "dedup", collection_name + ".json")
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = NearDuplicateIndex(path=path)
+        return _indexes[path]
@@ -0,0 +1,256 @@
+""" Embedding providers for the RAG pipeline, selected with the EMBEDDING_MODEL environment variable. """
+
+import os
+import re
+import hashlib
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_PROVIDERS: Dict[str, Callable[[], Embeddings]] = {}
+
+_embedding_functions: Dict[str, Embeddings] = {}            # built providers, so local models are loaded only once
+
+DEFAULT_EMBEDDING_MODEL = "openai"
+DEFAULT_OPENAI_EMBEDDING_MODEL = "text-embedding-3-large"
+
+
+def register_provider(name: str):
+    """ Register a factory that builds an Embeddings object for the given EMBEDDING_MODEL value. """
+    def decorator(factory):
+        EMBEDDING_PROVIDERS[name] = factory
+        return factory
+    return decorator
+
+
+def get_embedding_provider_name(name: Optional[str] = None) -> str:
+    """ Return the configured provider name, falling back to the EMBEDDING_MODEL env variable. """
+    return (name or os.getenv("EMBEDDING_MODEL") or DEFAULT_EMBEDDING_MODEL).lower()
+
+
+def get_embedding_model_name(name: Optional[str] = None) -> str:
+    """
+    Identity of the configured embedding model of a provider, e.g. 'text-embedding-3-large' for openai.
+    Two vectors are only comparable if both provider and model are the same.
+    """
+    name = get_embedding_provider_name(name)
+    if name == "openai":
+        return os.getenv("OPENAI_EMBEDDING_MODEL", DEFAULT_OPENAI_EMBEDDING_MODEL)
+    if name == "sentence_transformer":
+        model = os.path.basename(os.path.normpath(os.getenv("EMBEDDING_MODEL_PATH", "")))
+        return model + ("-int8" if os.getenv("EMBEDDING_QUANTIZE", "false").lower() == "true" else "")
+    if name == "ollama":
+        return os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+    if name == "fake":
+        return f"fake-{os.getenv('EMBEDDING_SIZE', '256')}"
+    return name
+
+
+def get_embedding_function(name: Optional[str] = None) -> Embeddings:
+    """
+    Build the embedding function for the given provider name.
+
+    Args:
+        name: one of the registered providers (openai, sentence_transformer, ollama, fake).
+              Defaults to the EMBEDDING_MODEL environment variable, then to openai.
+    Returns:
+        Langchain Embeddings object, shared between calls with the same provider name.
+    """
+    name = get_embedding_provider_name(name)
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding model '{name}'. Available: {sorted(EMBEDDING_PROVIDERS)}")
+    if name not in _embedding_functions:
+        _embedding_functions[name] = EMBEDDING_PROVIDERS[name]()
+    return _embedding_functions[name]
+
+
+def get_collection_name(name: Optional[str] = None) -> str:
+    """
+    Return the Chroma collection name of the configured model of a provider, e.g. 'collection_ollama_nomic-embed-text'.
+    Vectors of different models can have different dimensions so each model gets its own collection,
+    while the default openai model keeps the original collection name so existing vectorDBs keep working.
+    """
+    name = get_embedding_provider_name(name)
+    model = get_embedding_model_name(name)
+    if name == "openai" and model == DEFAULT_OPENAI_EMBEDDING_MODEL:
+        return "collection_name"
+    collection = f"collection_{name}" if model == name else f"collection_{name}_{model}"
+    sanitized = re.sub(r"[^a-zA-Z0-9_-]+", "_", collection).strip("_-")       # chroma: 3-63 chars of [a-zA-Z0-9._-]
+    if len(sanitized) > 63:
+        sanitized = sanitized[:54] + "_" + hashlib.sha1(collection.encode()).hexdigest()[:8]
+    return sanitized
+
+
+# ------------------------------------------------------------
+#                      Local CPU backend
+# ------------------------------------------------------------
+
+class LocalCPUEmbeddings(Embeddings):
+    """
+    Embed texts with a sentence-transformer model loaded from a local path, fully offline.
+
+    Texts are sorted by length and encoded in batches so that padding is minimal, and inference uses
+    `num_threads` CPU threads. With backend='onnx' the model is run with onnxruntime from
+    `<model_path>/model.onnx` and the tokenizer from `<model_path>/tokenizer.json`; with quantize=True
+    a dynamically quantized int8 copy of the model is created once and used instead.
+    """
+
+    def __init__(self,
+        model_path: str,
+        batch_size: int = 32,
+        num_threads: Optional[int] = None,
+        backend: str = "torch",
+        quantize: bool = False,
+        max_length: int = 512,
+        normalize: bool = True
+    ) -> None:
+
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError(f"Local embedding model path does not exist: {model_path}")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unsupported backend '{backend}', use 'torch' or 'onnx'.")
+        if quantize and backend != "onnx":
+            raise ValueError("Quantization is only supported with the onnx backend, set EMBEDDING_BACKEND=onnx.")
+
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.backend = backend
+        self.quantize = quantize
+        self.max_length = max_length
+        self.normalize = normalize
+        self._model = None
+        self._tokenizer = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """ Embed a list of texts in length-sorted batches, returning vectors in the input order. """
+        if not texts:
+            return []
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch_vectors = self._encode_batch([texts[i] for i in batch_ids])
+            for i, vector in zip(batch_ids, batch_vectors):
+                vectors[i] = [float(x) for x in vector]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _encode_batch(self, texts: List[str]):
+        """ Encode one batch of texts into a 2D array of vectors. """
+        if self.backend == "onnx":
+            return self._encode_batch_onnx(texts)
+        return self._encode_batch_torch(texts)
+
+    # -------------------- torch backend --------------------
+
+    def _load_torch_model(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(self.num_threads)
+        self._model = SentenceTransformer(self.model_path, device="cpu")
+        self._model.max_seq_length = self.max_length
+
+    def _encode_batch_torch(self, texts: List[str]):
+        if self._model is None:
+            self._load_torch_model()
+        return self._model.encode(texts,
+                                  batch_size=len(texts),
+                                  normalize_embeddings=self.normalize,
+                                  convert_to_numpy=True,
+                                  show_progress_bar=False)
+
+    # -------------------- onnx backend --------------------
+
+    def _get_onnx_model_file(self) -> str:
+        """ Return the onnx model file, creating the int8 quantized copy on first use if requested. """
+        model_file = os.path.join(self.model_path, "model.onnx")
+        if not self.quantize:
+            return model_file
+
+        quantized_file = os.path.join(self.model_path, "model_int8.onnx")
+        if not os.path.exists(quantized_file):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"Quantizing {model_file} to int8...")
+            quantize_dynamic(model_file, quantized_file, weight_type=QuantType.QInt8)
+        return quantized_file
+
+    def _load_onnx_model(self):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._model = ort.InferenceSession(self._get_onnx_model_file(), options,
+                                           providers=["CPUExecutionProvider"])
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        self._tokenizer.enable_padding()
+
+    def _encode_batch_onnx(self, texts: List[str]):
+        import numpy as np
+
+        if self._model is None:
+            self._load_onnx_model()
+
+        encodings = self._tokenizer.encode_batch(texts)
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        input_names = [i.name for i in self._model.get_inputs()]
+        outputs = self._model.run(None, {name: features[name] for name in input_names if name in features})
+
+        vectors = outputs[0]
+        if vectors.ndim == 3:                                          # token embeddings: mean pool over the mask
+            mask = features["attention_mask"][..., None].astype(vectors.dtype)
+            vectors = (vectors * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+
+# ------------------------------------------------------------
+#                      Provider factories
+# ------------------------------------------------------------
+
+@register_provider("openai")
+def _openai_embeddings() -> Embeddings:
+    """ OpenAI embeddings through the rate limiter shared with the chat model, which also retries failed requests. """
+    from langchain_openai import OpenAIEmbeddings
+    from colearner.rate_limit import RateLimitedEmbeddings
+    return RateLimitedEmbeddings(OpenAIEmbeddings(model=os.getenv("OPENAI_EMBEDDING_MODEL", DEFAULT_OPENAI_EMBEDDING_MODEL),
+                                                  max_retries=0))
+
+
+@register_provider("sentence_transformer")
+def _local_cpu_embeddings() -> Embeddings:
+    return LocalCPUEmbeddings(
+        model_path=os.getenv("EMBEDDING_MODEL_PATH", ""),
+        batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+        num_threads=int(os.getenv("EMBEDDING_NUM_THREADS", "0")) or None,
+        backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+        quantize=os.getenv("EMBEDDING_QUANTIZE", "false").lower() == "true",
+    )
+
+
+@register_provider("ollama")
+def _ollama_embeddings() -> Embeddings:
+    from langchain_community.embeddings import OllamaEmbeddings
+    return OllamaEmbeddings(base_url=os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434"),
+                            model=os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text"))
+
+
+@register_provider("fake")
+def _fake_embeddings() -> Embeddings:
+    """ Deterministic embeddings (same text -> same vector) for tests and offline runs. """
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=int(os.getenv("EMBEDDING_SIZE", "256")))
@@ -0,0 +1,329 @@
+"""
+Incremental loader of local git repositories. The last ingested commit is recorded per repository, and a sync
+reads only the files added or modified since that commit, so it takes time proportional to the change.
+
+    python -m colearner.git_loader /path/to/repo
+"""
+
+import os
+import json
+import time
+import argparse
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders.base import BaseLoader
+from colearner.metrics import span
+
+
+VENDOR_DIRS = {"node_modules", "vendor", "third_party", "third-party", "bower_components", "site-packages", "dist",
+               "build", ".venv", "venv", "__pycache__", ".tox", ".mypy_cache", ".pytest_cache", ".git"}
+VENDOR_FILES = {"package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock", "Cargo.lock",
+                "go.sum", "composer.lock", "Gemfile.lock"}
+BINARY_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".svg", ".pdf", ".zip", ".gz", ".tgz",
+                     ".bz2", ".xz", ".7z", ".rar", ".jar", ".war", ".whl", ".egg", ".so", ".dll", ".dylib", ".exe",
+                     ".bin", ".o", ".a", ".class", ".pyc", ".pyo", ".woff", ".woff2", ".ttf", ".otf", ".eot",
+                     ".mp3", ".mp4", ".wav", ".avi", ".mov", ".mkv", ".npy", ".npz", ".pkl", ".parquet", ".sqlite",
+                     ".db", ".onnx", ".pt", ".h5", ".ckpt", ".safetensors"}
+LANGUAGES = {".py": "python", ".js": "js", ".jsx": "js", ".mjs": "js", ".ts": "ts", ".tsx": "ts", ".java": "java",
+             ".kt": "kotlin", ".go": "go", ".rs": "rust", ".rb": "ruby", ".php": "php", ".scala": "scala",
+             ".swift": "swift", ".c": "c", ".h": "c", ".cc": "cpp", ".cpp": "cpp", ".hpp": "cpp", ".cs": "csharp",
+             ".lua": "lua", ".pl": "perl", ".hs": "haskell", ".ex": "elixir", ".exs": "elixir", ".proto": "proto",
+             ".sol": "sol", ".md": "markdown", ".markdown": "markdown", ".rst": "rst", ".tex": "latex",
+             ".html": "html", ".htm": "html"}
+
+
+def is_vendor_path(path: str) -> bool:
+    """ True for files of vendored dependencies, build outputs, lock files and minified assets. """
+    parts = path.split("/")
+    name = parts[-1]
+    return (any(part in VENDOR_DIRS for part in parts[:-1]) or name in VENDOR_FILES
+            or name.endswith((".min.js", ".min.css", ".map")))
+
+
+def get_language(path: str) -> Optional[str]:
+    """ Language of a file for code-aware splitting, from its extension. """
+    return LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+
+# ------------------------------------------------------------
+#                        Sync state
+# ------------------------------------------------------------
+
+class GitSyncState:
+    """ Last ingested commit per repository, in DATA_DIR/cache/git_state.json. """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.path.join(os.getenv("DATA_DIR", "data"), "cache", "git_state.json")
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, repo_path: str) -> Optional[str]:
+        return self._read().get(os.path.abspath(repo_path), {}).get("commit")
+
+    def put(self, repo_path: str, commit: str) -> None:
+        with self._lock:
+            data = self._read()
+            data[os.path.abspath(repo_path)] = {"commit": commit, "synced_at": time.time()}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+
+
+# ------------------------------------------------------------
+#                          Loader
+# ------------------------------------------------------------
+
+@dataclass
+class GitChanges:
+    """ Files changed between the last ingested commit (None for a first sync) and the head commit. """
+    base: Optional[str]
+    head: str
+    modified: List[Tuple[str, str]] = field(default_factory=list)       # (path, blob id) of added or modified files
+    deleted: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)                    # vendor, binary and oversized files
+
+    def __str__(self) -> str:
+        return (f"{self.base[:8] if self.base else 'empty'}..{self.head[:8]}: {len(self.modified)} added or modified, "
+                f"{len(self.deleted)} deleted, {len(self.skipped)} skipped files")
+
+
+@dataclass
+class FileChange:
+    """ One sync event: the new version of a file, or its deletion when document is None. """
+    path: str
+    source_id: str
+    document: Optional[Document] = None
+
+    @property
+    def deleted(self) -> bool:
+        return self.document is None
+
+
+class GitLoader(BaseLoader):
+    """
+    Load the text files of a local git repository at a commit, incrementally from the last synced commit.
+
+    Args:
+        repo_path: path of the working copy (only committed content is read)
+        ref: commit to load, HEAD by default
+        state: GitSyncState with the last ingested commit per repository
+        max_file_size: files larger than this many bytes are skipped
+
+    Documents have metadata 'source' (path in the repository), 'repo', 'commit' and 'language'.
+    """
+
+    def __init__(self, repo_path: str, ref: str = "HEAD", state: Optional[GitSyncState] = None,
+                 max_file_size: int = 500_000) -> None:
+        self.repo_path = os.path.abspath(repo_path)
+        self.repo_name = os.path.basename(self.repo_path.rstrip(os.sep))
+        self.ref = ref
+        self.state = state or GitSyncState()
+        self.max_file_size = max_file_size
+
+    def _git(self, *args: str) -> bytes:
+        return subprocess.run(["git", "-C", self.repo_path, *args], capture_output=True, check=True).stdout
+
+    def _is_commit(self, sha: str) -> bool:
+        return subprocess.run(["git", "-C", self.repo_path, "cat-file", "-e", sha + "^{commit}"],
+                              capture_output=True).returncode == 0
+
+    def source_id(self, path: str) -> str:
+        """ Document identity of a file, unique across repositories. """
+        return f"git:{self.repo_path}:{path}"
+
+    def head(self) -> str:
+        return self._git("rev-parse", "--verify", self.ref + "^{commit}").decode().strip()
+
+    def changes(self, since: Optional[str] = None) -> GitChanges:
+        """
+        Diff the head commit against `since` (the last synced commit by default). Every file of the head commit
+        is listed on a first sync, or when the last synced commit is gone, e.g. after a force push.
+        """
+        head = self.head()
+        since = since or self.state.get(self.repo_path)
+        if since and not self._is_commit(since):
+            print(f"Last synced commit {since} is not in {self.repo_path}, loading every file.")
+            since = None
+
+        changes = GitChanges(base=since, head=head)
+        if since == head:
+            return changes
+        candidates = []
+        if since is None:
+            for entry in self._git("ls-tree", "-r", "-z", head).split(b"\0"):       # "<mode> <type> <blob>\t<path>"
+                if entry:
+                    info, path = entry.decode("utf-8", "surrogateescape").split("\t", 1)
+                    mode, kind, blob = info.split()
+                    candidates.append((path, mode, blob, "A"))
+        else:
+            fields = self._git("diff", "--raw", "-z", "--no-renames", since, head).split(b"\0")
+            for info, path in zip(fields[0::2], fields[1::2]):             # ":<old mode> <new mode> <old> <new> <status>"
+                _, mode, _, blob, status = info.decode().split()
+                path = path.decode("utf-8", "surrogateescape")
+                if status == "D":
+                    changes.deleted.append(path)
+                else:
+                    candidates.append((path, mode, blob, status))
+
+        for path, mode, blob, status in candidates:
+            if mode not in ("100644", "100755") or is_vendor_path(path) \
+                    or os.path.splitext(path)[1].lower() in BINARY_EXTENSIONS:      # symlinks, submodules, binaries
+                changes.skipped.append(path)
+                if status != "A":
+                    changes.deleted.append(path)                        # its previous version may be stored
+            else:
+                changes.modified.append((path, blob))
+        return changes
+
+    def _read_blobs(self, blobs: List[str]) -> Iterator[Optional[bytes]]:
+        """ Contents of the blobs in order, through one `git cat-file --batch` process. None for oversized blobs. """
+        if not blobs:
+            return
+        process = subprocess.Popen(["git", "-C", self.repo_path, "cat-file", "--batch"],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        writer = threading.Thread(target=lambda: (process.stdin.write("".join(b + "\n" for b in blobs).encode()),
+                                                  process.stdin.close()), daemon=True)
+        writer.start()
+        try:
+            for _ in blobs:
+                size = int(process.stdout.readline().split()[2])                # "<blob> blob <size>"
+                content = process.stdout.read(size)
+                process.stdout.read(1)                                          # newline after the content
+                yield content if size <= self.max_file_size else None
+        finally:
+            writer.join()
+            process.stdout.close()
+            process.wait()
+
+    def iter_changes(self, changes: Optional[GitChanges] = None) -> Iterator[FileChange]:
+        """
+        Yield deletions first, then one Document per added or modified text file. A modified file that is now
+        oversized or binary is yielded as a deletion, so the chunks of its previous version are removed.
+        """
+        changes = changes or self.changes()
+        for path in changes.deleted:
+            yield FileChange(path, self.source_id(path))
+
+        paths, blobs = [p for p, _ in changes.modified], [b for _, b in changes.modified]
+        for path, content in zip(paths, self._read_blobs(blobs)):
+            text = None
+            if content is not None and b"\0" not in content[:8000]:
+                try:
+                    text = content.decode("utf-8")
+                except UnicodeDecodeError:
+                    pass
+            if text is None:
+                changes.skipped.append(path)
+                if changes.base is not None:
+                    yield FileChange(path, self.source_id(path))
+                continue
+            metadata = {"source": path, "repo": self.repo_name, "commit": changes.head,
+                        "language": get_language(path) or ""}
+            yield FileChange(path, self.source_id(path), Document(page_content=text, metadata=metadata))
+
+    def mark_synced(self, commit: str) -> None:
+        """ Record a commit as ingested; call it only after all its changes are stored. """
+        self.state.put(self.repo_path, commit)
+
+    def lazy_load(self) -> Iterator[Document]:
+        """ Documents of the files added or modified since the last synced commit. """
+        for change in self.iter_changes():
+            if not change.deleted:
+                yield change.document
+
+    def load(self) -> List[Document]:
+        return list(self.lazy_load())
+
+
+# ------------------------------------------------------------
+#                    Chunking and ingestion
+# ------------------------------------------------------------
+
+def split_code_documents(docs: List[Document], chunk_size: Optional[int] = None,
+                         chunk_overlap: Optional[int] = None) -> List[Document]:
+    """
+    Split files at the syntax boundaries of their language (classes, functions, headings), else as plain text.
+    Chunks are sized in tokens, by default with the chunk size and overlap of the shared text splitter.
+    """
+    from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+    from colearner.splitter import get_text_splitter
+    from colearner.tokenizer import count_tokens
+
+    if chunk_size is None or chunk_overlap is None:
+        shared = get_text_splitter()
+        chunk_size = shared.chunk_size if chunk_size is None else chunk_size
+        chunk_overlap = shared.chunk_overlap if chunk_overlap is None else chunk_overlap
+    splitters = {}
+    chunks = []
+    for doc in docs:
+        language = doc.metadata.get("language") or ""
+        if language not in splitters:
+            sizes = dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=count_tokens)
+            try:
+                splitters[language] = RecursiveCharacterTextSplitter.from_language(Language(language), **sizes)
+            except ValueError:                                          # no language, or no separators for it (c, perl)
+                splitters[language] = RecursiveCharacterTextSplitter(**sizes)
+        chunks.extend(splitters[language].split_documents([doc]))
+    return chunks
+
+
+def sync_repository(repo_path: str, vectordb=None, dedup_index=None, state: Optional[GitSyncState] = None,
+                    ref: str = "HEAD", queue=None) -> GitChanges:
+    """
+    Bring the chunks of a repository in the vectorDB up to date with its head commit: removed files are deleted,
+    added or modified files are re-chunked and diffed, so only their changed chunks are embedded.
+    The head commit is recorded as synced only after every change is stored. Documents whose duplicate chunks
+    lost their kept copy in a changed file are synced again through the ingestion queue (default IngestionQueue()).
+    """
+    from colearner.chunk_diff import remove_document_chunks, sync_document_chunks
+
+    if vectordb is None:
+        from colearner.rag import get_vectordb
+        from colearner.dedup import get_dedup_index
+        from colearner.embeddings import get_collection_name
+        vectordb = get_vectordb()
+        if dedup_index is None:
+            dedup_index = get_dedup_index(get_collection_name())
+
+    loader = GitLoader(repo_path, ref=ref, state=state)
+    orphans = []
+    with span("git_sync") as attributes:
+        changes = loader.changes()
+        for change in loader.iter_changes(changes):
+            if change.deleted:
+                diff = remove_document_chunks(vectordb, change.source_id, dedup_index)
+            else:
+                with span("split"):
+                    chunks = split_code_documents([change.document])
+                diff = sync_document_chunks(vectordb, change.source_id, chunks, dedup_index)
+            orphans.extend(diff.orphans)
+        loader.mark_synced(changes.head)
+        attributes.update(modified=len(changes.modified), deleted=len(changes.deleted), skipped=len(changes.skipped))
+    print(f"Synced {loader.repo_name} {changes}")
+    if orphans:
+        from colearner.jobs import IngestionQueue
+        (queue or IngestionQueue()).resync_orphans(orphans)
+    return changes
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest the changes of a local git repository since its last sync.")
+    parser.add_argument("repo_path")
+    parser.add_argument("--ref", default="HEAD", help="commit, branch or tag to ingest")
+    args = parser.parse_args(argv)
+    sync_repository(args.repo_path, ref=args.ref)
+
+
+if __name__ == "__main__":
+    main()
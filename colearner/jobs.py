@@ -0,0 +1,334 @@
+"""
+Background ingestion: a persistent job queue (sqlite under DATA_DIR) processed by worker threads,
+so the app keeps responding while documents are parsed, embedded and stored.
+
+Each job parses one document, diffs it against its stored chunks, embeds the added chunks and only then
+writes them to the vectorDB, so a cancelled or failed job leaves the document as it was. Jobs that were
+running when the app stopped are queued again on the next start; writes are upserts by content id, so
+resuming a job that was interrupted while writing is safe.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from colearner.metrics import span
+
+
+QUEUED, RUNNING, COMMITTING, DONE, FAILED, CANCELLED = "queued", "running", "committing", "done", "failed", "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING, COMMITTING)
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job when its cancellation was requested. """
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str                      # 'file', 'notion' or 'website'
+    source_id: str                 # document identity, see chunk_diff.get_source_key
+    name: str                      # name shown in the app
+    payload: Dict[str, Any]
+    state: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    error: str = ""
+    cancel_requested: bool = False
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    @property
+    def is_active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+
+class JobContext:
+    """ Handed to the job handler to report progress and to stop at cancellation checkpoints. """
+
+    def __init__(self, queue: "IngestionQueue", job: Job) -> None:
+        self.queue = queue
+        self.job = job
+
+    def progress(self, fraction: float, message: str = "", state: Optional[str] = None) -> None:
+        self.check_cancelled()
+        self.queue._update(self.job.id, progress=min(max(fraction, 0.0), 1.0), message=message,
+                           **({"state": state} if state else {}))
+
+    def check_cancelled(self) -> None:
+        if self.queue._is_cancel_requested(self.job.id):
+            raise JobCancelled()
+
+
+class IngestionQueue:
+    """
+    Persistent queue of ingestion jobs processed by background worker threads.
+
+    Args:
+        db_path: sqlite file of the queue, defaults to DATA_DIR/jobs.sqlite
+        handler: function(job, context) doing the work, defaults to ingest_document
+        num_workers: number of worker threads
+        poll_interval: seconds between checks for new jobs when idle
+    """
+
+    def __init__(self, db_path: Optional[str] = None, handler: Optional[Callable[[Job, JobContext], None]] = None,
+                 num_workers: int = 2, poll_interval: float = 0.5) -> None:
+        self.db_path = db_path or os.path.join(os.getenv("DATA_DIR", "data"), "jobs.sqlite")
+        self.handler = handler or ingest_document
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                id TEXT PRIMARY KEY, kind TEXT, source_id TEXT, name TEXT, payload TEXT,
+                                state TEXT, progress REAL, message TEXT, error TEXT, cancel_requested INTEGER,
+                                created_at REAL, updated_at REAL)""")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _row_to_job(self, row: sqlite3.Row) -> Job:
+        data = dict(row)
+        data["payload"] = json.loads(data["payload"])
+        data["cancel_requested"] = bool(data["cancel_requested"])
+        return Job(**data)
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                         (*fields.values(), job_id))
+
+    def _is_cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    # -------------------- public API --------------------
+
+    def submit(self, kind: str, source_id: str, name: str, payload: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Queue a job, or return the id of an active job of the same document with the same payload if there is one.
+        A new version of the document (e.g. another file_hash) is queued and runs after the active job.
+        """
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(f"SELECT id, payload FROM jobs WHERE source_id = ? AND state IN ({','.join('?' * len(ACTIVE_STATES))})",
+                                (source_id, *ACTIVE_STATES)).fetchall()
+            for row in rows:
+                if json.loads(row["payload"]) == (payload or {}):
+                    return row["id"]
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, 0, '', '', 0, ?, ?)",
+                         (job_id, kind, source_id, name, json.dumps(payload or {}), QUEUED, now, now))
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, states: Optional[List[str]] = None, limit: int = 50) -> List[Job]:
+        """ Most recent jobs first, optionally only in the given states. """
+        query, params = "SELECT * FROM jobs", []
+        if states:
+            query += f" WHERE state IN ({','.join('?' * len(states))})"
+            params = list(states)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._connect() as conn:
+            rows = conn.execute(query, (*params, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def cancel(self, job_id: str) -> None:
+        """ Cancel a queued job right away, or ask a running job to stop at its next checkpoint. """
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?",
+                         (CANCELLED, time.time(), job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state IN (?, ?)",
+                         (job_id, RUNNING, COMMITTING))
+
+    def resync_orphans(self, chunk_ids: List[str]) -> List[str]:
+        """
+        Queue the documents of orphaned duplicate chunks again (see NearDuplicateIndex.remove). These chunks
+        were dropped as near-duplicates of chunks that are deleted now, so they are not retrievable until their
+        document is synced again, which embeds and stores them. Documents are found by the last finished job
+        of their source. Returns the ids of the queued jobs.
+        """
+        from colearner.chunk_diff import get_source_key
+
+        keys = {chunk_id.rsplit("-", 1)[0] for chunk_id in chunk_ids}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created_at DESC", (DONE,)).fetchall()
+
+        job_ids = []
+        for job in map(self._row_to_job, rows):
+            matched = keys & {get_source_key(job.source_id), job.payload.get("file_hash")}
+            if matched:
+                keys -= matched
+                job_ids.append(self.submit(job.kind, job.source_id, job.name, job.payload))
+        if keys:
+            print(f"No ingestion job found to restore duplicate chunks of documents {sorted(keys)}.")
+        return job_ids
+
+    def start(self) -> "IngestionQueue":
+        """ Queue jobs interrupted by the last shutdown again, and start the worker threads. """
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, message = 'resumed' WHERE state IN (?, ?)",
+                         (QUEUED, RUNNING, COMMITTING))
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wait(self, job_id: str, timeout: float = 60) -> Job:
+        """ Block until the job is finished, for scripts and tests. """
+        deadline = time.time() + timeout
+        while (job := self.get(job_id)).is_active and time.time() < deadline:
+            time.sleep(0.05)
+        return job
+
+    # -------------------- workers --------------------
+
+    def _claim(self) -> Optional[Job]:
+        """
+        Take the oldest queued job, marking it running so no other worker takes it. Jobs of a document that
+        is being ingested wait, so versions of a document are ingested one after the other, in order.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE state = ? AND source_id NOT IN "
+                               "(SELECT source_id FROM jobs WHERE state IN (?, ?)) ORDER BY created_at LIMIT 1",
+                               (QUEUED, RUNNING, COMMITTING)).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?",
+                                   (RUNNING, time.time(), row["id"], QUEUED)).rowcount
+            if not claimed:                                          # taken by another process sharing the queue
+                return None
+        job = self._row_to_job(row)
+        job.state = RUNNING
+        return job
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            print(f"Ingestion job {job.id} started: {job.kind} {job.name}")
+            try:
+                with span("ingest", kind=job.kind, job_id=job.id):
+                    self.handler(job, JobContext(self, job))
+                self._update(job.id, state=DONE, progress=1.0, message="done")
+                print(f"Ingestion job {job.id} done: {job.name}")
+            except JobCancelled:
+                self._update(job.id, state=CANCELLED, message="cancelled")
+                print(f"Ingestion job {job.id} cancelled: {job.name}")
+            except Exception as e:
+                self._update(job.id, state=FAILED, error=f"{type(e).__name__}: {e}")
+                print(f"Ingestion job {job.id} failed: {job.name}\n{e}")
+
+
+# ------------------------------------------------------------
+#                     Default job handler
+# ------------------------------------------------------------
+
+def iter_job_documents(job: Job, context: JobContext, notion_loader=None) -> Iterator:
+    """ Parse the document of a job into langchain Documents as a stream, reporting progress per PDF page. """
+    if job.kind == "notion":
+        from colearner.notion_loader import NotionLoader
+        yield from (notion_loader or NotionLoader(page_url=job.payload["page_url"])).load()
+        return
+    if job.kind == "website":                                   # pages answered with 304 come from the cache, so the chunk
+        from colearner.website_loader import WebsiteLoader      # diff re-embeds only the pages that changed
+        loader = WebsiteLoader(job.payload["url"], max_pages=job.payload.get("max_pages", 100))
+        for crawled, doc in enumerate(loader.lazy_load(), 1):
+            yield doc
+            context.check_cancelled()
+            context.progress(0.4 * crawled / loader.max_pages, f"crawled {crawled} pages")
+        return
+
+    file_path = job.payload["file_path"]
+    if file_path.endswith(".pdf"):
+        from colearner.pdf_loader import iter_pdf_pages, count_pdf_pages
+        num_pages = max(count_pdf_pages(file_path), 1)
+        for parsed, doc in enumerate(iter_pdf_pages(file_path), 1):
+            doc.metadata["source"] = job.name                   # show the upload name, not the blob path
+            yield doc
+            context.progress(0.4 * parsed / num_pages, f"parsed page {parsed}/{num_pages}")
+    else:
+        from colearner.unstructured_loader import load_unstructured_file
+        for doc in load_unstructured_file(file_path):
+            doc.metadata["source"] = job.name
+            yield doc
+
+
+def ingest_document(job: Job, context: JobContext, vectordb=None, batch_size: int = 64) -> None:
+    """
+    Parse, split, diff and embed one document, then commit its chunks to the vectorDB in one step.
+    Cancellation is checked after every parsed page and embedding batch, i.e. always before the commit.
+    A Notion page tree that was not edited since its last ingestion is not read again.
+    """
+    from colearner.rag import get_vectordb
+    from colearner.splitter import chunk_size_stats, get_text_splitter
+    from colearner.dedup import get_dedup_index
+    from colearner.embeddings import get_collection_name
+    from colearner.chunk_diff import get_source_key, plan_document_sync, apply_document_sync, discard_document_sync
+
+    vectordb = vectordb or get_vectordb()
+    notion_loader = None
+    if job.kind == "notion":
+        from colearner.notion_loader import NotionLoader
+        notion_loader = NotionLoader(page_url=job.payload["page_url"])
+        stored = vectordb.get(where={"doc_id": get_source_key(job.source_id)}, limit=1, include=[])["ids"]
+        if stored and not notion_loader.changed_since_ingestion():
+            print(f"Notion page {job.name} not edited since its last ingestion, skipping it.")
+            return
+
+    context.progress(0.0, "parsing")
+    with span("parse", kind=job.kind) as attributes:          # pages are split as they are parsed, not held as a whole
+        splits = list(get_text_splitter().iter_split_documents(iter_job_documents(job, context, notion_loader)))
+        attributes.update(chunk_size_stats(splits))
+
+    dedup_index = get_dedup_index(get_collection_name())
+    extra_metadata = {"doc_hash": job.payload["file_hash"]} if job.payload.get("file_hash") else None
+    plan = plan_document_sync(vectordb, job.source_id, splits, dedup_index, extra_metadata)
+
+    try:
+        texts = [chunk.page_content for chunk in plan.added_chunks]
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            context.progress(0.45 + 0.45 * start / len(texts), f"embedding {start}/{len(texts)} chunks")
+            with span("embed", chunks=len(texts[start:start + batch_size])):
+                embeddings.extend(vectordb.embeddings.embed_documents(texts[start:start + batch_size]))
+        context.progress(0.9, f"committing: {plan.diff}", state=COMMITTING)
+    except BaseException:
+        orphans = discard_document_sync(plan, dedup_index)
+        context.queue.resync_orphans(orphans)                  # chunks of other jobs deduplicated against this one
+        raise
+
+    orphans = apply_document_sync(vectordb, plan, embeddings=embeddings, dedup_index=dedup_index)
+    context.queue.resync_orphans(orphans)
+    if notion_loader is not None:
+        notion_loader.mark_ingested()
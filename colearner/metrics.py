@@ -0,0 +1,241 @@
+"""
+Lightweight in-process instrumentation: nested timing spans and per-stage latency histograms.
+
+    with span("embed", chunks=len(texts)):
+        ...
+
+Durations are measured with the monotonic perf_counter clock and recorded in a process-wide registry.
+Finished spans are appended to a JSON lines file if METRICS_JSONL_PATH is set, and the histograms can
+be served in Prometheus text format with start_metrics_server (METRICS_PORT in the app).
+
+Stages used in the pipeline: notion_fetch, parse, split, dedup, embed, insert, rephrase, retrieve, generate.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_current_path: contextvars.ContextVar[Tuple[str, ...]] = contextvars.ContextVar("span_path", default=())
+
+
+def _escape_label(value: str) -> str:
+    """ Escape a label value for the Prometheus text format: backslash, double quote and newline. """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """ Cumulative latency histogram with fixed bucket bounds, as in Prometheus. """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)                   # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Estimate a quantile by linear interpolation inside the bucket that contains it. """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """ Thread-safe registry of histograms per (metric, stage) and of counters. """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self._jsonl_file = None
+        self._jsonl_path: Optional[str] = None
+
+    def observe(self, stage: str, seconds: float, metric: str = "stage_duration_seconds") -> None:
+        with self._lock:
+            histogram = self.histograms.get((metric, stage))
+            if histogram is None:
+                histogram = self.histograms[(metric, stage)] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: float = 1.0, stage: str = "") -> None:
+        with self._lock:
+            self.counters[(name, stage)] = self.counters.get((name, stage), 0.0) + value
+
+    def histogram(self, stage: str, metric: str = "stage_duration_seconds") -> Optional[Histogram]:
+        return self.histograms.get((metric, stage))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # -------------------- exporters --------------------
+
+    def set_jsonl_path(self, path: Optional[str]) -> None:
+        """ Append finished spans to this JSON lines file, or stop exporting with None. """
+        with self._lock:
+            if self._jsonl_file is not None:
+                self._jsonl_file.close()
+            self._jsonl_file, self._jsonl_path = None, path
+            if path:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._jsonl_file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def export_span(self, record: Dict[str, Any]) -> None:
+        if self._jsonl_file is None:
+            return
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self._jsonl_file is not None:
+                self._jsonl_file.write(line + "\n")
+
+    def render_prometheus(self, prefix: str = "colearner_") -> str:
+        """ All metrics in the Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            metrics = sorted({metric for metric, _ in self.histograms})
+            for metric in metrics:
+                name = prefix + metric
+                lines.append(f"# TYPE {name} histogram")
+                for (m, stage), histogram in sorted(self.histograms.items()):
+                    if m != metric:
+                        continue
+                    stage = _escape_label(stage)
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for (n, stage), value in sorted(self.counters.items()):
+                    if n == name:
+                        labels = f'{{stage="{_escape_label(stage)}"}}' if stage else ""
+                        lines.append(f"{prefix}{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ count, mean, p50 and p95 seconds per stage, for logs and benchmarks. """
+        with self._lock:
+            return {stage: {"count": h.count,
+                            "mean": h.sum / h.count if h.count else 0.0,
+                            "p50": h.quantile(0.5),
+                            "p95": h.quantile(0.95)}
+                    for (metric, stage), h in self.histograms.items() if metric == "stage_duration_seconds"}
+
+
+registry = MetricsRegistry()
+registry.set_jsonl_path(os.getenv("METRICS_JSONL_PATH"))
+
+
+# ------------------------------------------------------------
+#                           Spans
+# ------------------------------------------------------------
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block as a stage. Spans opened inside the block are its children, and the span record
+    (name, parent path, duration, attributes) is exported when the block exits, also on errors.
+    Attributes can be added inside the block through the yielded dict.
+    """
+    parent = _current_path.get()
+    token = _current_path.set(parent + (name,))
+    attributes = dict(attributes)
+    error = None
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_path.reset(token)
+        record(name, duration, path=parent + (name,), start=start_wall, error=error, **attributes)
+
+
+def record(name: str, duration: float, path: Tuple[str, ...] = (), start: Optional[float] = None,
+           error: Optional[str] = None, **attributes) -> None:
+    """ Record a stage timed elsewhere, e.g. from start and end callbacks that cannot wrap a block. """
+    registry.observe(name, duration)
+    registry.export_span({"name": name, "path": "/".join(path or _current_path.get() + (name,)),
+                          "start": start if start is not None else time.time() - duration,
+                          "duration": duration, "error": error, "thread": threading.current_thread().name,
+                          **attributes})
+
+
+def timed(name: Optional[str] = None):
+    """ Decorator recording every call of the function as a span, named after the function by default. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span_path() -> List[str]:
+    return list(_current_path.get())
+
+
+# ------------------------------------------------------------
+#                     Prometheus endpoint
+# ------------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int, host: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Serve /metrics in Prometheus text format from a daemon thread. Started once per process.
+    Listens on localhost unless `host` or METRICS_HOST is set, e.g. 0.0.0.0 for a scraper on another host.
+    """
+    global _server
+    if _server is None:
+        host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Serving metrics on http://{host}:{_server.server_address[1]}/metrics")
+    return _server
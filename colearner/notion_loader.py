@@ -2,15 +2,93 @@
 
 import os
 import re
+import json
+import time
+import threading
 import requests
-import random
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from langchain_core.documents import Document
 from langchain_community.document_loaders.base import BaseLoader
 import ast
 from typing import List, Dict, Any
 from itertools import groupby
 from operator import itemgetter
+from colearner.metrics import span
+
+
+NOTION_API_VERSION = "2022-06-28"
+REQUEST_TIMEOUT = float(os.getenv("NOTION_REQUEST_TIMEOUT", 10))         # seconds, so an unreachable API does not hang a rerun
+
+
+def get_notion_api_url() -> str:
+    """ Base URL of the Notion API, configurable with NOTION_API_BASE_URL, e.g. for a proxy or a local stub server. """
+    return os.getenv("NOTION_API_BASE_URL", "https://api.notion.com/v1").rstrip("/")
+
+
+class PageMetadataCache:
+    """
+    Title and last_edited_time of Notion pages by page id, persisted in DATA_DIR/cache/notion_pages.json,
+    so constructing a NotionLoader on every app rerun or in every ingestion job does not call the API.
+    The entry of an ingested page also keeps the last_edited_time of every page of its tree at that ingestion,
+    so a Sync of a tree that was not edited since is skipped.
+    
+    Entries are fresh for `ttl` seconds (NOTION_METADATA_TTL, default 1 hour) and refreshed afterwards. A failed
+    refresh keeps the stale entry, and a failed first lookup is stored without a title and retried after `retry_after`
+    seconds, so an unreachable API does not cost a request per rerun either.
+    """
+    
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, retry_after: float = 60) -> None:
+        self.path = path or os.path.join(os.getenv("DATA_DIR", "data"), "cache", "notion_pages.json")
+        self.ttl = float(os.getenv("NOTION_METADATA_TTL", 3600)) if ttl is None else ttl
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def get(self, page_id: str) -> Optional[Dict[str, Any]]:
+        """ Cached entry of the page, fresh or not: {'title', 'last_edited_time', 'fetched_at'}. """
+        return self.entries.get(page_id)
+    
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        max_age = self.ttl if entry.get("title") else min(self.ttl, self.retry_after)
+        return time.time() - entry["fetched_at"] < max_age
+    
+    def put(self, page_id: str, title: Optional[str], last_edited_time: Optional[str] = None) -> Dict[str, Any]:
+        with self.lock:
+            entry = {**self.entries.get(page_id, {}), "title": title, "last_edited_time": last_edited_time,
+                     "fetched_at": time.time()}
+            self.entries[page_id] = entry
+            self._save()
+        return entry
+    
+    def put_ingested(self, page_id: str, edit_times: Dict[str, Optional[str]]) -> None:
+        """ Record the last_edited_time of the pages of a tree ingested under the root page `page_id`. """
+        with self.lock:
+            self.entries.setdefault(page_id, {"title": None, "last_edited_time": None, "fetched_at": 0})
+            self.entries[page_id]["ingested"] = edit_times
+            self._save()
+    
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+_metadata_caches: Dict[str, PageMetadataCache] = {}
+_metadata_caches_lock = threading.Lock()
+
+
+def get_page_metadata_cache() -> PageMetadataCache:
+    """ Page metadata cache of DATA_DIR, shared by the app and the ingestion workers of the process. """
+    path = os.path.join(os.getenv("DATA_DIR", "data"), "cache", "notion_pages.json")
+    with _metadata_caches_lock:
+        if path not in _metadata_caches:
+            _metadata_caches[path] = PageMetadataCache(path)
+        return _metadata_caches[path]
 
 
 class NotionLoader(BaseLoader):
@@ -21,19 +99,29 @@ class NotionLoader(BaseLoader):
     def __init__(self, 
         page_url: str = '',
         notion_api_key: str = '', 
-        save_path: str = ''
+        save_path: str = '',
+        metadata_cache: Optional[PageMetadataCache] = None
     ) -> None:
         
         if not page_url:
             raise ValueError("Share link must be provided")
         
         self.page_url = page_url
+        self.notion_api_key = os.getenv("NOTION_API_KEY") if notion_api_key == '' else notion_api_key
+        self.save_path = os.getenv("DATA_DIR")+"/notion" if save_path == '' else save_path
+        self.metadata_cache = metadata_cache or get_page_metadata_cache()
         self.page_id = self._extract_page_id_from_url(self.page_url)
-        self.page_name = self._extract_page_name_from_page_id(self.page_id) #TODO: check if this will generate a random name each time app restarts if the page name is not retrievable
+        self.page_name = self._extract_page_name_from_page_id(self.page_id)   # cached, no API call while the cache entry is fresh
         self.page_text = []
         self.page_children = []
-        self.notion_api_key = os.getenv("NOTION_API_KEY") if notion_api_key == '' else notion_api_key
-        self.save_path = os.getenv("DATA_DIR")+"/notion" if save_path == '' else save_path
+        self.page_edit_times = {}       # last_edited_time of the child pages found by load()
+    
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.notion_api_key}",
+            "Notion-Version": NOTION_API_VERSION
+        }
     
     
     def _extract_page_id_from_url(self, url:str) -> str:
@@ -48,27 +136,75 @@ class NotionLoader(BaseLoader):
     
     
     def _extract_page_name_from_page_id(self, page_id) -> str:
-        """ Extract the page name from the page_id from Notion API. """
+        """
+        Page name from the page metadata cache, refreshed from the Notion API when the entry is missing or expired.
+        If the name is not retrievable, the page id is used, so the name stays the same across reruns and restarts.
+        """
+        
+        entry = self.metadata_cache.get(page_id)
+        if entry is None or not self.metadata_cache.is_fresh(entry):
+            entry = self._fetch_page_metadata(page_id, stale_entry=entry)
+        
+        self.page_name = entry.get("title") or 'NotionPage__id_'+page_id
+        self.last_edited_time = entry.get("last_edited_time")
+        return self.page_name
+    
+    
+    def _fetch_page_metadata(self, page_id:str, stale_entry:Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Get the title and last_edited_time of a page from the Notion API and store them in the metadata cache.
+        On an error response or a connection error, the stale title is kept, or the failure is cached.
+        """
+        
+        url = f"{get_notion_api_url()}/pages/{page_id}"
         
-        url = f"https://api.notion.com/v1/pages/{self.page_id}"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('NOTION_API_KEY')}",
-            "Notion-Version": "2022-06-28"  # Use the latest API version
-        }
-
         # Make the API request
-        response = requests.get(url, headers=headers)
+        try:
+            with span("notion_fetch", endpoint="pages"):
+                response = requests.get(url, headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Error occurred when extracting page name: {type(e).__name__}: {e}")
+            response = None
        
         # Extract the page title from the response
-        if response.status_code == 200:
+        if response is not None and response.status_code == 200:
             page_data = response.json()
-            self.page_name = page_data["properties"]["title"]["title"][0]["plain_text"]
-            return self.page_name
-        else:
+            title_property = next((p for p in page_data.get("properties", {}).values() if p.get("type") == "title"), 
+                                  page_data.get("properties", {}).get("title", {}))
+            title = "".join(t.get("plain_text", "") for t in title_property.get("title", [])) or None
+            return self.metadata_cache.put(page_id, title, page_data.get("last_edited_time"))
+        
+        if response is not None:
             print(f"Error occurred when extracting page name: {response.status_code}\nError message: {response.text}")
-            self.page_name = 'NotionPage__id_'+str(random.random())
-            print('Generating random page name: ', self.page_name)
-            return self.page_name
+        if stale_entry and stale_entry.get("title"):                # keep the last known name, and retry after the TTL,
+            return self.metadata_cache.put(page_id, stale_entry["title"])       # but not the edit time, which is unknown
+        return self.metadata_cache.put(page_id, None)
+    
+    
+    def changed_since_ingestion(self) -> bool:
+        """
+        Whether the page or one of its child pages was edited since the last recorded ingestion (see mark_ingested),
+        from their current last_edited_time: one pages request per page instead of reading all their blocks.
+        Pages whose edit time cannot be fetched count as changed.
+        """
+        
+        entry = self.metadata_cache.get(self.page_id) or {}
+        ingested = entry.get("ingested")
+        if not ingested or self.page_id not in ingested:
+            return True
+        for page_id, last_edited_time in ingested.items():
+            current = self._fetch_page_metadata(page_id, stale_entry=self.metadata_cache.get(page_id))
+            if page_id == self.page_id:
+                self.page_name = current.get("title") or self.page_name
+                self.last_edited_time = current.get("last_edited_time")
+            if current.get("last_edited_time") is None or current.get("last_edited_time") != last_edited_time:
+                return True
+        return False
+    
+    
+    def mark_ingested(self) -> None:
+        """ Record the edit times of the page tree read by load(), once its chunks are stored. """
+        self.metadata_cache.put_ingested(self.page_id, {self.page_id: self.last_edited_time, **self.page_edit_times})
     
     
     def load(self, write_to_file:bool =True) -> List[Document]:
@@ -76,6 +212,10 @@ class NotionLoader(BaseLoader):
         
         file_path = self.save_path+'/'+self.page_name+'.txt'
         
+        # start from an empty file, so blocks edited or removed since the last load are not read back
+        if write_to_file and os.path.exists(file_path):
+            os.remove(file_path)
+        
         # recursively search for all texts in the page, and write to a file
         self._recursive_text_search(id = self.page_id, parent = self.page_name, write_to_file=write_to_file)
         
@@ -92,13 +232,25 @@ class NotionLoader(BaseLoader):
             subgroup = grouped_data[group]
             for item in subgroup:
                 if item['type'] != 'child_page':
-                    subgroup_text += item['text'] + "\n"
+                    subgroup_text += self._to_markdown(item)
             doc = Document(page_content=subgroup_text, metadata={"source": file_path, "page_name": group})
             docs.append(doc)
         
         return docs
         
         
+    MARKDOWN_PREFIXES = {'heading_1': '# ', 'heading_2': '## ', 'heading_3': '### ', 'bulleted_list_item': '- ',
+                         'numbered_list_item': '1. ', 'to_do': '- [ ] ', 'quote': '> '}
+
+    def _to_markdown(self, item:Dict[str, Any]) -> str:
+        """ Render a text block as markdown, so the splitter sees headings, list items and code blocks. """
+        if item['type'] == 'code':
+            return f"```\n{item['text']}\n```\n\n"
+        if item['type'] in ('bulleted_list_item', 'numbered_list_item', 'to_do'):
+            return self.MARKDOWN_PREFIXES[item['type']] + item['text'] + "\n"
+        return self.MARKDOWN_PREFIXES.get(item['type'], '') + item['text'] + "\n\n"
+        
+        
     def _get_block(self, block_id:str) -> List[Dict[str, Any]]:
         """
         Get the response from the Notion API for a given block_id.
@@ -109,14 +261,10 @@ class NotionLoader(BaseLoader):
         This output dictionary should contain 'results' which is a list of dictionaries containing the sub-blocks.
         """
         
-        url = f"https://api.notion.com/v1/blocks/{block_id}/children"
-        
-        headers = {
-        "Authorization": f"Bearer {self.notion_api_key}",
-        "Notion-Version": "2022-06-28"  # Use the latest API version
-        }
+        url = f"{get_notion_api_url()}/blocks/{block_id}/children"
 
-        response = requests.get(url, headers=headers)
+        with span("notion_fetch", endpoint="blocks"):
+            response = requests.get(url, headers=self._headers(), timeout=REQUEST_TIMEOUT)
         
         if response.status_code == 200:
             page_data = response.json()
@@ -237,6 +385,7 @@ class NotionLoader(BaseLoader):
                                     'parent': parent}
                 self.page_children.append(children_page)
                 self.page_text.append(children_page)
+                self.page_edit_times[block['id']] = block.get('last_edited_time')
                 
                 if debug:
                     print('=========child_page==========')
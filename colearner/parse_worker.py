@@ -0,0 +1,246 @@
+"""
+Long-lived parsing workers that keep document parsers warm between jobs.
+
+- ParserPool: local worker processes that import the parser once and then parse files concurrently.
+- ParseServer / ParseClient: the same pool served over a local socket, e.g. from one long-running
+  unstructured container (`python3 -m colearner.parse_worker --serve --port 6000`).
+
+The socket protocol pickles its messages, so the server only binds to localhost by default and
+both sides authenticate with a secret key from PARSER_AUTHKEY (see get_authkey).
+
+Parsed documents are returned as structured dicts ({'page_content': ..., 'metadata': ...}) and turned
+back into langchain Documents by the caller.
+"""
+
+import os
+import sys
+import argparse
+import secrets
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+
+
+DEFAULT_ADDRESS = ("localhost", 6000)
+AUTHKEY_ENV = "PARSER_AUTHKEY"
+INSECURE_AUTHKEYS = {"", "colearner"}                   # the old built-in key is public, never accept it
+
+_parser = None                  # parser of the current worker process, set by _warm_up
+
+
+# ------------------------------------------------------------
+#                          Parsers
+# ------------------------------------------------------------
+
+def parse_with_unstructured(file_path: str) -> List[Dict[str, Any]]:
+    """ Parse a file with unstructured, one document per page. """
+    from colearner.unstructured_loader_docker import iter_unstructured_pages
+
+    return [document_to_dict(doc) for doc in iter_unstructured_pages([file_path])]
+
+
+def stub_parse(file_path: str) -> List[Dict[str, Any]]:
+    """ Read the file as plain text, for tests and environments without unstructured. """
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        return [{"page_content": f.read(), "metadata": {"source": file_path, "page_number": 1}}]
+
+
+PARSERS = {
+    "unstructured": parse_with_unstructured,
+    "stub": stub_parse,
+}
+
+
+def _warm_up(parser_name: str) -> None:
+    """ Worker initializer: pay the import cost of the parser once per worker instead of once per job. """
+    global _parser
+    _parser = PARSERS[parser_name]
+    if parser_name == "unstructured":
+        from langchain_community.document_loaders import UnstructuredFileLoader  # noqa: F401
+        from unstructured.partition.auto import partition  # noqa: F401
+
+
+def _parse_in_worker(file_path: str) -> List[Dict[str, Any]]:
+    return _parser(file_path)
+
+
+def document_to_dict(doc: Document) -> Dict[str, Any]:
+    return {"page_content": doc.page_content, "metadata": dict(doc.metadata)}
+
+
+def dict_to_document(data: Dict[str, Any]) -> Document:
+    return Document(page_content=data["page_content"], metadata=data["metadata"])
+
+
+# ------------------------------------------------------------
+#                       Local worker pool
+# ------------------------------------------------------------
+
+class ParserPool:
+    """
+    Pool of worker processes with a warm parser. Files are parsed concurrently, one job per file.
+
+    Args:
+        parser_name: key of PARSERS, 'unstructured' or 'stub'
+        max_workers: number of worker processes, defaults to the number of CPUs
+    """
+
+    def __init__(self, parser_name: str = "unstructured", max_workers: Optional[int] = None) -> None:
+        if parser_name not in PARSERS:
+            raise ValueError(f"Unknown parser '{parser_name}'. Available: {sorted(PARSERS)}")
+        self.parser_name = parser_name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # spawn, not fork: the pool is started from ingestion worker threads of the app, and forking a threaded
+        # process can deadlock
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_warm_up,
+                                             initargs=(parser_name,))
+
+    def submit(self, file_path: str) -> "Future[List[Dict[str, Any]]]":
+        """ Queue one file, returning a future of its parsed document dicts. """
+        return self._executor.submit(_parse_in_worker, file_path)
+
+    def parse(self, file_paths: List[str]) -> List[Document]:
+        """ Parse files concurrently and return their documents in the order of file_paths. """
+        futures = [self.submit(file_path) for file_path in file_paths]
+        return [dict_to_document(data) for future in futures for data in future.result()]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_pools: Dict[str, ParserPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_parser_pool(parser_name: str = "unstructured") -> ParserPool:
+    """ Process-wide pool per parser, started on first use and kept warm afterwards. """
+    with _pools_lock:                                                # concurrent jobs share one pool
+        if parser_name not in _pools:
+            _pools[parser_name] = ParserPool(parser_name, max_workers=int(os.getenv("PARSER_WORKERS", "0")) or None)
+        return _pools[parser_name]
+
+
+# ------------------------------------------------------------
+#                      Socket server/client
+# ------------------------------------------------------------
+
+def get_authkey(generate: bool = True) -> bytes:
+    """
+    Secret shared by ParseServer and ParseClient, read from PARSER_AUTHKEY.
+
+    If it is not set and generate is True, a random key is generated and written back to the environment,
+    so the rest of this process and the processes it starts (e.g. the worker container) use the same key.
+
+    Raises:
+        ValueError: if the key is missing (and generate is False) or is a known public key.
+    """
+    authkey = os.getenv(AUTHKEY_ENV)
+    if authkey is None and generate:
+        authkey = os.environ[AUTHKEY_ENV] = secrets.token_hex(32)
+    if authkey is None:
+        raise ValueError(f"{AUTHKEY_ENV} is not set, the parse server needs a secret key.")
+    if authkey in INSECURE_AUTHKEYS:
+        raise ValueError(f"{AUTHKEY_ENV} must be a secret, refusing to use '{authkey}'.")
+    return authkey.encode()
+
+
+class ParseServer:
+    """
+    Serve a ParserPool on a local socket. Each connection sends {'files': [paths]} messages and receives
+    {'documents': [dicts]} or {'error': message}. Connections are handled in threads, so jobs from several
+    clients are parsed at the same time by the pool.
+
+    Messages are unpickled, so anyone who knows the authkey and can reach the address can run code on
+    this host: keep the default localhost address unless the port is otherwise protected.
+    """
+
+    def __init__(self, address: Tuple[str, int] = DEFAULT_ADDRESS, authkey: Optional[bytes] = None,
+                 pool: Optional[ParserPool] = None) -> None:
+        authkey = authkey or get_authkey()
+        if authkey.decode(errors="replace") in INSECURE_AUTHKEYS:
+            raise ValueError("ParseServer needs a secret authkey.")
+        self.pool = pool or ParserPool()
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self._closed = threading.Event()
+
+    def serve_forever(self) -> None:
+        print(f"Parse server listening on {self.address} with {self.pool.max_workers} '{self.pool.parser_name}' workers")
+        while not self._closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break                                                   # listener closed
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    futures = [self.pool.submit(file_path) for file_path in message["files"]]
+                    conn.send({"documents": [data for future in futures for data in future.result()]})
+                except Exception as e:
+                    conn.send({"error": f"{type(e).__name__}: {e}"})
+
+    def close(self) -> None:
+        self._closed.set()
+        self.listener.close()
+        self.pool.close()
+
+
+class ParseClient:
+    """ Client of a ParseServer, keeps one connection open for all jobs. """
+
+    def __init__(self, address: Tuple[str, int] = DEFAULT_ADDRESS, authkey: Optional[bytes] = None) -> None:
+        self._conn = Client(address, authkey=authkey or get_authkey())
+        self._lock = threading.Lock()
+
+    def parse(self, file_paths: List[str]) -> List[Document]:
+        """ Parse files on the server. Paths must be valid on the server side. """
+        with self._lock:
+            self._conn.send({"files": list(file_paths)})
+            response = self._conn.recv()
+        if "error" in response:
+            raise RuntimeError(f"Parse server failed: {response['error']}")
+        return [dict_to_document(data) for data in response["documents"]]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a warm document parsing server.")
+    parser.add_argument("--serve", action="store_true", help="start the parse server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--parser", default="unstructured", choices=sorted(PARSERS))
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if not args.serve:
+        parser.print_help()
+        sys.exit(1)
+
+    try:
+        authkey = get_authkey(generate=False)                  # clients must be given the same key
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = ParseServer((args.host, args.port), authkey=authkey,
+                         pool=ParserPool(args.parser, max_workers=args.workers))
+    server.serve_forever()
@@ -1,8 +1,134 @@
-from langchain_community.document_loaders import PyPDFLoader
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from colearner.utils import get_path_hash
+
 
 def load_pdf(pdf_path:str) -> list:
     """Load a PDF file and return a list of documents."""
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
-    return docs
+    return list(iter_pdf_pages(pdf_path))
+
+
+class PageCache:
+    """ Extracted page texts on disk, keyed by (file hash, page number), so re-ingesting a PDF does not re-parse it. """
+
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        self.cache_dir = cache_dir or os.path.join(os.getenv("DATA_DIR", "data"), "cache", "pdf_pages")
+
+    def _path(self, file_hash: str, page: int) -> str:
+        return os.path.join(self.cache_dir, file_hash, f"{page}.json")
+
+    def has(self, file_hash: str, page: int) -> bool:
+        """ Whether the page is cached, without reading its text. """
+        return os.path.exists(self._path(file_hash, page))
+
+    def get(self, file_hash: str, page: int) -> Optional[str]:
+        try:
+            with open(self._path(file_hash, page), "r", encoding="utf-8") as f:
+                return json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, file_hash: str, page: int, text: str) -> None:
+        """ Write the page text atomically, so an interrupted run never leaves a partial cache entry. """
+        path = self._path(file_hash, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"text": text}, f)
+        os.replace(path + ".tmp", path)
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """ Number of pages of a PDF file. """
+    import pypdf
+    return len(pypdf.PdfReader(pdf_path).pages)
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """ Extract the texts of pages [start, end). Runs in a worker process, so it opens its own reader. """
+    import pypdf
+    reader = pypdf.PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def _page_ranges(pages: List[int], pages_per_task: int) -> List[Tuple[int, int]]:
+    """ Group sorted page numbers into contiguous [start, end) ranges of at most pages_per_task pages. """
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page and page - ranges[-1][0] < pages_per_task:
+            ranges[-1] = (ranges[-1][0], page + 1)
+        else:
+            ranges.append((page, page + 1))
+    return ranges
+
+
+def iter_pdf_pages(pdf_path: str,
+                   max_workers: Optional[int] = None,
+                   pages_per_task: int = 8,
+                   cache: Optional[PageCache] = None) -> Iterator[Document]:
+    """
+    Extract the pages of a PDF in parallel and yield them in page order as langchain Documents,
+    with the same metadata as PyPDFLoader ('source' and 'page').
+
+    Page ranges that are not in the page cache are fanned out to a process pool. At most two tasks per
+    worker are in flight and cached pages are read only when they are yielded, so memory stays bounded by
+    the pages waiting to be yielded rather than by the book.
+
+    Args:
+        pdf_path: path of the PDF file
+        max_workers: number of worker processes, defaults to the number of CPUs
+        pages_per_task: number of consecutive pages extracted by one task
+        cache: page cache, defaults to DATA_DIR/cache/pdf_pages
+    """
+    cache = cache or PageCache()
+    file_hash = get_path_hash(pdf_path)
+    num_pages = count_pdf_pages(pdf_path)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    missing_ranges = _page_ranges([page for page in range(num_pages) if not cache.has(file_hash, page)], pages_per_task)
+    ranges_by_start = {start: end for start, end in missing_ranges}
+    extracted = {}                                                    # pages of the current range, not yet yielded
+
+    def make_document(page: int) -> Document:
+        text = extracted.pop(page, None)
+        if text is None:
+            text = cache.get(file_hash, page)
+        if text is None:                                              # cache entry removed since it was checked
+            text = _extract_page_range(pdf_path, page, page + 1)[0]
+            cache.put(file_hash, page, text)
+        return Document(page_content=text, metadata={"source": pdf_path, "page": page})
+
+    def store(start: int, texts: List[str]) -> None:
+        for i, text in enumerate(texts):
+            cache.put(file_hash, start + i, text)
+            extracted[start + i] = text
+
+    if len(missing_ranges) <= 1 or max_workers == 1:                 # not worth starting worker processes
+        for page in range(num_pages):
+            if page in ranges_by_start:
+                store(page, _extract_page_range(pdf_path, page, ranges_by_start[page]))
+            yield make_document(page)
+        return
+
+    # spawn, not fork: this runs in Streamlit and job worker threads, and forking a threaded process can deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = {}                                                  # range start -> future
+        to_submit = iter(missing_ranges)
+
+        def submit_next():
+            next_range = next(to_submit, None)
+            if next_range is not None:
+                pending[next_range[0]] = executor.submit(_extract_page_range, pdf_path, *next_range)
+
+        for _ in range(2 * max_workers):
+            submit_next()
 
+        for page in range(num_pages):
+            if page in ranges_by_start:
+                texts = pending.pop(page).result()
+                submit_next()
+                store(page, texts)
+            yield make_document(page)
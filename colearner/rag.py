@@ -1,68 +1,124 @@
 import os
-from re import split
 import streamlit as st
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-import chromadb
 from colearner.utils import runtime
-import time
+from colearner.embeddings import get_embedding_function, get_collection_name
+from colearner.metrics import span
+
+
+def get_vectordb():
+    """ Chroma vectorstore of the configured embedding model, persisted in DATA_DIR/chromadb. """
+    import chromadb
+    from langchain_chroma import Chroma
+    
+    persistent_client = chromadb.PersistentClient(path=os.getenv('DATA_DIR')+"/chromadb")
+    return Chroma(
+        client=persistent_client,
+        collection_name=get_collection_name(),
+        embedding_function=get_embedding_function(),
+    )
+
+
+def get_retriever(vectordb=None, k=None):
+    """
+    mmr retriever over the vectorDB, without ingesting anything. Safe to call outside of the Streamlit script thread.
+    k (default RETRIEVER_K or 2) chunks are returned, chosen among 2*k candidates.
+    """
+    k = k or int(os.getenv("RETRIEVER_K", 2))
+    with span("build_retriever"):
+        vectordb = vectordb or get_vectordb()
+        return vectordb.as_retriever(search_type="mmr", search_kwargs={"k": k, "fetch_k": 2 * k})
+
+
+def split_documents(docs: list) -> list:
+    """ Split documents into chunks of CHUNK_SIZE tokens at headings, list items and pages, see colearner.splitter. """
+    from colearner.splitter import get_text_splitter
+    
+    return get_text_splitter().split_documents(docs)
 
 
 @runtime
 @st.spinner("Processing data for your Chatbot...")
-def configure_retriever(docs:list = [], doc_hash:str = "", update:bool = False):
+def configure_retriever(docs:list = [], doc_hash:str = "", update:bool = False, deduplicate:bool = True, source_id:str = ""):
     """
     Configure retriever for RAG model. Split documents, create embeddings and store in vectordb, and define retriever.
-    - Splitter: RecursiveCharacterTextSplitter
-    - Embeddings: HuggingFaceEmbeddings
+    - Splitter: StructureAwareSplitter, chunks sized in tokens that respect headings, list items and pages
+    - Embeddings: provider selected by EMBEDDING_MODEL env variable (openai, sentence_transformer, ollama, fake)
+    - Deduplication: near-duplicate chunks of the whole collection are dropped before embedding (MinHash)
     - Vectordb: ChromaDB (save to disk if CHROMADB_PATH provided as env variable, otherwise stores in memory)
     - Retrieval: mmr
     ---------------------------------------------------
     - Input: 
         - _docs: list of documents
         - doc_hash: hash string the documents used as unique id
+        - source_id: identity of the document source (file name or Notion page id). If given, chunks get content-hash ids
+                     and a re-ingested document is diffed against its stored chunks: only added chunks are embedded and
+                     removed chunks are deleted. Otherwise chunk ids are positional, doc_hash + "-" + i.
         - update (default=True): if True, create or update the vectordb with new documents, otherwise load the existing vectordb. 
+        - deduplicate (default=True): if True, skip embedding chunks that are near-duplicates of stored chunks.
     - Output: retriever object
     """
-    # Define the chromaDB client
-    
     print("======= Configuring vectorDB =======")
     
-    start_time = time.time()
-    embedding_function = OpenAIEmbeddings(model="text-embedding-3-large")
-    elapsed_time = time.time() - start_time
-    print(f"Elapsed time for embedding_function: {elapsed_time} seconds")
-    
-    start_time = time.time()
-    persistent_client = chromadb.PersistentClient(path=os.getenv('DATA_DIR')+"/chromadb")
-    elapsed_time = time.time() - start_time
-    print(f"Elapsed time for persistent_client: {elapsed_time} seconds")
-    
-    
-    vectordb = Chroma(
-        client=persistent_client,
-        collection_name="collection_name",
-        embedding_function=embedding_function,
-    )
+    vectordb = get_vectordb()
     
     if update:
         
-        start_time = time.time()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(docs)
-        elapsed_time = time.time() - start_time
-        print("Text splitting done! Total splits:", len(splits))
-        print(f"Elapsed time for splitting texts: {elapsed_time} seconds")
+        from colearner.splitter import chunk_size_stats
+        with span("split") as attributes:
+            splits = split_documents(docs)
+            attributes.update(chunk_size_stats(splits))
+        print("Text splitting done! Total splits:", len(splits), attributes)
+        
+    if update and source_id:
+        from colearner.dedup import get_dedup_index
+        from colearner.chunk_diff import sync_document_chunks
+        
+        dedup_index = get_dedup_index(get_collection_name()) if deduplicate else None
+        diff = sync_document_chunks(vectordb, source_id, splits, 
+                                    dedup_index = dedup_index, 
+                                    extra_metadata = {"doc_hash": doc_hash} if doc_hash else None)
+        if diff.orphans:
+            from colearner.jobs import IngestionQueue
+            IngestionQueue().resync_orphans(diff.orphans)          # documents deduplicated against replaced chunks
+        if dedup_index is not None:
+            dedup_index.save()
+    
+    elif update:
         
         hashes = [doc_hash+"-"+str(i) for i in range(len(splits))] # create unique ids for each split with common doc_hash
         assert len(hashes) == len(splits), "Hashes and splits length mismatch!"
         
-        start_time = time.time()
-        vectordb.add_documents(ids=hashes, documents=splits)
-        print(f"Elapsed time for adding docs to VectorDB: {elapsed_time} seconds")
+        if deduplicate:
+            from colearner.dedup import get_dedup_index
+            dedup_index = get_dedup_index(get_collection_name())
+            with span("dedup", chunks=len(splits)), dedup_index.lock:
+                indexed, linked = set(dedup_index.signatures), set(dedup_index.links)
+                hashes, splits, report = dedup_index.filter_documents(hashes, splits)
+            print(report)
+        
+        try:
+            if splits:
+                with span("embed", chunks=len(splits)):
+                    embeddings = vectordb.embeddings.embed_documents([split.page_content for split in splits])
+                with span("insert", chunks=len(splits)):
+                    vectordb._collection.upsert(ids=hashes, embeddings=embeddings,
+                                                documents=[split.page_content for split in splits],
+                                                metadatas=[split.metadata for split in splits])
+        except Exception:
+            if deduplicate:                                        # forget chunks that were never stored
+                with dedup_index.lock:
+                    dedup_index.remove([i for i in hashes if i not in indexed] + 
+                                       [i for i in report.duplicates if i not in linked])
+            raise
+        if deduplicate:
+            dedup_index.save()                                     # save after adding, so the index never holds unstored chunks
+        
+        if deduplicate and report.duplicate_chunks:
+            stored = vectordb.get(limit=1, include=["embeddings"])
+            embedding_size = len(stored["embeddings"][0]) if stored["embeddings"] else 0
+            print(f"Estimated storage saved by deduplication: {report.storage_saved(embedding_size)} bytes")
         
-    retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 2, "fetch_k": 4})
+    retriever = get_retriever(vectordb)
     
     print("Retriever configured successfully!")
     
@@ -0,0 +1,461 @@
+"""
+Process-wide client-side rate limiting of the OpenAI API, shared by the chat model and the embeddings.
+
+Requests wait in a token bucket limiter of requests and tokens per minute (OPENAI_RPM, OPENAI_TPM) before they
+are sent. Chat turns have priority over background embedding, which also leaves a share of the buckets free for
+interactive calls. A 429 response pauses every caller for its Retry-After delay before the request is retried.
+Concurrent single query embeddings are coalesced into one batch request. Latency, throttle time, tokens and
+429 responses are recorded per caller in the metrics registry.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from colearner.metrics import registry
+from colearner.tokenizer import count_tokens
+
+
+CHAT = 0                      # priorities, lower is served first
+EMBEDDING_QUERY = 1
+EMBEDDING = 2
+
+
+class TokenBucket:
+    """ Bucket of `per_minute` units refilled continuously. The level can go negative to pause all callers. """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """ Seconds until `amount` can be taken while leaving `reserve` in the bucket. """
+        missing = amount + reserve - self.level
+        return max(0.0, missing / self.rate)
+
+
+@dataclass
+class CallerStats:
+    requests: int = 0
+    tokens: int = 0
+    throttle_seconds: float = 0.0
+    latency_seconds: float = 0.0
+    rate_limited: int = 0                                           # 429 responses
+
+    def as_dict(self) -> Dict[str, float]:
+        return {"requests": self.requests, "tokens": self.tokens, "throttle_seconds": self.throttle_seconds,
+                "mean_latency": self.latency_seconds / self.requests if self.requests else 0.0,
+                "rate_limited": self.rate_limited}
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """ Seconds to wait after a 429 error, from its Retry-After header, or None if the error is not a 429. """
+    if getattr(error, "status_code", None) != 429 and type(error).__name__ != "RateLimitError":
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after-ms")) / 1000
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RateLimiter:
+    """
+    Token bucket limiter of requests and tokens per minute, served in priority order.
+
+    Args:
+        requests_per_minute: request budget, 0 for no limit
+        tokens_per_minute: token budget, 0 for no limit
+        background_headroom: share of both buckets that background (EMBEDDING priority) requests cannot use
+        max_retries: retries of a request answered with 429
+    """
+
+    def __init__(self, requests_per_minute: float = 3000, tokens_per_minute: float = 1_000_000,
+                 background_headroom: float = 0.1, max_retries: int = 3) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.background_headroom = background_headroom
+        self.max_retries = max_retries
+        self.stats: Dict[str, CallerStats] = {}
+        self._condition = threading.Condition()
+        self._waiters: List = []                                     # heap of (priority, ticket)
+        self._tickets = itertools.count()
+
+    def _wait_time(self, requests: int, tokens: int, priority: int) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, amount in ((self.requests, requests), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                reserve = bucket.capacity * self.background_headroom if priority >= EMBEDDING else 0.0
+                wait = max(wait, bucket.wait_time(min(amount, bucket.capacity - reserve), reserve))
+        return wait
+
+    def acquire(self, tokens: int = 0, priority: int = EMBEDDING, caller: str = "embeddings", requests: int = 1) -> float:
+        """ Block until the request can be sent, after every waiting request of a higher priority. Returns the seconds waited. """
+        start = time.perf_counter()
+        with self._condition:
+            waiter = (priority, next(self._tickets))
+            heapq.heappush(self._waiters, waiter)
+            self._condition.notify_all()                               # a waiting request of lower priority steps back
+            try:
+                while True:
+                    if self._waiters[0] == waiter:
+                        wait = self._wait_time(requests, tokens, priority)
+                        if wait <= 0:
+                            for bucket, amount in ((self.requests, requests), (self.tokens, tokens)):
+                                if bucket is not None:
+                                    bucket.level -= min(amount, bucket.capacity)
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+        waited = time.perf_counter() - start
+        with self._condition:
+            stats = self.stats.setdefault(caller, CallerStats())
+            stats.throttle_seconds += waited
+        registry.observe(caller, waited, metric="rate_limit_wait_seconds")
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """ Hold back every caller for `seconds`, after a 429 response. """
+        with self._condition:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, -seconds * bucket.rate)
+            self._condition.notify_all()
+
+    def record(self, caller: str, latency: float, tokens: int = 0, requests: int = 1, rate_limited: bool = False) -> None:
+        with self._condition:
+            stats = self.stats.setdefault(caller, CallerStats())
+            if rate_limited:
+                stats.rate_limited += 1
+            else:
+                stats.requests += requests
+                stats.tokens += tokens
+                stats.latency_seconds += latency
+        if rate_limited:
+            registry.increment("rate_limited_responses", stage=caller)
+        else:
+            registry.observe(caller, latency, metric="api_latency_seconds")
+            registry.increment("api_tokens", tokens, stage=caller)
+
+    def _retry_delay(self, error: Exception, attempt: int, caller: str) -> Optional[float]:
+        """
+        Seconds to back off before retrying after `error`, or None if it should be raised.
+        A 429 pauses every caller; server and connection errors (retried by the OpenAI client unless the limiter
+        is used) only back off this request.
+        """
+        if attempt >= self.max_retries:
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            self.record(caller, 0.0, rate_limited=True)
+            self.pause(retry_after or min(60.0, 2.0 ** attempt))
+            return 0.0                                                # acquire waits for the pause
+        if (getattr(error, "status_code", None) or 0) >= 500 or type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+            return min(30.0, 0.5 * 2.0 ** attempt)
+        return None
+
+    def _retry(self, error: Exception, attempt: int, caller: str) -> bool:
+        """ Wait before retrying after `error` and return True, or return False if it should be raised. """
+        delay = self._retry_delay(error, attempt, caller)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def _aretry(self, error: Exception, attempt: int, caller: str) -> bool:
+        delay = self._retry_delay(error, attempt, caller)
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def call(self, func: Callable[[], Any], tokens: int = 0, priority: int = EMBEDDING, caller: str = "embeddings",
+             requests: int = 1) -> Any:
+        """ Call func once the limiter allows it, retrying 429 errors. """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority, caller, requests)
+            start = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                if not self._retry(e, attempt, caller):
+                    raise
+                continue
+            self.record(caller, time.perf_counter() - start, tokens, requests)
+            return result
+
+    def stream(self, func: Callable[[], Iterator], tokens: int = 0, priority: int = CHAT, caller: str = "chat") -> Iterator:
+        """ Iterate over func() once the limiter allows it, retrying 429 errors raised before the first chunk. """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority, caller)
+            start = time.perf_counter()
+            iterator = iter(func())
+            try:
+                first = next(iterator, None)
+            except Exception as e:
+                if not self._retry(e, attempt, caller):
+                    raise
+                continue
+            if first is not None:
+                yield first
+                yield from iterator
+            self.record(caller, time.perf_counter() - start, tokens)
+            return
+
+    async def acall(self, func: Callable[[], Awaitable], tokens: int = 0, priority: int = EMBEDDING,
+                    caller: str = "embeddings", requests: int = 1) -> Any:
+        """ Await func() once the limiter allows it, retrying 429 errors. The limiter is waited for in a thread. """
+        for attempt in itertools.count():
+            await asyncio.to_thread(self.acquire, tokens, priority, caller, requests)
+            start = time.perf_counter()
+            try:
+                result = await func()
+            except Exception as e:
+                if not await self._aretry(e, attempt, caller):
+                    raise
+                continue
+            self.record(caller, time.perf_counter() - start, tokens, requests)
+            return result
+
+    async def astream(self, func: Callable[[], AsyncIterator], tokens: int = 0, priority: int = CHAT,
+                      caller: str = "chat") -> AsyncIterator:
+        """ Async version of stream: 429 errors raised before the first chunk are retried. """
+        for attempt in itertools.count():
+            await asyncio.to_thread(self.acquire, tokens, priority, caller)
+            start = time.perf_counter()
+            iterator = func().__aiter__()
+            try:
+                first = await anext(iterator, None)
+            except Exception as e:
+                if not await self._aretry(e, attempt, caller):
+                    raise
+                continue
+            if first is not None:
+                yield first
+                async for chunk in iterator:
+                    yield chunk
+            self.record(caller, time.perf_counter() - start, tokens)
+            return
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """ Requests, tokens, throttle time, mean latency and 429 responses per caller. """
+        with self._condition:
+            return {caller: stats.as_dict() for caller, stats in self.stats.items()}
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """ The process-wide OpenAI rate limiter, configured by OPENAI_RPM and OPENAI_TPM. """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(requests_per_minute=float(os.getenv("OPENAI_RPM", 3000)),
+                                        tokens_per_minute=float(os.getenv("OPENAI_TPM", 1_000_000)))
+        return _rate_limiter
+
+
+# ------------------------------------------------------------
+#                          Embeddings
+# ------------------------------------------------------------
+
+class _Pending:
+    __slots__ = ("text", "done", "vector", "error")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.done = threading.Event()
+        self.vector = None
+        self.error = None
+
+
+class QueryBatcher:
+    """
+    Coalesce concurrent single-text calls into batches: the first caller waits up to `max_wait` seconds for
+    others (or for `max_batch` texts), then embeds the whole batch in one call and hands out the vectors.
+    A caller with no other call queued or in flight is sent at once, so a lone query never waits.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], max_batch: int = 64,
+                 max_wait: float = 0.005) -> None:
+        self.embed_batch = embed_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending: List[_Pending] = []
+        self._collecting = False
+        self._in_flight = 0                                           # batches being embedded
+        self._full = threading.Event()
+
+    def embed(self, text: str) -> List[float]:
+        item = _Pending(text)
+        with self._lock:
+            self._pending.append(item)
+            leader = not self._collecting
+            alone = len(self._pending) == 1 and not self._in_flight
+            self._collecting = True
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+
+        if leader:
+            if not alone:
+                self._full.wait(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._collecting = False
+                self._in_flight += 1
+                self._full.clear()
+            texts = list(dict.fromkeys(pending.text for pending in batch))
+            try:
+                vectors = dict(zip(texts, self.embed_batch(texts)))
+                for pending in batch:
+                    pending.vector = vectors[pending.text]
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                for pending in batch:
+                    pending.done.set()
+
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.vector
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Embeddings sent through the shared rate limiter: documents with background priority, queries with
+    priority over documents and coalesced into batches. embed_documents takes another priority for texts
+    embedded during a chat turn, e.g. EMBEDDING_QUERY for the sentences of context compression.
+    """
+
+    def __init__(self, embeddings: Embeddings, limiter: Optional[RateLimiter] = None, coalesce_wait: float = 0.005,
+                 max_batch: int = 64) -> None:
+        self.embeddings = embeddings
+        self.limiter = limiter or get_rate_limiter()
+        self.batcher = QueryBatcher(self._embed_queries, max_batch=max_batch, max_wait=coalesce_wait)
+
+    def __getattr__(self, name):                                      # model, chunk_size, ... of the wrapped embeddings
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _requests(self, texts: List[str]) -> int:
+        batch_size = getattr(self.embeddings, "chunk_size", 0) or len(texts) or 1
+        return max(1, -(-len(texts) // batch_size))
+
+    def _batches(self, texts: List[str]) -> Iterator:
+        """
+        (texts, tokens) batches of at most the wrapped model's chunk_size texts, and of at most the tokens
+        a request can take from the token bucket, so a large input is paced by the limiter batch by batch.
+        """
+        batch_size = getattr(self.embeddings, "chunk_size", 0) or len(texts)
+        bucket = self.limiter.tokens
+        max_tokens = bucket.capacity * (1 - self.limiter.background_headroom) if bucket is not None else float("inf")
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def embed_documents(self, texts: List[str], priority: int = EMBEDDING) -> List[List[float]]:
+        """ Embed texts batch by batch, each acquired from the limiter and retried on its own. """
+        caller = "embed_documents" if priority >= EMBEDDING else "embed_query"
+        vectors = []
+        for batch, tokens in self._batches(texts):
+            vectors.extend(self.limiter.call(lambda batch=batch: self.embeddings.embed_documents(batch), tokens,
+                                             priority, caller))
+        return vectors
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        tokens = sum(count_tokens(text) for text in texts)
+        return self.limiter.call(lambda: self.embeddings.embed_documents(texts), tokens, EMBEDDING_QUERY,
+                                 "embed_query", self._requests(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed(text)
+
+
+# ------------------------------------------------------------
+#                          Chat model
+# ------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def _rate_limited_chat_class():
+    """ ChatOpenAI subclass sending its requests through the rate limiter, defined on first use (heavy import). """
+    from langchain_openai import ChatOpenAI
+
+    class RateLimitedChatOpenAI(ChatOpenAI):
+        limiter: Any = None
+        caller: str = "chat"
+
+        def _tokens(self, messages) -> int:
+            prompt = sum(count_tokens(str(message.content)) for message in messages)
+            return prompt + (self.max_tokens or 256)                  # the completion counts towards TPM too
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            parent = super()
+            return self.limiter.call(lambda: parent._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                                     self._tokens(messages), CHAT, self.caller)
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            parent = super()
+            yield from self.limiter.stream(lambda: parent._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                                           self._tokens(messages), CHAT, self.caller)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            parent = super()
+            return await self.limiter.acall(lambda: parent._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                                            self._tokens(messages), CHAT, self.caller)
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            parent = super()
+            async for chunk in self.limiter.astream(
+                    lambda: parent._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                    self._tokens(messages), CHAT, self.caller):
+                yield chunk
+
+    return RateLimitedChatOpenAI
+
+
+def rate_limited_chat_openai(limiter: Optional[RateLimiter] = None, caller: str = "chat", **kwargs):
+    """ ChatOpenAI(**kwargs) whose requests go through the shared rate limiter with chat priority. """
+    kwargs.setdefault("max_retries", 0)                               # retried by the limiter
+    return _rate_limited_chat_class()(limiter=limiter or get_rate_limiter(), caller=caller, **kwargs)
@@ -0,0 +1,230 @@
+"""
+Portable snapshots of the knowledge base, to restore it in a fresh environment without re-embedding.
+
+    python -m colearner.snapshot export knowledge_base.zip
+    python -m colearner.snapshot import knowledge_base.zip
+
+A snapshot is a zip archive (deflate compressed) with:
+    manifest.json                  format version, collection, embedding provider, model and size, documents, parts and checksums
+    parts/<n>/records.jsonl        chunk ids, texts and metadatas, one chunk per line
+    parts/<n>/embeddings.npy       float32 embeddings of the same chunks, in the same order
+    dedup.json                     near-duplicate index of the collection, if there is one
+
+The collection is exported and imported one part at a time, so memory is bounded by the part size, and every
+part is checked against its sha256 in the manifest before it is loaded. Import upserts the stored embeddings
+in bulk, so it makes no embedding calls and importing the same snapshot twice is harmless.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import zipfile
+import argparse
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+SNAPSHOT_FORMAT = "colearner-snapshot"
+SNAPSHOT_VERSION = 2                               # 2: the manifest records the embedding model
+
+
+class SnapshotError(ValueError):
+    """ The snapshot is invalid, corrupted or incompatible with the target collection. """
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _iter_collection(collection, part_size: int) -> Iterator[Dict[str, Any]]:
+    """ Pages of a Chroma collection with ids, documents, metadatas and embeddings. """
+    for offset in range(0, collection.count(), part_size):
+        yield collection.get(limit=part_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+
+
+def _document_list(documents: Dict[str, Dict[str, Any]], ids: List[str], metadatas: List[Dict]) -> None:
+    """ Count chunks per document id prefix, with the source of its first chunk, as listed in the app. """
+    for chunk_id, metadata in zip(ids, metadatas):
+        doc_id = chunk_id.split("-")[0]
+        entry = documents.setdefault(doc_id, {"doc_id": doc_id, "source": (metadata or {}).get("source", ""), "chunks": 0})
+        entry["chunks"] += 1
+
+
+def export_snapshot(vectordb, path: str, part_size: int = 5000, dedup_index=None) -> Dict[str, Any]:
+    """
+    Write the chunks of the vectorDB collection to a snapshot archive.
+
+    Args:
+        vectordb: langchain Chroma vectorstore
+        path: archive path, written atomically
+        part_size: number of chunks per part
+        dedup_index: near-duplicate index of the collection to include, if any
+    Returns:
+        the manifest
+    """
+    from colearner.embeddings import get_embedding_model_name, get_embedding_provider_name
+
+    collection = vectordb._collection
+    manifest = {"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "created_at": time.time(),
+                "collection": collection.name, "embedding_provider": get_embedding_provider_name(),
+                "embedding_model": get_embedding_model_name(), "embedding_size": 0, "chunks": 0, "parts": [], "documents": []}
+    documents: Dict[str, Dict[str, Any]] = {}
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-snapshot-")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+            for i, page in enumerate(_iter_collection(collection, part_size)):
+                embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+                records = "".join(json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n"
+                                  for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]))
+                embeddings_file = io.BytesIO()
+                np.save(embeddings_file, embeddings, allow_pickle=False)
+
+                part = {"name": f"parts/{i:05d}", "chunks": len(page["ids"])}
+                for member, data in [("records.jsonl", records.encode("utf-8")),
+                                     ("embeddings.npy", embeddings_file.getvalue())]:
+                    archive.writestr(f"{part['name']}/{member}", data)
+                    part[member] = _sha256(data)
+                manifest["parts"].append(part)
+                manifest["chunks"] += part["chunks"]
+                manifest["embedding_size"] = int(embeddings.shape[1]) if embeddings.ndim == 2 else 0
+                _document_list(documents, page["ids"], page["metadatas"])
+
+            if dedup_index is not None and len(dedup_index):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    dedup_index.save(os.path.join(tmp_dir, "dedup.json"))
+                    with open(os.path.join(tmp_dir, "dedup.json"), "rb") as f:
+                        data = f.read()
+                archive.writestr("dedup.json", data)
+                manifest["dedup"] = _sha256(data)
+
+            manifest["documents"] = list(documents.values())
+            archive.writestr("manifest.json", json.dumps(manifest, indent=1))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    print(f"Exported {manifest['chunks']} chunks of {len(documents)} documents to {path}")
+    return manifest
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    """ Manifest of a snapshot archive, checked for format and version. """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise SnapshotError(f"{path} is not a snapshot archive: {e}")
+
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{path} is not a snapshot archive")
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot version {manifest['version']} is newer than the supported version {SNAPSHOT_VERSION}")
+    return manifest
+
+
+def _read_member(archive: zipfile.ZipFile, name: str, sha256: str) -> bytes:
+    data = archive.read(name)
+    if _sha256(data) != sha256:
+        raise SnapshotError(f"Checksum mismatch in {name}, the snapshot is corrupted")
+    return data
+
+
+def _read_part(archive: zipfile.ZipFile, part: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    records = [json.loads(line) for line in
+               _read_member(archive, f"{part['name']}/records.jsonl", part["records.jsonl"]).decode("utf-8").splitlines()]
+    embeddings = np.load(io.BytesIO(_read_member(archive, f"{part['name']}/embeddings.npy", part["embeddings.npy"])),
+                         allow_pickle=False)
+    if len(records) != len(embeddings) or len(records) != part["chunks"]:
+        raise SnapshotError(f"{part['name']} has {len(records)} chunks and {len(embeddings)} embeddings, expected {part['chunks']}")
+    return records, embeddings
+
+
+def import_snapshot(vectordb, path: str, batch_size: int = 5000, dedup_index=None, force: bool = False) -> Dict[str, Any]:
+    """
+    Bulk-load a snapshot archive into the vectorDB collection with the stored embeddings.
+
+    Args:
+        vectordb: langchain Chroma vectorstore
+        path: archive written by export_snapshot
+        batch_size: number of chunks per upsert, capped by the chromaDB maximum batch size
+        dedup_index: near-duplicate index of the collection, merged with the index of the snapshot
+        force: import even if the snapshot was made with another embedding provider or model
+    Returns:
+        the manifest
+    """
+    from colearner.embeddings import get_embedding_model_name, get_embedding_provider_name
+
+    manifest = read_manifest(path)
+    collection = vectordb._collection
+    snapshot_model = (manifest["embedding_provider"], manifest.get("embedding_model"))   # no model in version 1 snapshots
+    configured_model = (get_embedding_provider_name(), get_embedding_model_name())
+    if snapshot_model != configured_model and not force:
+        raise SnapshotError(f"Snapshot embeddings were made with {'/'.join(map(str, snapshot_model))}, but the configured "
+                            f"model is {'/'.join(configured_model)}. Their embeddings are not comparable.")
+    stored = collection.get(limit=1, include=["embeddings"])["embeddings"]
+    if stored is not None and len(stored) and manifest["chunks"] and len(stored[0]) != manifest["embedding_size"]:
+        raise SnapshotError(f"Snapshot embeddings have size {manifest['embedding_size']}, "
+                            f"the collection has size {len(stored[0])}")
+
+    if hasattr(vectordb._client, "get_max_batch_size"):
+        batch_size = min(batch_size, vectordb._client.get_max_batch_size())
+
+    with zipfile.ZipFile(path) as archive:
+        for part in manifest["parts"]:
+            records, embeddings = _read_part(archive, part)
+            for start in range(0, len(records), batch_size):
+                batch = records[start:start + batch_size]
+                collection.upsert(ids=[r["id"] for r in batch],
+                                  embeddings=embeddings[start:start + batch_size].tolist(),
+                                  documents=[r["document"] for r in batch],
+                                  metadatas=[r["metadata"] for r in batch])
+
+        if dedup_index is not None and "dedup" in manifest:
+            data = _read_member(archive, "dedup.json", manifest["dedup"])
+            with tempfile.TemporaryDirectory() as tmp_dir, dedup_index.lock:
+                with open(os.path.join(tmp_dir, "dedup.json"), "wb") as f:
+                    f.write(data)
+                links = dict(dedup_index.links)
+                dedup_index.load(os.path.join(tmp_dir, "dedup.json"))
+                dedup_index.links = {**links, **dedup_index.links}
+                dedup_index.save()
+
+    print(f"Imported {manifest['chunks']} chunks of {len(manifest['documents'])} documents from {path}")
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    from colearner.rag import get_vectordb
+    from colearner.dedup import get_dedup_index
+    from colearner.embeddings import get_collection_name
+
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the knowledge base.")
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("path", help="snapshot archive")
+    parser.add_argument("--part-size", type=int, default=5000, help="chunks per part when exporting")
+    parser.add_argument("--force", action="store_true", help="import embeddings of another embedding provider or model")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        manifest = read_manifest(args.path)
+        print(json.dumps({k: v for k, v in manifest.items() if k != "parts"}, indent=1))
+        return manifest
+
+    vectordb = get_vectordb()
+    dedup_index = get_dedup_index(get_collection_name())
+    if args.command == "export":
+        return export_snapshot(vectordb, args.path, part_size=args.part_size, dedup_index=dedup_index)
+    return import_snapshot(vectordb, args.path, dedup_index=dedup_index, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
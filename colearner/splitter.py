@@ -0,0 +1,276 @@
+"""
+Structure-aware text splitter sized in tokens.
+
+Each document (a PDF page, a Notion page rendered as markdown, a file) is parsed into blocks: headings,
+list items, code fences and paragraphs. A heading always starts a new chunk, so chunks never mix sections,
+and blocks are packed whole into chunks of at most chunk_size tokens, with chunk_overlap tokens of trailing
+blocks repeated at the start of the next chunk of the same section. Blocks larger than a chunk are split at
+lines, then sentences, then words. Form feeds are page breaks that no chunk crosses.
+
+Large inputs are split across a process pool. The output is the same as a serial run, in the same order,
+so content-hash chunk ids (chunk_diff) stay deterministic.
+"""
+
+import os
+import re
+import statistics
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from colearner.tokenizer import count_tokens, get_encoding
+
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+•]|\d+[.)]|\[[ xX]\])\s+")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_SPLIT_LEVELS = ((re.compile(r"\n+"), "\n"), (re.compile(r"(?<=[.!?;:])\s+"), " "), (re.compile(r"\s+"), " "))
+
+
+@dataclass
+class Block:
+    kind: str                      # 'heading', 'list', 'code' or 'paragraph'
+    text: str
+    level: int = 0                 # heading level
+
+
+def parse_blocks(text: str) -> List[Block]:
+    """ Blocks of a markdown-like text, in order. Lines of a paragraph or list item are kept together. """
+    blocks: List[Block] = []
+    lines: List[str] = []
+    kind = "paragraph"
+
+    def flush():
+        nonlocal lines
+        if any(line.strip() for line in lines):
+            blocks.append(Block(kind, "\n".join(lines).strip("\n")))
+        lines = []
+
+    fence = None
+    for line in text.replace("\r\n", "\n").split("\n"):
+        if fence is not None:
+            lines.append(line)
+            if line.strip().startswith(fence):
+                flush()
+                fence, kind = None, "paragraph"
+            continue
+        if match := _FENCE.match(line):
+            flush()
+            fence, kind, lines = match.group(1), "code", [line]
+        elif not line.strip():
+            flush()
+            kind = "paragraph"
+        elif match := _HEADING.match(line):
+            flush()
+            blocks.append(Block("heading", line.strip(), level=len(match.group(1))))
+            kind = "paragraph"
+        elif _LIST_ITEM.match(line):
+            flush()
+            kind, lines = "list", [line]
+        else:
+            lines.append(line)
+    flush()
+    return blocks
+
+
+def _split_batch(args: Tuple[int, int, List[Document]]) -> List[Tuple[Document, int]]:
+    """ Process pool task: split a batch of documents. """
+    chunk_size, chunk_overlap, docs = args
+    return StructureAwareSplitter(chunk_size, chunk_overlap, max_workers=1)._split_serial(docs)
+
+
+class StructureAwareSplitter:
+    """
+    Split documents at headings, list items and page breaks into chunks of at most chunk_size tokens.
+
+    Args:
+        chunk_size: maximum tokens per chunk (CHUNK_SIZE, 256 by default)
+        chunk_overlap: tokens of the previous chunk repeated within a section (CHUNK_OVERLAP, 48 by default)
+        max_workers: worker processes for large inputs, defaults to the number of CPUs
+        parallel_threshold: characters of input from which the process pool is used
+
+    Chunks keep the metadata of their document, with 'tokens' (token count of the chunk) and 'section'
+    (heading path like 'Title > Subtitle', when the chunk is under a heading).
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None,
+                 max_workers: Optional[int] = None, parallel_threshold: int = 1_000_000) -> None:
+        self.chunk_size = chunk_size or int(os.getenv("CHUNK_SIZE", 256))
+        self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", 48)) if chunk_overlap is None else chunk_overlap
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError(f"Chunk overlap ({self.chunk_overlap}) must be smaller than the chunk size ({self.chunk_size}).")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+
+    # -------------------- text --------------------
+
+    def _hard_split(self, text: str) -> List[str]:
+        """ Split a text without separators (e.g. a long URL) into pieces of chunk_size tokens. """
+        encoding = get_encoding()
+        if encoding is None:
+            step = 4 * self.chunk_size                                 # count_tokens estimates 4 characters per token
+            return [text[i:i + step] for i in range(0, len(text), step)]
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + self.chunk_size]) for i in range(0, len(tokens), self.chunk_size)]
+
+    def _units(self, text: str, separator: str, level: int = 0) -> List[Tuple[str, str, int]]:
+        """ (separator, text, tokens) pieces of at most chunk_size tokens, split at lines, sentences, then words. """
+        tokens = count_tokens(text)
+        if tokens <= self.chunk_size:
+            return [(separator, text, tokens)]
+        for pattern, inner_separator in _SPLIT_LEVELS[level:]:
+            level += 1
+            parts = [part for part in pattern.split(text) if part.strip()]
+            if len(parts) > 1:
+                units = []
+                for i, part in enumerate(parts):
+                    units += self._units(part, separator if i == 0 else inner_separator, level)
+                return units
+        return [(separator if i == 0 else "", piece, count_tokens(piece)) for i, piece in enumerate(self._hard_split(text))]
+
+    def _pack(self, units: List[Tuple[str, str, int]], overlap: int) -> List[Tuple[str, int]]:
+        """ Pack units greedily into chunks, repeating up to `overlap` tokens of trailing units in the next chunk. """
+        chunks, current, size = [], [], 0
+
+        def join(units):
+            return units[0][1] + "".join(sep + piece for sep, piece, _ in units[1:])
+
+        def emit():
+            text = join(current)
+            tokens = count_tokens(text)
+            if tokens > self.chunk_size and len(current) > 1:           # separators merged into extra tokens
+                for unit in current:
+                    chunks.append((unit[1], unit[2]))
+            else:
+                chunks.append((text, tokens))
+
+        for unit in units:
+            cost = unit[2] + (1 if current else 0)                     # one token for the separator
+            if current and size + cost > self.chunk_size:
+                exact = count_tokens(join(current + [unit]))           # the sum of unit counts overestimates
+                if exact <= self.chunk_size:
+                    current.append(unit)
+                    size = exact
+                    continue
+                emit()
+                kept, kept_size = [], 0
+                for previous in reversed(current):
+                    if kept_size + previous[2] + 1 > overlap:
+                        break
+                    kept.insert(0, previous)
+                    kept_size += previous[2] + 1
+                while kept and kept_size + unit[2] + 1 > self.chunk_size:
+                    kept_size -= kept.pop(0)[2] + 1
+                current, size = kept, kept_size
+                cost = unit[2] + (1 if current else 0)
+            current.append(unit)
+            size += cost
+        if current:
+            emit()
+        return chunks
+
+    def split_text(self, text: str) -> List[Tuple[str, int, str]]:
+        """ (chunk text, tokens, section) of a text. """
+        chunks = []
+        for page in text.split("\f"):
+            headings: List[Tuple[int, str]] = []
+            section_units: List[Tuple[str, str, int]] = []
+
+            def close_section():
+                section = " > ".join(title for _, title in headings)
+                chunks.extend((chunk, tokens, section) for chunk, tokens in self._pack(section_units, self.chunk_overlap))
+
+            previous_kind = None
+            for block in parse_blocks(page):
+                if block.kind == "heading":
+                    close_section()
+                    while headings and headings[-1][0] >= block.level:
+                        headings.pop()
+                    headings.append((block.level, block.text.lstrip("#").strip()))
+                    section_units = []
+                separator = "\n" if block.kind == "list" and previous_kind in ("list", "heading") else "\n\n"
+                if previous_kind == "heading":
+                    separator = "\n"
+                section_units += self._units(block.text, separator)
+                previous_kind = block.kind
+            close_section()
+        return chunks
+
+    # -------------------- documents --------------------
+
+    def _split_serial(self, docs: List[Document]) -> List[Tuple[Document, int]]:
+        chunks = []
+        for doc in docs:
+            for text, tokens, section in self.split_text(doc.page_content):
+                metadata = {**doc.metadata, "tokens": tokens}
+                if section:
+                    metadata["section"] = section
+                chunks.append((Document(page_content=text, metadata=metadata), tokens))
+        return chunks
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        """ Split documents in order, across worker processes when the input is large. """
+        docs = list(docs)
+        total = sum(len(doc.page_content) for doc in docs)
+        if self.max_workers == 1 or len(docs) < 2 or total < self.parallel_threshold:
+            return [chunk for chunk, _ in self._split_serial(docs)]
+
+        batches, batch, batch_size = [], [], 0                          # contiguous batches keep the order
+        target = max(1, total // (4 * self.max_workers))
+        for doc in docs:
+            batch.append(doc)
+            batch_size += len(doc.page_content)
+            if batch_size >= target:
+                batches.append(batch)
+                batch, batch_size = [], 0
+        if batch:
+            batches.append(batch)
+
+        # spawn, not fork: ingestion runs in Streamlit and job worker threads, and forking a threaded process can deadlock
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(batches)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = executor.map(_split_batch, [(self.chunk_size, self.chunk_overlap, b) for b in batches])
+            return [chunk for result in results for chunk, _ in result]
+
+    def iter_split_documents(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        Split a stream of documents in order, e.g. PDF pages as they are extracted. Documents are buffered
+        up to parallel_threshold characters, so large inputs still use the process pool without being
+        held in memory as a whole.
+        """
+        batch, batch_size = [], 0
+        for doc in docs:
+            batch.append(doc)
+            batch_size += len(doc.page_content)
+            if batch_size >= self.parallel_threshold:
+                yield from self.split_documents(batch)
+                batch, batch_size = [], 0
+        if batch:
+            yield from self.split_documents(batch)
+
+
+def chunk_size_stats(chunks: List[Document]) -> Dict[str, float]:
+    """ Chunk count and token size distribution (min, p50, p95, max, mean) of split documents. """
+    sizes = sorted(chunk.metadata["tokens"] if "tokens" in chunk.metadata else count_tokens(chunk.page_content)
+                   for chunk in chunks)
+    if not sizes:
+        return {"chunks": 0, "tokens": 0}
+    return {"chunks": len(sizes), "tokens": sum(sizes), "tokens_min": sizes[0],
+            "tokens_p50": sizes[len(sizes) // 2], "tokens_p95": sizes[min(len(sizes) - 1, int(0.95 * len(sizes)))],
+            "tokens_max": sizes[-1], "tokens_mean": statistics.fmean(sizes)}
+
+
+_splitter: Optional[StructureAwareSplitter] = None
+_splitter_lock = threading.Lock()
+
+
+def get_text_splitter() -> StructureAwareSplitter:
+    """ Splitter shared by the ingestion paths, configured by CHUNK_SIZE and CHUNK_OVERLAP. """
+    global _splitter
+    with _splitter_lock:
+        if _splitter is None:
+            _splitter = StructureAwareSplitter()
+        return _splitter
@@ -0,0 +1,107 @@
+"""
+Cold start profiling: import-time breakdown of the modules the app loads before its first render.
+
+    python -m colearner.startup                       # report of the app startup imports
+    python -m colearner.startup --json startup.json   # also write it as JSON, to compare releases
+    python -m colearner.startup colearner.rag         # profile other modules
+
+Imports are timed in a fresh interpreter with `python -X importtime`, so modules already loaded in
+the current process do not hide their cost.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+
+# modules imported by app.py before the page is rendered
+APP_STARTUP_MODULES = ["streamlit", "dotenv", "colearner.utils", "colearner.blob_store",
+                       "colearner.chunk_diff", "colearner.jobs", "colearner.metrics"]
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int                  # time spent in the module itself, microseconds
+    cumulative_us: int            # including the modules it imported
+    depth: int                    # 0 for modules imported directly by the profiled statement
+
+
+@dataclass
+class StartupReport:
+    modules: List[str]
+    wall_time_s: float                                            # interpreter start to end of the imports
+    import_time_s: float                                          # sum of the top-level cumulative import times
+    timings: List[ImportTiming] = field(default_factory=list)
+
+    def top_level(self) -> List[ImportTiming]:
+        return sorted((t for t in self.timings if t.depth == 0), key=lambda t: -t.cumulative_us)
+
+    def by_package(self) -> Dict[str, float]:
+        """ Self time per top-level package in seconds, e.g. how much of the start is spent in langchain_core. """
+        packages: Dict[str, float] = {}
+        for timing in self.timings:
+            package = timing.module.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + timing.self_us / 1e6
+        return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+    def format(self, top: int = 15) -> str:
+        lines = [f"Startup imports of {', '.join(self.modules)}",
+                 f"  wall time: {self.wall_time_s:.3f} s, import time: {self.import_time_s:.3f} s",
+                 "", f"  {'cumulative [s]':>14}  module (imported first)"]
+        lines += [f"  {t.cumulative_us / 1e6:>14.3f}  {t.module}" for t in self.top_level()[:top]]
+        lines += ["", f"  {'self [s]':>14}  package"]
+        lines += [f"  {seconds:>14.3f}  {package}" for package, seconds in list(self.by_package().items())[:top]]
+        return "\n".join(lines)
+
+
+def parse_importtime(stderr: str) -> List[ImportTiming]:
+    """ Parse the 'import time: self [us] | cumulative | imported package' lines of -X importtime. """
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        timings.append(ImportTiming(name.strip(), int(self_us), int(cumulative_us), depth))
+    return timings
+
+
+def profile_imports(modules: Optional[List[str]] = None, python: str = sys.executable) -> StartupReport:
+    """ Import the modules in a fresh interpreter and return where the time went. """
+    modules = modules or APP_STARTUP_MODULES
+    statement = "; ".join(f"import {module}" for module in modules)
+    start = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            cwd=os.getcwd(), env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+
+    timings = parse_importtime(result.stderr)
+    import_time = sum(t.cumulative_us for t in timings if t.depth == 0) / 1e6
+    return StartupReport(modules, wall_time, import_time, timings)
+
+
+def main(argv: Optional[List[str]] = None) -> StartupReport:
+    parser = argparse.ArgumentParser(description="Import-time breakdown of the app cold start.")
+    parser.add_argument("modules", nargs="*", help="modules to profile, defaults to the app startup imports")
+    parser.add_argument("--top", type=int, default=15, help="number of modules and packages listed")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = profile_imports(args.modules or None)
+    print(report.format(args.top))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**asdict(report), "by_package": report.by_package()}, f, indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
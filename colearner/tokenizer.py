@@ -0,0 +1,89 @@
+"""
+Token counting for prompt and chunk budgets, with the OpenAI tokenizer when it is available offline.
+
+tiktoken downloads its encoding file on first use and caches it in TIKTOKEN_CACHE_DIR, which defaults here to
+DATA_DIR/cache/tiktoken so the file is kept with the data. Fetch it ahead of time (e.g. while building an image)
+for hosts without network access:
+
+    python -m colearner.tokenizer download
+"""
+
+import os
+import logging
+import argparse
+import threading
+from typing import List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+ESTIMATE = "estimate"                   # TOKENIZER_ENCODING that counts characters/4, without tiktoken
+
+_lock = threading.Lock()
+_encoding = None
+_loaded = False
+
+
+def get_tiktoken_cache_dir() -> str:
+    return os.getenv("TIKTOKEN_CACHE_DIR") or os.path.join(os.getenv("DATA_DIR", "data"), "cache", "tiktoken")
+
+
+def _load_encoding():
+    """ The tiktoken encoding named by TOKENIZER_ENCODING (cl100k_base by default), from the cache dir if it is there. """
+    import tiktoken
+
+    cache_dir = get_tiktoken_cache_dir()
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir                      # read by tiktoken, also in worker processes
+    return tiktoken.get_encoding(os.getenv("TOKENIZER_ENCODING", "cl100k_base"))
+
+
+def get_encoding():
+    """
+    tiktoken encoding of token counts, loaded once per process, or None if it cannot be loaded (no tiktoken,
+    or no network and no cached encoding file): token counts are then estimated as characters/4, with a warning.
+    Set TOKENIZER_STRICT=true to raise instead, so chunk sizes never silently change between hosts, or
+    TOKENIZER_ENCODING=estimate to always estimate, e.g. for benchmarks comparable across hosts.
+    """
+    global _encoding, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                try:
+                    _encoding = None if os.getenv("TOKENIZER_ENCODING") == ESTIMATE else _load_encoding()
+                except Exception as e:
+                    if os.getenv("TOKENIZER_STRICT", "false").lower() == "true":
+                        raise RuntimeError(f"Cannot load the tiktoken encoding into {get_tiktoken_cache_dir()}. "
+                                           "Run `python -m colearner.tokenizer download` on a host with network access.") from e
+                    logger.warning("tiktoken encoding not available (%s: %s), token counts are estimated as characters/4. "
+                                   "Run `python -m colearner.tokenizer download` to cache it in %s.",
+                                   type(e).__name__, e, get_tiktoken_cache_dir())
+                    _encoding = None
+                _loaded = True
+    return _encoding
+
+
+def reset_encoding() -> None:
+    """ Forget the loaded encoding, so the next count reads TOKENIZER_ENCODING again. """
+    global _encoding, _loaded
+    with _lock:
+        _encoding, _loaded = None, False
+
+
+def count_tokens(text: str) -> int:
+    """ Number of tokens of a text, or an estimate of one token per 4 characters without tiktoken. """
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cache the tiktoken encoding used for token counts.")
+    parser.add_argument("command", choices=["download"])
+    parser.parse_args(argv)
+    encoding = _load_encoding()
+    print(f"Encoding {encoding.name} cached in {get_tiktoken_cache_dir()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,11 @@ def load_unstructured_files(file_paths):
     loader = UnstructuredFileLoader(file_paths, mode="single")
     docs = loader.load()
     
-    return docs
\ No newline at end of file
+    return docs
+
+
+def load_unstructured_file(file_path: str):
+    """ Load one unstructured file into Langchain Documents, one per page, with a warm parser worker pool. """
+    from colearner.parse_worker import get_parser_pool
+    
+    return get_parser_pool().parse([file_path])
@@ -1,88 +1,133 @@
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterable, Iterator, List
+import os
 import sys
-import docker
+import time
 
 
-def run_unstructured_loader_in_container(tmp_file_name):
+WORKER_CONTAINER_NAME = "colearner_unstructured_worker"
+WORKER_PORT = 6000
+
+
+def start_unstructured_worker_container(port: int = WORKER_PORT):
     """
-    Run the UnstructuredFileLoader inside a Docker container built 
-        from official Unstructured docker with additional 'pip install unstructured' command.
+    Start one long-running parse server inside a Docker container built from the official Unstructured 
+        docker with additional 'pip install unstructured' command, or reuse it if it is already running.
+    The server keeps unstructured imported in its workers, so jobs do not pay the container start and 
+        model load cost again.
+    
+    Returns:
+        ParseClient connected to the container.
     """
+    import docker
+    from colearner.parse_worker import AUTHKEY_ENV, ParseClient, get_authkey
     
     client = docker.from_env()
+    authkey = get_authkey().decode()
     
-    container = client.containers.run(
-        "unstructured_installed:0.1",
-        command=f"python3 ./colearner/unstructured_loader_docker.py {tmp_file_name}",
-        volumes={
-            "d:/Work/CoLearner/": {
-                "bind": "/app",
-                "mode": "ro"
-            }
-        },
-        working_dir="/app",
-        stderr=True,
-        stdout=True,
-        detach=True
-    )
-    
-    container.wait()
-    
-    for line in container.logs(stream=True):
-        print(line.strip().decode())
-        
-    container.remove()
+    try:
+        container = client.containers.get(WORKER_CONTAINER_NAME)
+        if f"{AUTHKEY_ENV}={authkey}" not in (container.attrs["Config"].get("Env") or []):
+            container.remove(force=True)                        # started with another key, e.g. by an earlier app run
+            raise docker.errors.NotFound(WORKER_CONTAINER_NAME)
+        if container.status != "running":
+            container.start()
+    except docker.errors.NotFound:
+        container = client.containers.run(
+            "unstructured_installed:0.1",
+            # all interfaces of the container network, which is only published on the host's localhost below
+            command=f"python3 -m colearner.parse_worker --serve --host 0.0.0.0 --port {port}",
+            name=WORKER_CONTAINER_NAME,
+            volumes={
+                os.getenv("HOST_APP_DIR", "d:/Work/CoLearner/"): {
+                    "bind": "/app",
+                    "mode": "ro"
+                }
+            },
+            environment={AUTHKEY_ENV: authkey},
+            ports={f"{port}/tcp": ("127.0.0.1", port)},
+            working_dir="/app",
+            detach=True
+        )
     
+    for _ in range(60):                                          # wait for the server to accept connections
+        try:
+            return ParseClient(("localhost", port), authkey=authkey.encode())
+        except (ConnectionRefusedError, ConnectionResetError, EOFError):   # docker's proxy resets while starting
+            time.sleep(1)
+    raise RuntimeError(f"Unstructured worker container did not start: {container.logs(tail=20).decode()}")
+
+
+def run_unstructured_loader_in_container(tmp_file_name):
+    """
+    Parse the files listed in data/uploaded_files/tmp/<tmp_file_name> with the warm unstructured worker 
+        container and return them as Langchain Documents.
+    Paths are relative to the app folder, which is mounted to /app in the container.
+    """
     
-def aggregate_documents(docs: List[Document]) -> List[Document]:
+    with open('data/uploaded_files/tmp/' + tmp_file_name, 'r') as f:           #TODO: change how path is defined
+        filepaths = ['data/uploaded_files/'+line.replace('\n','') for line in f.readlines()]
+    
+    return start_unstructured_worker_container().parse(filepaths)
+    
+    
+def iter_aggregated_pages(elements: Iterable[Document]) -> Iterator[Document]:
     """
-    Aggregate document contents by filename and page number.
+    Aggregate a stream of unstructured elements into one Document per file and page.
+    
+    A page is yielded as soon as the first element of the next page (or file) arrives, so only the 
+    elements of the current page are held in memory.
     
     Args:   
-        docs: list of dictionaries, each dictionary contains the following keys:
-            - 'page_content': str
-            - 'metadata': dict, containing the following keys:
-                - 'filename': str,
-                - 'current_page_number': int
+        elements: Documents from UnstructuredFileLoader(..., mode='elements'), in file and page order, with metadata:
+                - 'filename': str
+                - 'page_number': int, missing for formats without pages
                 
-        list of dictionaries, each dictionary contains the following:
-            - 'page_content': str
-            - 'metadata': dict, containing the following keys:
-                - 'source': str, the file name of the document
-                - 'current_page_number': int
+    Yields:
+        Documents with metadata:
+            - 'source': str, the file name of the document
+            - 'page_number': int, if the element had one
     """
     
-    output = []
+    page_contents = []
+    page_key = None
+    
+    for element in elements:
+        key = (element.metadata.get('filename', element.metadata.get('source')), element.metadata.get('page_number'))
+        
+        # a new file or page starts: the elements collected so far make a complete page
+        if page_contents and key != page_key:
+            yield _page_document(page_contents, *page_key)
+            page_contents = []
+        
+        page_key = key
+        page_contents.append(element.page_content)
+    
+    if page_contents:                                                          # the last page
+        yield _page_document(page_contents, *page_key)
 
-    for i, doc in enumerate(docs):
-        current_file_name  = doc.metadata['filename']
-        current_page_number = doc.metadata['page_number']
-        if i == 0:
-            prev_file_name = current_file_name
-            prev_page_number = current_page_number
-            page_contents = [doc.page_content]
 
-        page_contents.append(doc.page_content) #BUG: first sentence of next page is appended to the last sentence of the previous page...
-        
-        # aggregate file content when a new file or page starts, or at the end of the list (for the last doc)
-        if current_page_number != prev_page_number or current_file_name != prev_file_name or i == len(docs)-1:
-            print(f"Aggregating file: {prev_file_name}, page: {prev_page_number}",'\n')
+def _page_document(page_contents: List[str], source: str, page_number) -> Document:
+    metadata = {'source': source}
+    if page_number is not None:                                                # vectorDB metadata can't be None
+        metadata['page_number'] = page_number
+    return Document(page_content=' '.join(page_contents), metadata=metadata)
 
-            # 1. append the aggregated doc to the output
-            aggregated_doc = Document(page_content=' '.join(page_contents), 
-                                        metadata={'source': prev_file_name, 'page_number': prev_page_number})
-            output.append(aggregated_doc)
-            
-            print(aggregated_doc,'\n')
-            
-            # 2. change the prev values to the new values and reset the page_contents
-            prev_file_name = current_file_name
-            prev_page_number = current_page_number
-            page_contents = []        
-            
-    return output
+
+def aggregate_documents(docs: List[Document]) -> List[Document]:
+    """ Aggregate document contents by filename and page number, see iter_aggregated_pages. """
+    return list(iter_aggregated_pages(docs))
+
+
+def iter_unstructured_pages(filepaths: List[str]) -> Iterator[Document]:
+    """ 
+    Load unstructured files one at a time and yield one Langchain Document per page, 
+    ready to be split and embedded without holding the whole batch in memory.
+    """
+    for filepath in filepaths:
+        loader = UnstructuredFileLoader(filepath, mode='elements')
+        yield from iter_aggregated_pages(loader.lazy_load())
 
 
 def load_unstructured_files(temp_file_name: str) -> List[Document]:
@@ -100,11 +145,7 @@ def load_unstructured_files(temp_file_name: str) -> List[Document]:
         filepaths = ['data/uploaded_files/'+line.replace('\n','') for line in f.readlines()]
     print("Accessing filepaths", filepaths)
     
-    loader = UnstructuredFileLoader(filepaths, mode='elements')
-    raw_docs = loader.load()
-    docs = aggregate_documents(raw_docs)
-        
-    return docs
+    return list(iter_unstructured_pages(filepaths))
     
     
     
@@ -2,15 +2,17 @@ import os
 import hashlib
 import time
 from functools import wraps
+from colearner.blob_store import atomic_write, hash_stream
+from colearner.metrics import span
 
 def runtime(func):
-    """Print the runtime of the decorated function."""
+    """Record the runtime of the decorated function as a metrics span named after it, and print it."""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        run_time = end_time - start_time
+        with span(func.__name__):
+            start_time = time.perf_counter()
+            result = func(*args, **kwargs)
+            run_time = time.perf_counter() - start_time
         print(f"{func.__name__} took {run_time:.4f} seconds to execute.")
         return result
     return wrapper
@@ -21,16 +23,21 @@ def create_folder(folder_path:str):
         os.makedirs(folder_path, exist_ok=True)
         
 def save_file(file, file_path: str):
-    """Save a file to the given path, given the file content if it does not exist."""
+    """Save a file to the given path, given the file content if it does not exist. The file is written atomically without copying its buffer."""
     if not os.path.exists(file_path):
-        with open(file_path, 'wb') as f:
-            f.write(file.getvalue())
+        atomic_write(file_path, file)
 
 def get_file_hash(file):
-    """Read the file content and create a hash.""" 
-    content = file.read()
-    file.seek(0)  # Reset file pointer to beginning
-    return hashlib.md5(content).hexdigest()
+    """Create a hash of the file content, streamed in chunks instead of read into memory at once.""" 
+    return hash_stream(file)
+
+def get_path_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash the content of the file at the given path, reading it in chunks."""
+    hasher = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
 def all_items_exist(list_a, list_b):
     """Return True if all items in list_a exist in list_b, otherwise False."""
@@ -0,0 +1,367 @@
+""" Website crawler loader: concurrent, polite fetching with conditional-GET caching, streaming pages as Documents. """
+
+import os
+import re
+import json
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+from html.parser import HTMLParser
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urldefrag, urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders.base import BaseLoader
+from colearner.metrics import span
+
+
+# ------------------------------------------------------------
+#                        HTML to text
+# ------------------------------------------------------------
+
+class HTMLTextExtractor(HTMLParser):
+    """ Visible text, title and links of an HTML page, with line breaks at block elements. """
+
+    SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe"}    # not head: </head> is optional
+    BLOCK_TAGS = {"p", "div", "section", "article", "header", "footer", "main", "aside", "nav", "br", "hr", "li", "ul", "ol",
+                  "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "dd", "dt", "figcaption"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.links: List[str] = []
+        self.title = ""
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in self.SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in self.SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        lines = (re.sub(r"[ \t\r\f\v]+", " ", line).strip() for line in "".join(self.parts).split("\n"))
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def html_to_text(html: str) -> Tuple[str, str, List[str]]:
+    """ Return (title, text, links) of an HTML page. """
+    extractor = HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.title.strip(), extractor.text(), extractor.links
+
+
+# ------------------------------------------------------------
+#                    Conditional-GET cache
+# ------------------------------------------------------------
+
+class HTTPCache:
+    """
+    Extracted pages on disk by URL, with the ETag and Last-Modified headers of the response, so a re-crawl
+    sends conditional GETs and a 304 Not Modified page is served from the cache without parsing it again.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        self.cache_dir = cache_dir or os.path.join(os.getenv("DATA_DIR", "data"), "cache", "web")
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url: str, entry: Dict) -> None:
+        path = self._path(url)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+# ------------------------------------------------------------
+#                           Crawler
+# ------------------------------------------------------------
+
+class _HostLimiter:
+    """ At most `concurrency` requests in flight per host, started at least `delay` seconds apart. """
+
+    def __init__(self, concurrency: int, delay: float) -> None:
+        self.concurrency = concurrency
+        self.delay = delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last_start: Dict[str, float] = {}
+
+    async def __call__(self, host: str):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.concurrency))
+        await semaphore.acquire()
+        if self.delay:
+            async with self._locks.setdefault(host, asyncio.Lock()):
+                wait = self._last_start.get(host, 0.0) + self.delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._last_start[host] = time.monotonic()
+        return semaphore
+
+
+class WebsiteLoader(BaseLoader):
+    """
+    Crawl a website from a start URL and yield one Document per HTML page as soon as it is fetched.
+
+    Args:
+        start_url: first page of the crawl
+        max_pages: maximum number of pages
+        max_depth: maximum number of links followed from the start page
+        same_host_only: only follow links to the host of the start URL
+        max_concurrency: requests in flight in total
+        per_host_concurrency: requests in flight per host
+        per_host_delay: minimum seconds between two requests to the same host
+        respect_robots: skip URLs disallowed by the robots.txt of their host
+        timeout: seconds per request
+        cache: conditional-GET cache, defaults to DATA_DIR/cache/web
+
+    Documents have metadata 'source' (URL), 'title' and 'changed' (False for pages answered with 304 Not Modified).
+    After a crawl, `stats` counts fetched, not modified, skipped and failed pages.
+    """
+
+    def __init__(self,
+                 start_url: str,
+                 max_pages: int = 100,
+                 max_depth: int = 2,
+                 same_host_only: bool = True,
+                 max_concurrency: int = 8,
+                 per_host_concurrency: int = 2,
+                 per_host_delay: float = 0.0,
+                 respect_robots: bool = True,
+                 timeout: float = 30,
+                 user_agent: str = "CoLearnerBot/0.1",
+                 cache: Optional[HTTPCache] = None) -> None:
+
+        if urlparse(start_url).scheme not in ("http", "https"):
+            raise ValueError("Start URL must be an http(s) URL")
+        self.start_url = urldefrag(start_url)[0]
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.same_host_only = same_host_only
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_delay = per_host_delay
+        self.respect_robots = respect_robots
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.cache = cache or HTTPCache()
+        self.stats = {}
+
+    def _accept(self, url: str) -> bool:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            return False
+        return not self.same_host_only or parsed.netloc == urlparse(self.start_url).netloc
+
+    async def _robots(self, session, url: str, robots: Dict[str, "asyncio.Task"]) -> bool:
+        """ True if robots.txt of the host allows the URL. robots.txt is fetched once per host. """
+        if not self.respect_robots:
+            return True
+        parsed = urlparse(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+
+        async def fetch_robots() -> Optional[RobotFileParser]:
+            try:
+                async with session.get(host + "/robots.txt") as response:
+                    if response.status == 200:
+                        parser = RobotFileParser()
+                        parser.parse((await response.text()).splitlines())
+                        return parser
+            except Exception:
+                pass
+            return None
+
+        if host not in robots:
+            robots[host] = asyncio.ensure_future(fetch_robots())
+        parser = await robots[host]
+        return parser is None or parser.can_fetch(self.user_agent, url)
+
+    async def _fetch(self, session, url: str, limiter: _HostLimiter) -> Optional[Dict]:
+        """ Fetch one page with a conditional GET. Returns the cache entry of the page, or None if it is not HTML. """
+        cached = self.cache.get(url)
+        semaphore = await limiter(urlparse(url).netloc)
+        try:
+            with span("web_fetch"):
+                async with session.get(url, headers=HTTPCache.conditional_headers(cached)) as response:
+                    if response.status == 304 and cached:
+                        self.stats["not_modified"] += 1
+                        return {**cached, "changed": False}
+                    response.raise_for_status()
+                    content_type = response.headers.get("Content-Type", "")
+                    if "html" not in content_type and "text/plain" not in content_type:
+                        self.stats["skipped"] += 1
+                        return None
+                    body = await response.text(errors="replace")
+                    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                    final_url = urldefrag(str(response.url))[0]
+        finally:
+            semaphore.release()
+
+        with span("parse", kind="html"):
+            if "html" in content_type:
+                title, text, links = html_to_text(body)
+            else:
+                title, text, links = "", body, []
+        entry = {"url": url, "final_url": final_url, "title": title, "text": text,
+                 "links": [urldefrag(urljoin(final_url, link))[0] for link in links],
+                 "etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        if etag or last_modified:
+            self.cache.put(url, entry)
+        self.stats["fetched"] += 1
+        return {**entry, "changed": True}
+
+    async def alazy_load(self) -> AsyncIterator[Document]:
+        """ Crawl breadth first with a bounded pool of fetch tasks, yielding pages in completion order. """
+        import aiohttp
+
+        self.stats = {"fetched": 0, "not_modified": 0, "skipped": 0, "failed": 0}
+        limiter = _HostLimiter(self.per_host_concurrency, self.per_host_delay)
+        robots: Dict[str, asyncio.Task] = {}
+        seen: Set[str] = {self.start_url}
+        frontier: asyncio.Queue = asyncio.Queue()
+        frontier.put_nowait((self.start_url, 0))
+        results: asyncio.Queue = asyncio.Queue()
+        scheduled = 1                                                    # pages queued, at most max_pages
+
+        async def worker(session):
+            nonlocal scheduled
+            while True:
+                url, depth = await frontier.get()
+                try:
+                    entry = await self._fetch(session, url, limiter) if await self._robots(session, url, robots) else None
+                    if entry is None:
+                        continue
+                    if depth < self.max_depth:
+                        for link in entry["links"]:
+                            if link not in seen and scheduled < self.max_pages and self._accept(link):
+                                seen.add(link)
+                                scheduled += 1
+                                frontier.put_nowait((link, depth + 1))
+                    await results.put(entry)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"Failed to fetch {url}: {type(e).__name__}: {e}")
+                finally:
+                    frontier.task_done()
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                         headers={"User-Agent": self.user_agent}) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(self.max_concurrency)]
+            done = asyncio.create_task(frontier.join())
+            try:
+                while True:
+                    get_result = asyncio.create_task(results.get())
+                    finished, _ = await asyncio.wait({get_result, done}, return_when=asyncio.FIRST_COMPLETED)
+                    if get_result in finished:
+                        entry = get_result.result()
+                        yield Document(page_content=entry["text"],
+                                       metadata={"source": entry["url"], "title": entry["title"], "changed": entry["changed"]})
+                        continue
+                    get_result.cancel()
+                    while not results.empty():                           # pages finished together with the last one
+                        entry = results.get_nowait()
+                        yield Document(page_content=entry["text"],
+                                       metadata={"source": entry["url"], "title": entry["title"], "changed": entry["changed"]})
+                    break
+            finally:
+                for task in workers + [done]:
+                    task.cancel()
+
+    def lazy_load(self) -> Iterator[Document]:
+        """
+        Stream pages from the async crawl, which runs in its own thread and event loop.
+        The crawl is cancelled when the caller stops iterating, e.g. when the ingestion job is cancelled.
+        """
+        pages: queue.Queue = queue.Queue(maxsize=2 * self.max_concurrency)
+        finished = object()
+        errors = []
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            """ Wait for room in the queue until the consumer stops. False if it stopped. """
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        async def produce():
+            crawl = self.alazy_load()
+            try:
+                async for doc in crawl:
+                    if not await asyncio.get_running_loop().run_in_executor(None, put, doc):    # back pressure without blocking the loop
+                        break
+            finally:
+                await crawl.aclose()                                      # cancels the fetch tasks
+
+        def run():
+            try:
+                asyncio.run(produce())
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                put(finished)
+
+        thread = threading.Thread(target=run, name="website-loader", daemon=True)
+        thread.start()
+        try:
+            while (doc := pages.get()) is not finished:
+                yield doc
+        finally:
+            stop.set()
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def load(self) -> List[Document]:
+        """ Crawl the website and return all pages. """
+        docs = list(self.lazy_load())
+        print(f"Crawled {self.start_url}: {self.stats}")
+        return docs
@@ -0,0 +1,17 @@
+import json
+from benchmarks import run
+
+
+def test_benchmarks_run_offline_and_write_json(tmp_path):
+    output = tmp_path / "bench.json"
+    run.main(["--sizes", "20", "--notion-depths", "1", "--repeat", "1", "--queries", "5", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    results = {result["benchmark"]: result for result in report["results"]}
+    assert report["meta"]["tokenizer"] == "estimate"
+    assert set(results) == set(run.BENCHMARKS)
+    assert results["notion_load"]["documents"] == 4                      # root page and its 3 child pages
+    assert results["ingest"]["embedded_chunks"] == results["ingest"]["chunks"]
+    assert results["ingest"]["reembedded_chunks"] == 0
+    assert results["retrieval"]["recall"] == 1.0                          # every fact is in one chunk and has rare key words
+    assert {"rephrase", "retrieve", "generate"} <= set(results["qa_chain"]["stages"])
@@ -0,0 +1,55 @@
+import io
+import hashlib
+import os
+from colearner.blob_store import BlobStore, hash_stream
+
+
+class Unbuffered_File(io.RawIOBase):
+    """ File object without getbuffer, read in chunks. """
+
+    def __init__(self, content):
+        self._file = io.BytesIO(content)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+
+content = b"chapter one " * 1000
+
+
+def test_hash_stream_matches_md5_and_rewinds():
+    file = io.BytesIO(content)
+    file.read(10)
+
+    assert hash_stream(file, chunk_size=100) == hashlib.md5(content).hexdigest()
+    assert file.tell() == 0
+    assert hash_stream(Unbuffered_File(content), chunk_size=100) == hashlib.md5(content).hexdigest()
+
+
+def test_same_content_under_two_names_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    hash_a, path_a = store.put(io.BytesIO(content), "notes.pdf")
+    hash_b, path_b = store.put(io.BytesIO(content), "copy of notes.pdf")
+
+    assert hash_a == hash_b and path_a == path_b
+    assert os.listdir(tmp_path / "blobs") == [hash_a + ".pdf"]
+    assert store.read_index() == {"notes.pdf": hash_a, "copy of notes.pdf": hash_a}
+
+
+def test_same_name_with_new_content_does_not_overwrite(tmp_path):
+    store = BlobStore(str(tmp_path))
+    _, old_path = store.put(io.BytesIO(b"version 1"), "notes.txt")
+    _, new_path = store.put(Unbuffered_File(b"version 2"), "notes.txt")
+
+    assert old_path != new_path
+    assert open(old_path, "rb").read() == b"version 1"
+    assert open(new_path, "rb").read() == b"version 2"
+    assert store.get_path("notes.txt") == new_path
+    assert store.get_path("missing.txt") is None
+    assert not [f for f in os.listdir(tmp_path / "blobs") if f.startswith(".tmp")]
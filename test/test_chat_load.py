@@ -0,0 +1,14 @@
+from benchmarks import chat_load
+from benchmarks.openai_stub import StubConfig
+
+
+def test_chat_load_runs_concurrent_sessions_against_the_stub():
+    config = StubConfig(first_token_latency=0.0, tokens_per_second=0, answer_tokens=5, embedding_latency=0.0)
+    report = chat_load.run([1, 3], turns=2, stub_config=config, num_pages=5)
+
+    single, concurrent = report["levels"]
+    assert (single["turns"], concurrent["turns"]) == (2, 6)
+    assert concurrent["errors"] == 0
+    assert concurrent["ttft"]["p50"] <= concurrent["latency"]["p50"]
+    assert concurrent["tokens_per_second"] > 0
+    assert {"rephrase", "retrieve", "generate"} <= set(concurrent["stages"])
@@ -0,0 +1,93 @@
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pytest
+from colearner.chunk_diff import diff_chunks, get_chunk_ids, get_source_key, sync_document_chunks
+from colearner.dedup import NearDuplicateIndex
+
+
+class Counting_Embeddings(DeterministicFakeEmbedding):
+    """ Fake embeddings that count how many texts were embedded. """
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+
+def make_vectordb(collection_name):
+    embedding_function = Counting_Embeddings(size=8)
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name=collection_name,
+                      embedding_function=embedding_function)
+    return vectordb, embedding_function
+
+
+def pages(*texts):
+    return [Document(page_content=text, metadata={"source": "book.pdf", "page": i}) for i, text in enumerate(texts)]
+
+
+def test_chunk_ids_depend_on_content_not_position():
+    key = get_source_key("book.pdf")
+    ids, _ = get_chunk_ids(key, pages("a", "b"))
+    shifted_ids, _ = get_chunk_ids(key, pages("new", "a", "b"))
+
+    assert shifted_ids[1:] == ids
+    assert all(i.startswith(key + "-") for i in ids)
+
+
+def test_identical_chunks_share_an_id():
+    ids, chunks = get_chunk_ids(get_source_key("book.pdf"), pages("header", "body", "header"))
+    assert len(ids) == 2
+    assert [c.page_content for c in chunks] == ["header", "body"]
+
+
+def test_diff_chunks():
+    diff = diff_chunks(["a", "b", "c"], ["b", "d", "c"])
+    assert diff.added == ["d"]
+    assert diff.removed == ["a"]
+    assert diff.unchanged == ["b", "c"]
+
+
+def test_sync_embeds_only_changed_chunks():
+    vectordb, embedding_function = make_vectordb("sync")
+
+    sync_document_chunks(vectordb, "book.pdf", pages("intro", "chapter 1", "chapter 2"))
+    assert embedding_function.calls == 3
+
+    diff = sync_document_chunks(vectordb, "book.pdf", pages("new preface", "intro", "chapter 1 edited", "chapter 2"))
+    assert embedding_function.calls == 5
+    assert len(diff.added) == 2 and len(diff.removed) == 1 and len(diff.unchanged) == 2
+
+    stored = vectordb.get(where={"doc_id": get_source_key("book.pdf")})
+    assert sorted(stored["documents"]) == ["chapter 1 edited", "chapter 2", "intro", "new preface"]
+    assert {m["page"] for m in stored["metadatas"] if m} == {0, 1, 2, 3}           # moved chunks get new page numbers
+
+
+def test_sync_leaves_other_documents_alone():
+    vectordb, _ = make_vectordb("other")
+    sync_document_chunks(vectordb, "a.pdf", pages("shared text"))
+    sync_document_chunks(vectordb, "b.pdf", pages("shared text"))
+    sync_document_chunks(vectordb, "a.pdf", pages("replaced"))
+
+    assert vectordb.get(where={"doc_id": get_source_key("b.pdf")})["documents"] == ["shared text"]
+
+
+class Failing_Embeddings(DeterministicFakeEmbedding):
+    def embed_documents(self, texts):
+        raise RuntimeError("embedding service unavailable")
+
+
+def test_failed_sync_does_not_leave_unstored_chunks_in_dedup_index():
+    failing_vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="failed",
+                              embedding_function=Failing_Embeddings(size=8))
+    index = NearDuplicateIndex()
+    text = "a paragraph long enough to be shingled and compared with other chunks"
+
+    with pytest.raises(RuntimeError):
+        sync_document_chunks(failing_vectordb, "a.pdf", pages(text), dedup_index=index)
+    assert len(index) == 0
+
+    vectordb, _ = make_vectordb("failed")
+    sync_document_chunks(vectordb, "b.pdf", pages(text), dedup_index=index)
+    assert vectordb.get(where={"doc_id": get_source_key("b.pdf")})["documents"] == [text]
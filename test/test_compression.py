@@ -0,0 +1,95 @@
+import pytest
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_community.chat_message_histories import ChatMessageHistory
+from benchmarks.fakes import HashingEmbeddings
+from colearner.chatbot import Context_with_History_Chatbot
+from colearner.compression import EmbeddingContextCompressor, _sentence_cache, split_sentences
+from colearner.metrics import registry
+from colearner.rate_limit import RateLimitedEmbeddings, RateLimiter
+from colearner.tokenizer import count_tokens
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+FILLER = "Unrelated filler words about weather and cooking recipes."
+DOCS = [
+    Document(page_content=f"{FILLER} Chroma stores the note embeddings on disk. {FILLER} Notes are split into chunks.",
+             metadata={"source": "a.pdf"}),
+    Document(page_content=f"{FILLER} {FILLER} Nothing relevant here.", metadata={"source": "b.pdf"}),
+    Document(page_content="Chroma stores the note embeddings on disk. The embeddings come from OpenAI.",
+             metadata={"source": "c.pdf"}),
+]
+
+
+def test_split_sentences():
+    assert split_sentences("One. Two? Three!\nFour\n\n") == ["One.", "Two?", "Three!", "Four"]
+
+
+def test_keeps_relevant_sentences_in_order_within_budget():
+    compressor = EmbeddingContextCompressor(embeddings=HashingEmbeddings(), token_budget=25)
+    compressed = compressor.compress_documents(DOCS, "Where are the note embeddings stored by Chroma?")
+    text = " ".join(doc.page_content for doc in compressed)
+
+    assert sum(count_tokens(doc.page_content) for doc in compressed) <= 25
+    assert text.count("Chroma stores the note embeddings on disk.") == 1              # deduplicated across documents
+    assert "weather" not in text
+    assert [doc.metadata["source"] for doc in compressed][0] == "a.pdf"
+    assert registry.counters[("context_tokens_saved", "")] > 0
+
+
+def test_documents_within_budget_are_not_embedded():
+    embeddings = HashingEmbeddings()
+    compressor = EmbeddingContextCompressor(embeddings=embeddings, token_budget=10000)
+    assert compressor.compress_documents(DOCS, "anything") == DOCS
+    assert embeddings.calls == 0
+
+
+def test_sentence_embeddings_are_cached():
+    embeddings = HashingEmbeddings()
+    compressor = EmbeddingContextCompressor(embeddings=embeddings, token_budget=10)
+    compressor.compress_documents(DOCS, "embeddings")
+    calls = embeddings.calls
+    compressor.compress_documents(DOCS, "disk")
+    assert embeddings.calls == calls
+
+
+def test_sentence_embeddings_are_shared_across_compressors_and_bounded():
+    embeddings = HashingEmbeddings()
+    EmbeddingContextCompressor(embeddings=embeddings, token_budget=10).compress_documents(DOCS, "embeddings")
+    calls = embeddings.calls
+    EmbeddingContextCompressor(embeddings=embeddings, token_budget=10).compress_documents(DOCS, "disk")   # a Streamlit rerun
+    assert embeddings.calls == calls
+
+    EmbeddingContextCompressor(embeddings=embeddings, token_budget=10, cache_size=2).compress_documents(DOCS, "disk")
+    assert len(_sentence_cache(embeddings)[0]) == 2
+
+
+def test_sentences_are_embedded_ahead_of_background_ingestion():
+    limiter = RateLimiter()
+    compressor = EmbeddingContextCompressor(embeddings=RateLimitedEmbeddings(HashingEmbeddings(), limiter=limiter),
+                                            token_budget=10)
+    compressor.compress_documents(DOCS, "embeddings")
+    assert "embed_query" in limiter.report() and "embed_documents" not in limiter.report()
+
+
+def test_qa_chain_answers_from_compressed_context():
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="compression_chain",
+                      embedding_function=HashingEmbeddings())
+    vectordb.add_documents(DOCS)
+    chatbot = Context_with_History_Chatbot(llm=FakeListChatModel(responses=["the answer"]), msgs=ChatMessageHistory(),
+                                           context_token_budget=20)
+    chain = chatbot.get_qa_chain(vectordb.as_retriever(search_kwargs={"k": 3}))
+    result = chain.invoke({"input": "Where does Chroma store the note embeddings?"},
+                          config={"configurable": {"session_id": "any"}})
+
+    assert sum(count_tokens(doc.page_content) for doc in result["context"]) <= 20
+    assert registry.summary()["retrieve"]["count"] == 1
+    assert registry.summary()["compress"]["count"] == 1
@@ -0,0 +1,56 @@
+from langchain_core.documents import Document
+from colearner.dedup import NearDuplicateIndex
+
+
+text = ("Gradient descent updates the parameters in the opposite direction of the gradient "
+        "of the loss function, scaled by the learning rate. ") * 3
+near_duplicate = text.replace("scaled by", "multiplied by", 1)
+different = "Notion templates can be duplicated to create a weekly review page with a checklist of goals."
+
+
+def test_signature_is_stable_between_instances():
+    assert (NearDuplicateIndex().signature(text) == NearDuplicateIndex().signature(text)).all()
+
+
+def test_near_duplicate_is_found():
+    index = NearDuplicateIndex()
+    index.add("a-0", text)
+
+    assert index.find_duplicate(near_duplicate) == "a-0"
+    assert index.find_duplicate(different) is None
+
+
+def test_filter_documents_drops_duplicates_in_batch_and_index():
+    index = NearDuplicateIndex()
+    index.add("a-0", text)
+
+    ids = ["b-0", "b-1", "b-2"]
+    docs = [Document(page_content=near_duplicate), Document(page_content=different), Document(page_content=different)]
+    kept_ids, kept_docs, report = index.filter_documents(ids, docs)
+
+    assert kept_ids == ["b-1"]
+    assert kept_docs[0].page_content == different
+    assert report.duplicates == {"b-0": "a-0", "b-2": "b-1"}
+    assert report.embedding_calls_saved == 2
+    assert report.storage_saved(embedding_size=4) == len(near_duplicate) + len(different) + 2 * 16
+
+
+def test_remove_returns_orphaned_duplicates():
+    index = NearDuplicateIndex()
+    index.filter_documents(["a-0", "b-0"], [Document(page_content=text), Document(page_content=near_duplicate)])
+
+    assert index.remove(["a-0"]) == ["b-0"]
+    assert len(index) == 0
+    assert index.find_duplicate(text) is None
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "dedup" / "collection.json")
+    index = NearDuplicateIndex(path=path)
+    index.filter_documents(["a-0", "b-0"], [Document(page_content=text), Document(page_content=near_duplicate)])
+    index.save()
+
+    loaded = NearDuplicateIndex(path=path)
+    assert len(loaded) == 1
+    assert loaded.links == {"b-0": "a-0"}
+    assert loaded.find_duplicate(near_duplicate) == "a-0"
@@ -0,0 +1,76 @@
+import pytest
+import numpy as np
+from colearner import embeddings
+from colearner.embeddings import LocalCPUEmbeddings, get_embedding_function, get_collection_name
+
+
+class Stub_Local_Embeddings(LocalCPUEmbeddings):
+    """ Local embeddings with a stub encoder that records the batches it receives. """
+
+    def __init__(self, model_path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        self.batches = []
+
+    def _encode_batch(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts])
+
+
+def test_fake_provider_is_deterministic(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODEL", "fake")
+    embedding_function = get_embedding_function()
+
+    assert embedding_function.embed_query("hello") == embedding_function.embed_query("hello")
+    assert embedding_function.embed_query("hello") != embedding_function.embed_query("world")
+    assert get_collection_name() == "collection_fake_fake-256"
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        get_embedding_function("does_not_exist")
+
+
+def test_openai_keeps_original_collection_name():
+    assert get_collection_name("openai") == "collection_name"
+
+
+def test_collection_name_depends_on_the_model(monkeypatch, tmp_path):
+    monkeypatch.setenv("OLLAMA_EMBEDDING_MODEL", "mxbai-embed-large:latest")
+    monkeypatch.setenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+    monkeypatch.setenv("EMBEDDING_MODEL_PATH", str(tmp_path / ("all-MiniLM-L6-v2" * 5)))
+
+    assert get_collection_name("ollama") == "collection_ollama_mxbai-embed-large_latest"
+    assert get_collection_name("openai") == "collection_openai_text-embedding-3-small"
+    assert len(get_collection_name("sentence_transformer")) == 63                    # chroma's limit
+    monkeypatch.setenv("EMBEDDING_MODEL_PATH", str(tmp_path / "all-mpnet-base-v2"))
+    assert get_collection_name("sentence_transformer") == "collection_sentence_transformer_all-mpnet-base-v2"
+
+
+def test_local_embeddings_requires_existing_path():
+    with pytest.raises(ValueError):
+        LocalCPUEmbeddings(model_path="/path/does/not/exist")
+
+
+def test_local_embeddings_quantize_requires_onnx(tmp_path):
+    with pytest.raises(ValueError):
+        LocalCPUEmbeddings(model_path=str(tmp_path), quantize=True)
+
+
+def test_local_embeddings_batches_in_input_order(tmp_path):
+    model = Stub_Local_Embeddings(str(tmp_path), batch_size=2)
+    texts = ["ccc", "a", "bbbb", "dd", "eeeee"]
+    vectors = model.embed_documents(texts)
+
+    assert [vector[0] for vector in vectors] == [len(text) for text in texts]
+    assert [len(batch) for batch in model.batches] == [2, 2, 1]
+    assert model.batches[0] == ["a", "dd"]                          # batches are length sorted
+    assert model.embed_query("xyz") == [3.0, 1.0]
+
+
+def test_provider_is_built_once(monkeypatch):
+    calls = []
+    monkeypatch.setitem(embeddings.EMBEDDING_PROVIDERS, "counting", lambda: calls.append(1) or object())
+    monkeypatch.setattr(embeddings, "_embedding_functions", {})
+
+    assert get_embedding_function("counting") is get_embedding_function("counting")
+    assert len(calls) == 1
@@ -0,0 +1,163 @@
+import subprocess
+
+import pytest
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+from colearner.chunk_diff import get_source_key, sync_document_chunks
+from colearner.dedup import NearDuplicateIndex
+from colearner.git_loader import GitLoader, GitSyncState, is_vendor_path, split_code_documents, sync_repository
+from colearner.jobs import DONE, QUEUED, IngestionQueue
+
+
+class Counting_Embeddings(DeterministicFakeEmbedding):
+    """ Fake embeddings that count how many texts were embedded. """
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+
+def git(repo, *args):
+    subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True)
+
+
+def commit(repo, files, message="change"):
+    for path, content in files.items():
+        target = repo / path
+        if content is None:
+            target.unlink()
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content if isinstance(content, bytes) else content.encode())
+    git(repo, "add", "-A")
+    git(repo, "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", message)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "project"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    commit(repo, {
+        "main.py": "def main():\n    return 1\n",
+        "README.md": "# Project\n\nNotes.\n",
+        "node_modules/lib/index.js": "module.exports = 1\n",
+        "logo.png": b"\x89PNG\r\n\x1a\n\0\0",
+        "data.dat": b"abc\0def",
+        "package-lock.json": "{}",
+    })
+    return repo
+
+
+def test_vendor_paths():
+    assert is_vendor_path("node_modules/a/b.js") and is_vendor_path("web/vendor/x.go") and is_vendor_path("app.min.js")
+    assert not is_vendor_path("src/vendors.py")
+
+
+def test_first_sync_loads_text_files_only(repo, tmp_path):
+    loader = GitLoader(str(repo), state=GitSyncState(str(tmp_path / "state.json")))
+    changes = loader.changes()
+    docs = [change.document for change in loader.iter_changes(changes)]
+
+    assert changes.base is None
+    assert sorted(doc.metadata["source"] for doc in docs) == ["README.md", "main.py"]
+    assert {doc.metadata["language"] for doc in docs} == {"python", "markdown"}
+    assert set(changes.skipped) == {"node_modules/lib/index.js", "logo.png", "data.dat", "package-lock.json"}
+
+
+def test_sync_reads_only_changed_files(repo, tmp_path):
+    state = GitSyncState(str(tmp_path / "state.json"))
+    loader = GitLoader(str(repo), state=state)
+    loader.mark_synced(loader.head())
+    assert loader.load() == []
+
+    commit(repo, {"main.py": "def main():\n    return 2\n", "README.md": None, "src/util.py": "X = 1\n"})
+    changes = loader.changes()
+    events = {change.path: change for change in loader.iter_changes(changes)}
+
+    assert sorted(events) == ["README.md", "main.py", "src/util.py"]
+    assert events["README.md"].deleted
+    assert events["main.py"].document.page_content.endswith("return 2\n")
+    assert events["src/util.py"].document.metadata["commit"] == changes.head
+
+
+def test_unknown_last_commit_falls_back_to_full_load(repo, tmp_path):
+    loader = GitLoader(str(repo), state=GitSyncState(str(tmp_path / "state.json")))
+    loader.mark_synced("0" * 40)
+    assert sorted(doc.metadata["source"] for doc in loader.load()) == ["README.md", "main.py"]
+
+
+def test_split_code_documents_keeps_functions_together():
+    code = "".join(f"def function_{i}():\n    return {i}\n\n" for i in range(40))
+    chunks = split_code_documents([Document(page_content=code, metadata={"language": "python"})], chunk_size=100,
+                                  chunk_overlap=0)
+    assert all(chunk.page_content.startswith("def function_") for chunk in chunks)
+
+
+def test_sync_repository_embeds_changes_and_deletes_removed_files(repo, tmp_path):
+    embeddings = Counting_Embeddings(size=8)
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="git_sync", embedding_function=embeddings)
+    state = GitSyncState(str(tmp_path / "state.json"))
+
+    sync_repository(str(repo), vectordb, state=state)
+    first_calls = embeddings.calls
+    assert first_calls == 2
+
+    commit(repo, {"README.md": None, "main.py": "def main():\n    return 3\n"})
+    changes = sync_repository(str(repo), vectordb, state=state)
+    readme_key = get_source_key(GitLoader(str(repo)).source_id("README.md"))
+
+    assert embeddings.calls - first_calls == 1
+    assert vectordb.get(where={"doc_id": readme_key})["ids"] == []
+    assert state.get(str(repo)) == changes.head
+    assert sync_repository(str(repo), vectordb, state=state).modified == []
+
+
+def test_file_that_becomes_binary_loses_its_chunks(repo, tmp_path):
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="git_binary",
+                      embedding_function=DeterministicFakeEmbedding(size=8))
+    state = GitSyncState(str(tmp_path / "state.json"))
+    sync_repository(str(repo), vectordb, state=state)
+
+    commit(repo, {"main.py": b"\0compiled"})
+    changes = sync_repository(str(repo), vectordb, state=state)
+    main_key = get_source_key(GitLoader(str(repo)).source_id("main.py"))
+
+    assert "main.py" in changes.skipped
+    assert vectordb.get(where={"doc_id": main_key})["ids"] == []
+
+
+def test_sync_repository_with_a_language_without_separators(repo, tmp_path):
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="git_c",
+                      embedding_function=DeterministicFakeEmbedding(size=8))
+    commit(repo, {"a.c": "int main(void) {\n    return 0;\n}\n", "run.pl": "print 1;\n"})
+    state = GitSyncState(str(tmp_path / "state.json"))
+
+    changes = sync_repository(str(repo), vectordb, state=state)
+    sources = {m["source"] for m in vectordb.get()["metadatas"]}
+
+    assert {"a.c", "run.pl"} <= sources
+    assert state.get(str(repo)) == changes.head
+
+
+def test_removed_file_queues_the_documents_deduplicated_against_it(repo, tmp_path):
+    text = "Notes about the project, long enough to be shingled and compared with the chunks of other documents."
+    commit(repo, {"NOTES.md": text})
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="git_orphans",
+                      embedding_function=DeterministicFakeEmbedding(size=8))
+    index, state = NearDuplicateIndex(), GitSyncState(str(tmp_path / "state.json"))
+    sync_repository(str(repo), vectordb, dedup_index=index, state=state)
+
+    queue = IngestionQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("file", "copy.pdf", "copy.pdf", {"file_path": "copy.pdf"})
+    queue._update(job_id, state=DONE)
+    sync_document_chunks(vectordb, "copy.pdf", [Document(page_content=text, metadata={"source": "copy.pdf"})], index)
+    assert vectordb.get(where={"doc_id": get_source_key("copy.pdf")})["ids"] == []      # dropped as a duplicate
+
+    commit(repo, {"NOTES.md": None})
+    sync_repository(str(repo), vectordb, dedup_index=index, state=state, queue=queue)
+
+    assert [job.source_id for job in queue.list_jobs(states=[QUEUED])] == ["copy.pdf"]
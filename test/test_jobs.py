@@ -0,0 +1,130 @@
+import time
+import threading
+from functools import partial
+import chromadb
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from colearner.chunk_diff import get_source_key
+from colearner.jobs import CANCELLED, DONE, FAILED, RUNNING, IngestionQueue, ingest_document
+from test.test_pdf_loader import write_pdf
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.sqlite")
+
+
+def test_job_reports_progress_and_finishes(db_path):
+    def handler(job, context):
+        context.progress(0.5, f"halfway through {job.payload['n']}")
+
+    queue = IngestionQueue(db_path, handler=handler).start()
+    job = queue.wait(queue.submit("file", "a.pdf", "a.pdf", {"n": 1}))
+    queue.stop()
+
+    assert job.state == DONE and job.progress == 1.0
+
+
+def test_active_job_of_the_same_document_is_reused(db_path):
+    queue = IngestionQueue(db_path)                             # not started, jobs stay queued
+    assert queue.submit("file", "a.pdf", "a.pdf") == queue.submit("file", "a.pdf", "a.pdf")
+    assert queue.submit("file", "b.pdf", "b.pdf") != queue.submit("file", "a.pdf", "a.pdf")
+
+
+def test_new_version_is_queued_behind_the_active_job(db_path):
+    started, release, order = threading.Event(), threading.Event(), []
+
+    def handler(job, context):
+        order.append(job.payload["file_hash"])
+        started.set()
+        release.wait(5)
+
+    queue = IngestionQueue(db_path, handler=handler, num_workers=2)
+    first = queue.submit("file", "a.pdf", "a.pdf", {"file_hash": "v1"})
+    queue.start()
+    started.wait(5)
+    second = queue.submit("file", "a.pdf", "a.pdf", {"file_hash": "v2"})
+
+    assert second != first
+    assert queue.submit("file", "a.pdf", "a.pdf", {"file_hash": "v2"}) == second
+    time.sleep(0.2)
+    assert queue.get(second).state == "queued"                 # not ingested next to the older version
+    release.set()
+    assert queue.wait(second).state == DONE
+    queue.stop()
+    assert order == ["v1", "v2"]
+
+
+def test_cancel_queued_and_running_jobs(db_path):
+    started = threading.Event()
+
+    def handler(job, context):
+        started.set()
+        while True:
+            context.progress(0.1, "working")
+
+    queue = IngestionQueue(db_path, handler=handler, num_workers=1)
+    running_id = queue.submit("file", "a.pdf", "a.pdf")
+    queued_id = queue.submit("file", "b.pdf", "b.pdf")
+    queue.start()
+    started.wait(5)
+
+    queue.cancel(queued_id)
+    assert queue.get(queued_id).state == CANCELLED
+    queue.cancel(running_id)
+    assert queue.wait(running_id).state == CANCELLED
+    queue.stop()
+
+
+def test_failed_job_records_error(db_path):
+    def handler(job, context):
+        raise ValueError("cannot parse")
+
+    queue = IngestionQueue(db_path, handler=handler).start()
+    job = queue.wait(queue.submit("file", "a.pdf", "a.pdf"))
+    queue.stop()
+
+    assert job.state == FAILED and job.error == "ValueError: cannot parse"
+
+
+def test_interrupted_jobs_are_resumed(db_path):
+    queue = IngestionQueue(db_path)
+    job_id = queue.submit("file", "a.pdf", "a.pdf")
+    queue._update(job_id, state=RUNNING)                        # the app stopped while the job was running
+
+    done = []
+    restarted = IngestionQueue(db_path, handler=lambda job, context: done.append(job.id)).start()
+    assert restarted.wait(job_id).state == DONE
+    restarted.stop()
+    assert done == [job_id]
+
+
+def test_orphaned_duplicates_queue_their_document_again(db_path):
+    queue = IngestionQueue(db_path)
+    job_id = queue.submit("file", "b.pdf", "b.pdf", {"file_path": "b.pdf"})
+    queue._update(job_id, state=DONE)
+
+    job_ids = queue.resync_orphans([get_source_key("b.pdf") + "-0123", "unknown-0123"])
+
+    assert len(job_ids) == 1 and job_ids[0] != job_id
+    resync = queue.get(job_ids[0])
+    assert (resync.source_id, resync.payload, resync.state) == ("b.pdf", {"file_path": "b.pdf"}, "queued")
+
+
+def test_ingest_document_commits_chunks(tmp_path, monkeypatch, db_path):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    vectordb = Chroma(client=chromadb.EphemeralClient(), collection_name="jobs",
+                      embedding_function=DeterministicFakeEmbedding(size=8))
+    pdf_path = tmp_path / "book.pdf"
+    write_pdf(pdf_path, ["First page", "Second page"])
+
+    queue = IngestionQueue(db_path, handler=partial(ingest_document, vectordb=vectordb)).start()
+    job = queue.wait(queue.submit("file", "book.pdf", "book.pdf", {"file_path": str(pdf_path), "file_hash": "abc"}))
+    queue.stop()
+
+    assert job.state == DONE, job.error
+    stored = vectordb.get()
+    assert sorted(d.strip() for d in stored["documents"]) == ["First page", "Second page"]
+    assert {m["source"] for m in stored["metadatas"]} == {"book.pdf"}
+    assert {m["doc_hash"] for m in stored["metadatas"]} == {"abc"}
@@ -0,0 +1,86 @@
+import json
+import urllib.request
+import pytest
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.language_models import FakeListChatModel
+from langchain_community.chat_message_histories import ChatMessageHistory
+from colearner.metrics import Histogram, span, registry, start_metrics_server
+from colearner.chatbot import Context_with_History_Chatbot
+
+
+class Static_Retriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [Document(page_content="CoLearner stores notes in Chroma.")]
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    registry.reset()
+    yield
+    registry.set_jsonl_path(None)
+    registry.reset()
+
+
+def test_histogram_quantiles_are_within_bucket_bounds():
+    histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+    for value in [0.05] * 90 + [5.0] * 10:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert 0.0 <= histogram.quantile(0.5) <= 0.1
+    assert 1.0 <= histogram.quantile(0.95) <= 10.0
+
+
+def test_nested_spans_are_exported_with_their_path(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    registry.set_jsonl_path(str(path))
+
+    with span("ingest"):
+        with span("embed", chunks=3):
+            pass
+    with pytest.raises(ValueError):
+        with span("insert"):
+            raise ValueError()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["name"], r["path"]) for r in records] == [("embed", "ingest/embed"), ("ingest", "ingest"), ("insert", "insert")]
+    assert records[0]["chunks"] == 3 and records[0]["duration"] >= 0
+    assert records[2]["error"] == "ValueError"
+    assert registry.histogram("embed").count == 1
+
+
+def test_prometheus_endpoint_serves_stage_histograms():
+    with span("split"):
+        pass
+    server = start_metrics_server(0)                                      # localhost by default
+    body = urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics").read().decode()
+
+    assert '# TYPE colearner_stage_duration_seconds histogram' in body
+    assert 'colearner_stage_duration_seconds_bucket{stage="split",le="+Inf"} 1' in body
+    assert 'colearner_stage_duration_seconds_count{stage="split"} 1' in body
+
+
+def test_prometheus_label_values_are_escaped():
+    registry.observe('chat "ask"\nnow', 0.1)
+    registry.increment("calls", stage="C:\\tmp")
+    body = registry.render_prometheus()
+
+    assert 'colearner_stage_duration_seconds_count{stage="chat \\"ask\\"\\nnow"} 1' in body
+    assert 'colearner_calls{stage="C:\\\\tmp"} 1.0' in body
+    assert all(line.startswith(("#", "colearner_")) for line in body.strip().split("\n"))
+
+
+def test_qa_chain_records_rephrase_retrieve_and_generate():
+    history = ChatMessageHistory()
+    history.add_user_message("What is CoLearner?")
+    history.add_ai_message("A study assistant.")
+    chatbot = Context_with_History_Chatbot(llm=FakeListChatModel(responses=["standalone question", "the answer"]), msgs=history)
+
+    chain = chatbot.get_qa_chain(Static_Retriever())
+    list(chain.stream({"input": "Where does it store notes?"}, config={"configurable": {"session_id": "any"}}))
+
+    summary = registry.summary()
+    for stage in ["rephrase", "retrieve", "generate", "first_token"]:
+        assert summary[stage]["count"] == 1, stage
+    assert "llm" not in summary
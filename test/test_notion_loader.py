@@ -1,6 +1,9 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import pytest
 from unittest.mock import Mock, patch
-from colearner.notion_loader import NotionLoader  # Adjust the import path as necessary
+from colearner.notion_loader import NotionLoader, PageMetadataCache  # Adjust the import path as necessary
 
 @pytest.fixture
 def notion_loader():
@@ -187,3 +190,109 @@ def test_recursive_text_search_with_write_to_file(setup_mocks):
     assert mock_append_new_data_to_file_notion.called
     assert mock_append_new_data_to_file_notion.call_count == 4
 
+
+
+############ Test cases for the page metadata cache ############
+
+page_url = "https://www.notion.so/Study-notes-0123456789abcdef0123456789abcdef?pvs=4"
+page_id = "0123456789abcdef0123456789abcdef"
+
+
+class Notion_Pages_Stub(BaseHTTPRequestHandler):
+    """ Notion API stub answering GET /pages/<id>, counting the requests. """
+    requests = []
+    status = 200
+    last_edited_time = "2024-07-01T10:00:00.000Z"
+
+    def do_GET(self):
+        Notion_Pages_Stub.requests.append(self.path)
+        body = json.dumps({"last_edited_time": Notion_Pages_Stub.last_edited_time,
+                           "properties": {"Name": {"type": "title", "title": [{"plain_text": "Study notes"}]}}})
+        self.send_response(Notion_Pages_Stub.status)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def notion_stub(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Notion_Pages_Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("NOTION_API_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    Notion_Pages_Stub.requests, Notion_Pages_Stub.status = [], 200
+    Notion_Pages_Stub.last_edited_time = "2024-07-01T10:00:00.000Z"
+    yield Notion_Pages_Stub
+    server.shutdown()
+
+
+def test_page_name_is_fetched_once_and_persisted(notion_stub, tmp_path):
+    cache_path = str(tmp_path / "notion_pages.json")
+    loaders = [NotionLoader(page_url=page_url, metadata_cache=PageMetadataCache(cache_path)) for _ in range(3)]
+
+    assert [loader.page_name for loader in loaders] == ["Study notes"] * 3
+    assert notion_stub.requests == [f"/pages/{page_id}"]
+
+
+def test_expired_entry_is_refreshed(notion_stub, tmp_path):
+    cache = PageMetadataCache(str(tmp_path / "notion_pages.json"), ttl=0)
+    NotionLoader(page_url=page_url, metadata_cache=cache)
+    NotionLoader(page_url=page_url, metadata_cache=cache)
+
+    assert len(notion_stub.requests) == 2
+
+
+def test_unretrievable_page_name_is_stable_and_not_refetched(notion_stub, tmp_path):
+    notion_stub.status = 404
+    cache = PageMetadataCache(str(tmp_path / "notion_pages.json"))
+    names = {NotionLoader(page_url=page_url, metadata_cache=cache).page_name for _ in range(3)}
+
+    assert names == {"NotionPage__id_" + page_id}
+    assert len(notion_stub.requests) == 1
+
+
+def test_failed_refresh_keeps_the_last_known_name(notion_stub, tmp_path):
+    cache = PageMetadataCache(str(tmp_path / "notion_pages.json"), ttl=0)
+    NotionLoader(page_url=page_url, metadata_cache=cache)
+    notion_stub.status = 500
+
+    assert NotionLoader(page_url=page_url, metadata_cache=cache).page_name == "Study notes"
+
+
+def test_unreachable_api_keeps_the_name_and_is_not_retried_on_every_rerun(tmp_path, monkeypatch):
+    monkeypatch.setenv("NOTION_API_BASE_URL", "http://127.0.0.1:1")          # nothing listens on port 1
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    cache = PageMetadataCache(str(tmp_path / "notion_pages.json"))
+    cache.put(page_id, "Study notes")
+    cache.entries[page_id]["fetched_at"] = 0                                  # expired
+
+    assert NotionLoader(page_url=page_url, metadata_cache=cache).page_name == "Study notes"
+    assert cache.is_fresh(cache.get(page_id))
+
+    other_cache = PageMetadataCache(str(tmp_path / "other.json"))
+    assert NotionLoader(page_url=page_url, metadata_cache=other_cache).page_name == "NotionPage__id_" + page_id
+    assert other_cache.is_fresh(other_cache.get(page_id))
+
+
+def test_page_tree_not_edited_since_its_ingestion_is_unchanged(notion_stub, tmp_path):
+    cache = PageMetadataCache(str(tmp_path / "notion_pages.json"))
+    loader = NotionLoader(page_url=page_url, save_path=str(tmp_path), metadata_cache=cache)
+    child_page = {'type': 'child_page', 'id': 'child_page_id', 'child_page': {'title': 'Chapter'},
+                  'has_children': False, 'last_edited_time': "2024-07-01T10:00:00.000Z"}
+    assert loader.last_edited_time == "2024-07-01T10:00:00.000Z"
+    assert loader.changed_since_ingestion()                                   # never ingested
+
+    with patch.object(NotionLoader, '_get_block', return_value={'results': [child_page]}):
+        loader.load()
+    loader.mark_ingested()
+
+    loader = NotionLoader(page_url=page_url, save_path=str(tmp_path), metadata_cache=PageMetadataCache(cache.path))
+    assert not loader.changed_since_ingestion()
+    assert notion_stub.requests[-2:] == [f"/pages/{page_id}", "/pages/child_page_id"]
+
+    notion_stub.last_edited_time = "2024-07-02T08:00:00.000Z"                  # e.g. the child page is edited
+    assert loader.changed_since_ingestion()
+    notion_stub.last_edited_time, notion_stub.status = "2024-07-01T10:00:00.000Z", 500
+    assert loader.changed_since_ingestion()                                   # edit times that cannot be fetched
@@ -0,0 +1,85 @@
+import threading
+import pytest
+from colearner import parse_worker
+from colearner.parse_worker import AUTHKEY_ENV, ParseClient, ParserPool, ParseServer, get_authkey, get_parser_pool
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"note_{i}.txt"
+        path.write_text(f"content of note {i}")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture(autouse=True)
+def authkey(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+
+
+@pytest.fixture
+def stub_pool():
+    with ParserPool("stub", max_workers=2) as pool:
+        yield pool
+
+
+def test_unknown_parser():
+    with pytest.raises(ValueError):
+        ParserPool("does_not_exist")
+
+
+def test_concurrent_jobs_share_one_pool(monkeypatch, files):
+    monkeypatch.setattr(parse_worker, "_pools", {})
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(get_parser_pool("stub"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(pool) for pool in pools}) == 1
+    with pools[0]:
+        assert pools[0].parse(files[:1])[0].page_content == "content of note 0"
+
+
+def test_pool_parses_files_in_order(stub_pool, files):
+    docs = stub_pool.parse(files)
+
+    assert [doc.page_content for doc in docs] == [f"content of note {i}" for i in range(3)]
+    assert [doc.metadata["source"] for doc in docs] == files
+
+
+def test_server_returns_documents_to_client(stub_pool, files):
+    server = ParseServer(("localhost", 0), pool=stub_pool)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = ParseClient(server.address)
+    try:
+        assert [doc.page_content for doc in client.parse(files[:2])] == ["content of note 0", "content of note 1"]
+        assert client.parse(files[2:])[0].metadata["source"] == files[2]          # connection is reused
+
+        with pytest.raises(RuntimeError, match="FileNotFoundError"):
+            client.parse([files[0] + ".missing"])
+    finally:
+        client.close()
+        server.listener.close()
+
+
+def test_authkey_is_generated_once_per_process():
+    key = get_authkey()
+
+    assert len(key) == 64
+    assert get_authkey() == key
+
+
+def test_authkey_rejects_missing_and_public_keys(monkeypatch):
+    with pytest.raises(ValueError, match="not set"):
+        get_authkey(generate=False)
+
+    monkeypatch.setenv(AUTHKEY_ENV, "colearner")
+    with pytest.raises(ValueError, match="secret"):
+        get_authkey()
+    with pytest.raises(ValueError):
+        ParseServer(("localhost", 0), authkey=b"colearner", pool=object())
@@ -0,0 +1,70 @@
+import pytest
+from colearner import pdf_loader
+from colearner.pdf_loader import PageCache, iter_pdf_pages, _page_ranges
+
+
+def write_pdf(path, page_texts):
+    """ Write a minimal PDF with one line of text per page. """
+    n = len(page_texts)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(n)), n),
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, text in enumerate(page_texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    path.write_bytes(out.encode("latin-1"))
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "book.pdf"
+    write_pdf(path, [f"Page number {i}" for i in range(7)])
+    return str(path)
+
+
+def test_page_ranges():
+    assert _page_ranges([0, 1, 2, 3, 4], 2) == [(0, 2), (2, 4), (4, 5)]
+    assert _page_ranges([1, 2, 5], 8) == [(1, 3), (5, 6)]
+
+
+def test_pages_are_streamed_in_order_from_worker_processes(pdf_path, tmp_path):
+    cache = PageCache(str(tmp_path / "cache"))
+    docs = list(iter_pdf_pages(pdf_path, max_workers=2, pages_per_task=2, cache=cache))
+
+    assert [doc.metadata for doc in docs] == [{"source": pdf_path, "page": i} for i in range(7)]
+    assert [doc.page_content.strip() for doc in docs] == [f"Page number {i}" for i in range(7)]
+
+
+def test_cached_pages_are_not_parsed_again(pdf_path, tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path / "cache"))
+    first = list(iter_pdf_pages(pdf_path, max_workers=1, cache=cache))
+
+    def fail(*args):
+        raise AssertionError("page was parsed again")
+    monkeypatch.setattr(pdf_loader, "_extract_page_range", fail)
+
+    assert list(iter_pdf_pages(pdf_path, max_workers=1, cache=cache)) == first
+
+
+def test_cached_pages_are_read_as_they_are_yielded(pdf_path, tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path / "cache"))
+    list(iter_pdf_pages(pdf_path, max_workers=1, cache=cache))
+
+    reads = []
+    original_get = cache.get
+    monkeypatch.setattr(cache, "get", lambda *args: reads.append(args) or original_get(*args))
+
+    pages = iter_pdf_pages(pdf_path, max_workers=1, cache=cache)
+    assert next(pages).metadata["page"] == 0
+    assert len(reads) == 1
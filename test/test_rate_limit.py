@@ -0,0 +1,173 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.openai_stub import StubConfig, start_openai_stub
+from colearner.metrics import registry
+from colearner.rate_limit import CHAT, EMBEDDING, EMBEDDING_QUERY, RateLimitedEmbeddings, RateLimiter, rate_limited_chat_openai
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+class Batch_Counting_Embeddings(HashingEmbeddings):
+    """ Hashing embeddings that record the size of every embed_documents call, answered after `latency` seconds. """
+
+    def __init__(self, latency=0.0):
+        super().__init__(size=64)
+        self.batches = []
+        self.latency = latency
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+
+class Too_Many_Requests(Exception):
+    status_code = 429
+
+    class response:
+        headers = {"retry-after": "0.05"}
+
+
+def test_chat_is_served_before_waiting_embeddings():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, background_headroom=0)
+    limiter.requests.level = 0                                        # next request in 0.1s
+    order = []
+
+    def acquire(priority, name):
+        limiter.acquire(priority=priority, caller=name)
+        order.append(name)
+
+    threads = [threading.Thread(target=acquire, args=(EMBEDDING, f"embed{i}")) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.02)
+    threads.append(threading.Thread(target=acquire, args=(CHAT, "chat")))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+
+    assert order[0] == "chat"
+    assert limiter.report()["embed0"]["throttle_seconds"] > 0
+
+
+def test_background_requests_leave_headroom_for_chat():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60000, background_headroom=0.5)
+    limiter.tokens.level = 30500
+
+    limiter.acquire(tokens=400, priority=EMBEDDING)
+    assert limiter._wait_time(1, 400, EMBEDDING) > 0
+    assert limiter._wait_time(1, 400, CHAT) == 0
+
+
+def test_rate_limited_calls_are_retried_after_a_pause():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=0, background_headroom=0)
+    attempts = []
+
+    def call():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise Too_Many_Requests()
+        return "ok"
+
+    assert limiter.call(call, caller="embed_documents") == "ok"
+    assert attempts[1] - attempts[0] >= 0.04
+    assert limiter.report()["embed_documents"]["rate_limited"] == 1
+    assert limiter.report()["embed_documents"]["requests"] == 1
+
+
+def test_async_calls_are_retried_after_a_pause():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=0, background_headroom=0)
+    attempts = []
+
+    async def call():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise Too_Many_Requests()
+        return "ok"
+
+    async def stream():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 3:
+            raise Too_Many_Requests()
+        for chunk in ("a", "b"):
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in limiter.astream(stream)]
+
+    assert asyncio.run(limiter.acall(call, caller="chat")) == "ok"
+    assert asyncio.run(collect()) == ["a", "b"]
+    assert attempts[1] - attempts[0] >= 0.04
+    assert limiter.report()["chat"]["rate_limited"] == 2
+    assert limiter.report()["chat"]["requests"] == 2
+
+
+def test_lone_query_is_not_held_for_coalescing():
+    embeddings = RateLimitedEmbeddings(Batch_Counting_Embeddings(), limiter=RateLimiter(), coalesce_wait=1.0)
+    start = time.perf_counter()
+    embeddings.embed_query("question")
+    assert time.perf_counter() - start < 0.5
+
+
+def test_embed_documents_with_query_priority():
+    limiter = RateLimiter()
+    embeddings = RateLimitedEmbeddings(Batch_Counting_Embeddings(), limiter=limiter)
+    embeddings.embed_documents(["sentence one", "sentence two"], priority=EMBEDDING_QUERY)
+    assert set(limiter.report()) == {"embed_query"}
+
+
+def test_large_inputs_are_limited_and_retried_per_batch():
+    class Rate_Limited_Once(Batch_Counting_Embeddings):
+        chunk_size = 2
+
+        def embed_documents(self, texts):
+            if len(self.batches) == 1 and not hasattr(self, "failed"):
+                self.failed = True
+                raise Too_Many_Requests()
+            return super().embed_documents(texts)
+
+    base = Rate_Limited_Once()
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=60000, background_headroom=0)
+    texts = [f"text number {i}" for i in range(5)]
+
+    assert RateLimitedEmbeddings(base, limiter=limiter).embed_documents(texts) == base.embed_documents(texts)[:5]
+    assert base.batches[:3] == [2, 2, 1]                               # the failed batch alone was sent again
+    assert limiter.report()["embed_documents"]["requests"] == 3
+
+
+def test_concurrent_queries_are_coalesced():
+    base = Batch_Counting_Embeddings(latency=0.05)
+    embeddings = RateLimitedEmbeddings(base, limiter=RateLimiter(), coalesce_wait=0.05)
+    texts = [f"question {i}" for i in range(8)]
+    results = {}
+
+    threads = [threading.Thread(target=lambda t=t: results.__setitem__(t, embeddings.embed_query(t))) for t in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(base.batches) < len(texts) and sum(base.batches) == len(texts)
+    assert all(results[text] == base.embed_query(text) for text in texts)
+    assert embeddings.embed_documents(["a", "b"]) == base.embed_documents(["a", "b"])
+
+
+def test_chat_model_goes_through_the_limiter():
+    server = start_openai_stub(StubConfig(first_token_latency=0, tokens_per_second=0, answer_tokens=5))
+    try:
+        limiter = RateLimiter()
+        llm = rate_limited_chat_openai(limiter=limiter, model="gpt-3.5-turbo", base_url=server.base_url, api_key="stub")
+        assert "".join(chunk.content for chunk in llm.stream("hello")).split() == [f"token{i}" for i in range(5)]
+        assert llm.invoke("hello").content
+        assert limiter.report()["chat"]["requests"] == 2
+    finally:
+        server.shutdown()
@@ -0,0 +1,87 @@
+import zipfile
+import pytest
+from colearner.dedup import NearDuplicateIndex
+from colearner.chunk_diff import sync_document_chunks
+from colearner.snapshot import SnapshotError, export_snapshot, import_snapshot, read_manifest
+from test.test_chunk_diff import make_vectordb, pages
+
+
+@pytest.fixture(autouse=True)
+def fake_provider(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODEL", "fake")
+
+
+def test_snapshot_round_trip_without_embedding_calls(tmp_path):
+    source, _ = make_vectordb("snapshot_source")
+    sync_document_chunks(source, "book.pdf", pages(*[f"page {i} of the book" for i in range(7)]))
+    sync_document_chunks(source, "notes.txt", pages("some notes"))
+    path = str(tmp_path / "kb.zip")
+
+    manifest = export_snapshot(source, path, part_size=3)
+    target, embedding_function = make_vectordb("snapshot_target")
+    import_snapshot(target, path)
+    import_snapshot(target, path)                                     # idempotent
+
+    assert manifest["chunks"] == 8 and len(manifest["parts"]) == 3 and manifest["embedding_size"] == 8
+    assert sorted((d["source"], d["chunks"]) for d in manifest["documents"]) == [("book.pdf", 1), ("book.pdf", 7)]
+    assert embedding_function.calls == 0
+    stored = source.get(include=["documents", "metadatas", "embeddings"])
+    restored = target.get(ids=stored["ids"], include=["documents", "metadatas", "embeddings"])
+    assert restored["documents"] == stored["documents"] and restored["metadatas"] == stored["metadatas"]
+    assert [list(e) for e in restored["embeddings"]] == [list(e) for e in stored["embeddings"]]
+
+
+def test_corrupted_part_is_rejected(tmp_path):
+    source, _ = make_vectordb("snapshot_corrupted")
+    sync_document_chunks(source, "book.pdf", pages("first page", "second page"))
+    path, broken_path = str(tmp_path / "kb.zip"), str(tmp_path / "broken.zip")
+    export_snapshot(source, path)
+
+    with zipfile.ZipFile(path) as archive, zipfile.ZipFile(broken_path, "w") as broken:
+        for item in archive.infolist():
+            data = archive.read(item)
+            broken.writestr(item, data.replace(b"first page", b"first PAGE") if item.filename.endswith(".jsonl") else data)
+
+    target, _ = make_vectordb("snapshot_corrupted_target")
+    with pytest.raises(SnapshotError, match="Checksum"):
+        import_snapshot(target, broken_path)
+
+
+def test_other_embedding_provider_is_rejected(tmp_path, monkeypatch):
+    source, _ = make_vectordb("snapshot_provider")
+    sync_document_chunks(source, "book.pdf", pages("a page"))
+    path = str(tmp_path / "kb.zip")
+    export_snapshot(source, path)
+    monkeypatch.setenv("EMBEDDING_MODEL", "openai")
+
+    with pytest.raises(SnapshotError, match="fake"):
+        import_snapshot(make_vectordb("snapshot_provider_target")[0], path)
+    assert read_manifest(path)["embedding_provider"] == "fake"
+
+
+def test_other_embedding_model_of_the_same_provider_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.delenv("EMBEDDING_SIZE", raising=False)
+    source, _ = make_vectordb("snapshot_model")
+    sync_document_chunks(source, "book.pdf", pages("a page"))
+    path = str(tmp_path / "kb.zip")
+    export_snapshot(source, path)
+    monkeypatch.setenv("EMBEDDING_SIZE", "512")
+
+    with pytest.raises(SnapshotError, match="fake-256"):
+        import_snapshot(make_vectordb("snapshot_model_target")[0], path)      # empty target, no vector size to compare
+    assert read_manifest(path)["embedding_model"] == "fake-256"
+
+
+def test_dedup_index_is_restored(tmp_path):
+    source, _ = make_vectordb("snapshot_dedup")
+    index = NearDuplicateIndex(path=str(tmp_path / "source.json"))
+    text = "a long paragraph that appears in two documents " * 5
+    sync_document_chunks(source, "a.txt", pages(text), dedup_index=index)
+    path = str(tmp_path / "kb.zip")
+    export_snapshot(source, path, dedup_index=index)
+
+    restored_index = NearDuplicateIndex(path=str(tmp_path / "target.json"))
+    import_snapshot(make_vectordb("snapshot_dedup_target")[0], path, dedup_index=restored_index)
+
+    assert len(restored_index) == 1
+    assert restored_index.find_duplicate(text) is not None
@@ -0,0 +1,74 @@
+from langchain_core.documents import Document
+from colearner.splitter import StructureAwareSplitter, chunk_size_stats, parse_blocks
+from colearner.tokenizer import count_tokens
+
+
+MARKDOWN = """# Guide
+
+Intro paragraph.
+
+## Install
+
+- first step
+- second step
+
+```
+pip install colearner
+```
+
+## Usage
+
+Run the app.
+"""
+
+
+def test_parse_blocks():
+    kinds = [(block.kind, block.level) for block in parse_blocks(MARKDOWN)]
+    assert kinds == [("heading", 1), ("paragraph", 0), ("heading", 2), ("list", 0), ("list", 0), ("code", 0),
+                     ("heading", 2), ("paragraph", 0)]
+
+
+def test_headings_start_chunks_and_set_sections():
+    chunks = StructureAwareSplitter(chunk_size=200, chunk_overlap=0).split_documents(
+        [Document(page_content=MARKDOWN, metadata={"source": "guide.md"})])
+
+    assert [chunk.metadata.get("section") for chunk in chunks] == ["Guide", "Guide > Install", "Guide > Usage"]
+    assert chunks[1].page_content == "## Install\n- first step\n- second step\n\n```\npip install colearner\n```"
+    assert all(chunk.metadata["source"] == "guide.md" for chunk in chunks)
+
+
+def test_chunks_fit_the_token_budget_with_overlap():
+    text = " ".join(f"Sentence number {i} talks about topic {i % 7}." for i in range(300))
+    splitter = StructureAwareSplitter(chunk_size=50, chunk_overlap=12)
+    chunks = splitter.split_documents([Document(page_content=text, metadata={"page": 3})])
+
+    assert len(chunks) > 10
+    assert all(chunk.metadata["tokens"] == count_tokens(chunk.page_content) for chunk in chunks)
+    assert max(count_tokens(chunk.page_content) for chunk in chunks) <= 50
+    assert chunks[1].page_content.split(". ")[0] in chunks[0].page_content                # overlapping sentence
+    assert all(chunk.metadata["page"] == 3 for chunk in chunks)
+
+
+def test_long_words_and_page_breaks():
+    splitter = StructureAwareSplitter(chunk_size=20, chunk_overlap=0)
+    chunks = splitter.split_text("x" * 500 + "\fsecond page")
+    assert max(tokens for _, tokens, _ in chunks) <= 20
+    assert chunks[-1][0] == "second page"
+
+
+def test_parallel_split_matches_serial_split():
+    docs = [Document(page_content=f"# Page {i}\n\n" + "Some text here. " * 200, metadata={"page": i}) for i in range(12)]
+    serial = StructureAwareSplitter(chunk_size=64, chunk_overlap=8, max_workers=1).split_documents(docs)
+    parallel = StructureAwareSplitter(chunk_size=64, chunk_overlap=8, max_workers=3, parallel_threshold=0).split_documents(docs)
+
+    assert [(c.page_content, c.metadata) for c in parallel] == [(c.page_content, c.metadata) for c in serial]
+    stats = chunk_size_stats(parallel)
+    assert stats["chunks"] == len(serial) and stats["tokens_max"] <= 64 and stats["tokens_min"] <= stats["tokens_p50"]
+
+
+def test_streamed_split_matches_split_documents():
+    docs = [Document(page_content=f"# Page {i}\n\n" + "Some text here. " * 50, metadata={"page": i}) for i in range(6)]
+    splitter = StructureAwareSplitter(chunk_size=64, chunk_overlap=8, max_workers=1, parallel_threshold=2000)
+    streamed = list(splitter.iter_split_documents(iter(docs)))
+
+    assert [(c.page_content, c.metadata) for c in streamed] == [(c.page_content, c.metadata) for c in splitter.split_documents(docs)]
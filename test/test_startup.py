@@ -0,0 +1,40 @@
+import sys
+import subprocess
+import colearner
+from colearner.startup import parse_importtime, profile_imports, APP_STARTUP_MODULES
+
+
+importtime_output = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        420 | io
+import time:        50 |         50 |     json.decoder
+import time:       200 |        250 |   json
+import time:       100 |        350 | colearner
+"""
+
+
+def test_parse_importtime_keeps_nesting():
+    timings = parse_importtime(importtime_output)
+
+    assert [(t.module, t.depth) for t in timings] == [("_io", 1), ("io", 0), ("json.decoder", 2), ("json", 1), ("colearner", 0)]
+    assert timings[1].cumulative_us == 420 and timings[1].self_us == 300
+
+
+def test_app_startup_modules_do_not_import_langchain_or_chromadb():
+    statement = "; ".join(f"import {module}" for module in APP_STARTUP_MODULES)
+    check = "import sys; print(sorted(m for m in ('langchain', 'langchain_core', 'chromadb', 'numpy') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", f"{statement}; {check}"], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_submodules_are_loaded_on_attribute_access():
+    assert colearner.chunk_diff.get_source_key("a") == colearner.chunk_diff.get_source_key("a")
+    assert "rag" in dir(colearner)
+
+
+def test_profile_imports_reports_requested_modules():
+    report = profile_imports(["colearner.metrics"])
+
+    assert "colearner.metrics" in [t.module for t in report.top_level()]
+    assert report.wall_time_s > 0 and "colearner" in report.by_package()
@@ -0,0 +1,44 @@
+import logging
+
+import pytest
+from colearner import tokenizer
+
+
+@pytest.fixture
+def unavailable_encoding(monkeypatch):
+    def load():
+        raise OSError("no network")
+
+    monkeypatch.setattr(tokenizer, "_load_encoding", load)
+    monkeypatch.setattr(tokenizer, "_encoding", None)
+    monkeypatch.setattr(tokenizer, "_loaded", False)
+
+
+def test_missing_encoding_is_estimated_with_a_warning(unavailable_encoding, caplog):
+    with caplog.at_level(logging.WARNING, logger="colearner.tokenizer"):
+        assert tokenizer.count_tokens("12345678") == 2
+    assert "characters/4" in caplog.text
+
+
+def test_strict_mode_fails_without_the_encoding(unavailable_encoding, monkeypatch):
+    monkeypatch.setenv("TOKENIZER_STRICT", "true")
+    with pytest.raises(RuntimeError, match="colearner.tokenizer download"):
+        tokenizer.get_encoding()
+
+
+def test_encoding_is_cached_under_the_data_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    assert tokenizer.get_tiktoken_cache_dir() == str(tmp_path / "cache" / "tiktoken")
+
+
+def test_estimate_mode_does_not_load_tiktoken(monkeypatch, caplog):
+    monkeypatch.setenv("TOKENIZER_ENCODING", tokenizer.ESTIMATE)
+    monkeypatch.setattr(tokenizer, "_load_encoding", lambda: pytest.fail("tiktoken loaded"))
+    tokenizer.reset_encoding()
+    try:
+        with caplog.at_level(logging.WARNING, logger="colearner.tokenizer"):
+            assert tokenizer.count_tokens("12345678") == 2
+        assert caplog.text == ""
+    finally:
+        tokenizer.reset_encoding()
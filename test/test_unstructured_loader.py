@@ -0,0 +1,45 @@
+from langchain_core.documents import Document
+from colearner.unstructured_loader_docker import aggregate_documents, iter_aggregated_pages
+
+
+def element(text, filename, page_number):
+    return Document(page_content=text, metadata={"filename": filename, "page_number": page_number})
+
+
+elements = [
+    element("Title", "a.pdf", 1),
+    element("First sentence of page 1.", "a.pdf", 1),
+    element("First sentence of page 2.", "a.pdf", 2),
+    element("Only page of b.", "b.pdf", 1),
+]
+
+
+def test_elements_are_aggregated_per_file_and_page():
+    docs = aggregate_documents(elements)
+
+    assert [doc.page_content for doc in docs] == ["Title First sentence of page 1.",
+                                                  "First sentence of page 2.",
+                                                  "Only page of b."]
+    assert [doc.metadata for doc in docs] == [{"source": "a.pdf", "page_number": 1},
+                                              {"source": "a.pdf", "page_number": 2},
+                                              {"source": "b.pdf", "page_number": 1}]
+
+
+def test_pages_are_yielded_at_the_page_boundary():
+    consumed = []
+
+    def stream():
+        for e in elements:
+            consumed.append(e)
+            yield e
+
+    pages = iter_aggregated_pages(stream())
+    assert next(pages).metadata["page_number"] == 1
+    assert len(consumed) == 3                       # only the first element of page 2 was read
+
+
+def test_empty_and_unpaginated_input():
+    assert aggregate_documents([]) == []
+
+    docs = aggregate_documents([Document(page_content="text", metadata={"source": "notes.txt"})])
+    assert docs[0].metadata == {"source": "notes.txt"}
@@ -0,0 +1,128 @@
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from colearner.website_loader import HTTPCache, WebsiteLoader, html_to_text
+
+
+class Site:
+    """ Pages served by the local fixture, with ETags and counters of full and 304 responses. """
+
+    def __init__(self, pages, latency=0.0):
+        self.pages = dict(pages)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.full, self.not_modified = [], []
+        self.in_flight = self.max_in_flight = 0
+
+
+@pytest.fixture
+def site():
+    site = Site({
+        "/": '<html><head><title>Home</title><script>var x = "hidden";</script></head>'
+             '<body><h1>Welcome</h1><p>Start here.</p><a href="/a">A</a> <a href="/b#top">B</a>'
+             '<a href="https://elsewhere.example/">out</a><a href="mailto:x@y.z">mail</a></body></html>',
+        "/a": '<html><body><p>Page A text.</p><a href="/c">C</a><a href="/">home</a></body></html>',
+        "/b": '<html><body><style>p {color: red}</style><p>Page B text.</p></body></html>',
+        "/c": '<html><body><p>Page C text.</p><a href="/private/d">D</a></body></html>',
+        "/private/d": '<html><body><p>Private.</p></body></html>',
+        "/robots.txt": "User-agent: *\nDisallow: /private/\n",
+    }, latency=0.05)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with site.lock:
+                site.in_flight += 1
+                site.max_in_flight = max(site.max_in_flight, site.in_flight)
+            try:
+                time.sleep(site.latency)
+                body = site.pages.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    site.not_modified.append(self.path)
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                site.full.append(self.path)
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain" if self.path.endswith(".txt") else "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            finally:
+                with site.lock:
+                    site.in_flight -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    yield site
+    server.shutdown()
+
+
+def test_html_to_text():
+    title, text, links = html_to_text('<title> T </title><script>skip()</script><div>one<br>two</div><a href="x">link</a>')
+    assert title == "T"
+    assert text == "one\ntwo\nlink"
+    assert links == ["x"]
+
+
+def test_html_to_text_without_closing_head():
+    title, text, _ = html_to_text('<html><head><title>T</title><meta charset="utf-8"><style>p {}</style>'
+                                  '<body><p>Body text.</p></body></html>')
+    assert (title, text) == ("T", "Body text.")
+
+
+def test_crawl_follows_same_host_links_and_respects_robots(site, tmp_path):
+    loader = WebsiteLoader(site.url, per_host_concurrency=1, cache=HTTPCache(str(tmp_path)))
+    docs = {doc.metadata["source"]: doc for doc in loader.lazy_load()}
+
+    assert set(docs) == {site.url, site.url + "a", site.url + "b", site.url + "c"}
+    assert docs[site.url].metadata["title"] == "Home"
+    assert "Welcome" in docs[site.url].page_content and "hidden" not in docs[site.url].page_content
+    assert "color" not in docs[site.url + "b"].page_content
+    assert all(doc.metadata["changed"] for doc in docs.values())
+    assert "/private/d" not in site.full
+    assert site.max_in_flight == 1
+
+
+def test_max_depth_and_max_pages(site, tmp_path):
+    assert len(WebsiteLoader(site.url, max_depth=0, cache=HTTPCache(str(tmp_path))).load()) == 1
+    assert len(WebsiteLoader(site.url, max_pages=2, cache=HTTPCache(str(tmp_path))).load()) == 2
+
+
+def test_recrawl_uses_conditional_gets(site, tmp_path):
+    first = WebsiteLoader(site.url, cache=HTTPCache(str(tmp_path))).load()
+    site.full.clear()
+    site.pages["/b"] = "<html><body><p>Page B changed.</p></body></html>"
+
+    loader = WebsiteLoader(site.url, cache=HTTPCache(str(tmp_path)))
+    second = {doc.metadata["source"]: doc for doc in loader.load()}
+
+    assert sorted(site.full) == ["/b", "/robots.txt"]
+    assert sorted(site.not_modified) == ["/", "/a", "/c"]
+    assert loader.stats == {"fetched": 1, "not_modified": 3, "skipped": 0, "failed": 0}
+    assert second[site.url + "b"].metadata["changed"] and "changed" in second[site.url + "b"].page_content
+    assert {doc.metadata["source"]: doc.page_content for doc in first if doc.metadata["source"] != site.url + "b"} == \
+           {url: doc.page_content for url, doc in second.items() if not doc.metadata["changed"]}
+
+
+def test_crawl_stops_when_the_consumer_stops(site, tmp_path):
+    pages = WebsiteLoader(site.url, max_concurrency=1, cache=HTTPCache(str(tmp_path))).lazy_load()
+    next(pages)
+    pages.close()
+
+    deadline = time.monotonic() + 5
+    while any(t.name == "website-loader" for t in threading.enumerate()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not any(t.name == "website-loader" for t in threading.enumerate())